@@ -0,0 +1,67 @@
+"""
+Benchmark of parsing delays with the vectorized `delay_parts` + `delay_sec_from_parts`
+against mapping `delay_sec` over every row in Python.
+
+Run from the root of the repository with e.g.
+    python benchmarks/bench_delay.py 10000 1000000 10000000
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "silver"))
+
+import polars as pl
+from utils.format import delay_sec, delay_parts, delay_sec_from_parts
+
+DEFAULT_SIZES = [10_000, 1_000_000, 10_000_000]
+
+
+def generate_delays(n: int, seed: int = 0) -> pl.DataFrame:
+    rng = random.Random(seed)
+    # Generate a pool of distinct values and sample from it to keep generation fast.
+    pool = [
+        f"{rng.choice(['', '-'])}P0Y0M0DT0H{rng.randint(0, 59)}M{rng.randint(0, 59):02d}.000S"
+        for _ in range(10_000)
+    ]
+    return pl.DataFrame({"delay": pool}).sample(n, with_replacement=True, seed=seed)
+
+
+def python_map(df: pl.DataFrame) -> pl.Series:
+    return df.select(
+        pl.struct("delay").map_batches(
+            lambda x: pl.Series(map(delay_sec, x.struct.field("delay"))),
+            return_dtype=pl.Int64,
+        )
+    )["delay"]
+
+
+def vectorized(df: pl.DataFrame) -> pl.Series:
+    return (
+        df.with_columns(delay_parts("delay").alias("parts"))
+        .select(delay_sec_from_parts(pl.col("parts")).alias("delay"))
+        .get_column("delay")
+    )
+
+
+def timed(f, df: pl.DataFrame) -> tuple[float, pl.Series]:
+    start = time.perf_counter()
+    result = f(df)
+    return time.perf_counter() - start, result
+
+
+if __name__ == "__main__":
+    sizes = [int(n) for n in sys.argv[1:]] or DEFAULT_SIZES
+    print(
+        f"{'rows':>12} {'python map rows/s':>20} {'vectorized rows/s':>20} {'speedup':>8}"
+    )
+    for n in sizes:
+        df = generate_delays(n)
+        map_time, expected = timed(python_map, df)
+        vec_time, result = timed(vectorized, df)
+        assert result.equals(expected)
+        print(
+            f"{n:>12} {n / map_time:>20,.0f} {n / vec_time:>20,.0f} {map_time / vec_time:>7.2f}x"
+        )
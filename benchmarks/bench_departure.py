@@ -0,0 +1,63 @@
+"""
+Benchmark of parsing origin_aimed_departure_time with the lookup of `departure_minutes`
++ `departure_time` + `departure_day_offset` against `str.strptime`, which silver used
+before. strptime can not parse departures past midnight, e.g. "2415", so the values are
+all before midnight and the day offset is only computed by the lookup.
+
+Run from the root of the repository with e.g.
+    python benchmarks/bench_departure.py 10000 1000000 10000000
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "silver"))
+
+import polars as pl
+from utils.format import departure_minutes, departure_time, departure_day_offset
+
+DEFAULT_SIZES = [10_000, 1_000_000, 10_000_000]
+
+
+def generate_departures(n: int, seed: int = 0) -> pl.DataFrame:
+    minutes = pl.int_range(0, 24 * 60, eager=True).sample(
+        n, with_replacement=True, seed=seed
+    )
+    return pl.DataFrame({"minutes": minutes}).select(
+        pl.concat_str(
+            (pl.col("minutes") // 60).cast(pl.String).str.zfill(2),
+            (pl.col("minutes") % 60).cast(pl.String).str.zfill(2),
+        ).alias("departure")
+    )
+
+
+def strptime(df: pl.DataFrame) -> pl.DataFrame:
+    return df.select(pl.col("departure").str.strptime(dtype=pl.Time, format="%H%M"))
+
+
+def lookup(df: pl.DataFrame) -> pl.DataFrame:
+    return df.with_columns(departure_minutes("departure").alias("minutes")).select(
+        departure_time(pl.col("minutes")).alias("departure"),
+        departure_day_offset(pl.col("minutes")).alias("offset"),
+    )
+
+
+def timed(f, df: pl.DataFrame) -> tuple[float, pl.DataFrame]:
+    start = time.perf_counter()
+    result = f(df)
+    return time.perf_counter() - start, result
+
+
+if __name__ == "__main__":
+    sizes = [int(n) for n in sys.argv[1:]] or DEFAULT_SIZES
+    print(f"{'rows':>12} {'strptime rows/s':>20} {'lookup rows/s':>20} {'speedup':>8}")
+    for n in sizes:
+        df = generate_departures(n)
+        strptime_time, expected = timed(strptime, df)
+        lookup_time, result = timed(lookup, df)
+        assert result["departure"].equals(expected["departure"])
+        assert result["offset"].sum() == 0
+        print(
+            f"{n:>12} {n / strptime_time:>20,.0f} {n / lookup_time:>20,.0f} {strptime_time / lookup_time:>7.2f}x"
+        )
@@ -0,0 +1,101 @@
+"""
+Benchmark of merging a batch of new rows to the gold Delta table as the table grows.
+Compares the partitioned merge that only rewrites the partitions touched by the batch
+against the full table merge used for unpartitioned tables.
+
+Run from the root of the repository with e.g.
+    python benchmarks/bench_gold_merge.py 10 100 300
+where the arguments are the number of days of history in the table.
+"""
+
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "gold"))
+
+import polars as pl
+from delta_operations.functions import (
+    PARTITION_COLUMN,
+    merge_full_table,
+    merge_partitioned,
+)
+
+DEFAULT_DAYS = [10, 100, 300]
+ROWS_PER_DAY = 10_000
+BATCH_ROWS = 2_000
+WORKERS = 4
+
+
+def generate_gold_rows(day: datetime.date, n: int, offset: int = 0) -> pl.DataFrame:
+    seconds = pl.int_range(offset, offset + n, eager=True) * 7 % 86_400
+    return pl.DataFrame(
+        {
+            "date": pl.repeat(day, n, eager=True),
+            # Times are stored as microseconds since midnight.
+            "time": seconds * 1_000_000,
+            "line": (pl.int_range(0, n, eager=True) % 40).cast(pl.String),
+            "operator": pl.repeat("TKL", n, eager=True),
+            "vehicle": (pl.int_range(0, n, eager=True) % 300).cast(pl.String),
+            "journey_pattern": pl.repeat("3V", n, eager=True),
+            "origin_short_name": pl.repeat("3615", n, eager=True),
+            "destination_short_name": pl.repeat("1028", n, eager=True),
+            "direction": (pl.int_range(0, n, eager=True) % 2 + 1).cast(pl.String),
+            "longitude": pl.repeat(23.69, n, eager=True),
+            "latitude": pl.repeat(61.52, n, eager=True),
+            "speed": pl.repeat(10.0, n, eager=True, dtype=pl.Float32),
+            "origin_aimed_departure_time": pl.repeat(81_600_000_000, n, eager=True),
+            "origin_day_offset": pl.repeat(0, n, eager=True, dtype=pl.Int8),
+            "delay": pl.repeat(-200, n, eager=True, dtype=pl.Int64),
+            "update_time": pl.repeat(datetime.datetime.now(), n, eager=True),
+        }
+    ).unique(["date", "time", "line", "direction", "origin_aimed_departure_time"])
+
+
+def create_table(path: str, days: int, partitioned: bool):
+    start = datetime.date(2024, 1, 1)
+    rows = pl.concat(
+        [
+            generate_gold_rows(start + datetime.timedelta(days=i), ROWS_PER_DAY)
+            for i in range(days)
+        ]
+    )
+    if partitioned:
+        rows.write_delta(path, delta_write_options={"partition_by": [PARTITION_COLUMN]})
+    else:
+        # Written as a single file since the full table merge of the Delta Lake version
+        # in use fails on unpartitioned tables with multiple files.
+        rows.write_delta(path)
+
+
+def new_batch(days: int) -> pl.DataFrame:
+    # Half of the rows update existing rows of the last day, half are new rows.
+    last_day = datetime.date(2024, 1, 1) + datetime.timedelta(days=days - 1)
+    return generate_gold_rows(
+        last_day, BATCH_ROWS, offset=ROWS_PER_DAY - BATCH_ROWS // 2
+    )
+
+
+if __name__ == "__main__":
+    day_counts = [int(n) for n in sys.argv[1:]] or DEFAULT_DAYS
+    print(f"{'days':>6} {'rows':>10} {'full merge s':>14} {'partitioned s':>14}")
+    for days in day_counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            full_path = os.path.join(tmp, "full")
+            partitioned_path = os.path.join(tmp, "partitioned")
+            create_table(full_path, days, partitioned=False)
+            create_table(partitioned_path, days, partitioned=True)
+            batch = new_batch(days)
+
+            start = time.perf_counter()
+            merge_full_table(batch, full_path)
+            full_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            merge_partitioned(batch, partitioned_path, WORKERS)
+            partitioned_time = time.perf_counter() - start
+
+            rows = pl.scan_delta(partitioned_path).select(pl.len()).collect().item()
+            print(f"{days:>6} {rows:>10} {full_time:>14.3f} {partitioned_time:>14.3f}")
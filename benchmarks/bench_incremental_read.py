@@ -0,0 +1,93 @@
+"""
+Benchmark of the incremental read of new loads from the bronze DuckDB table as the
+history in the table grows. The incremental read gets the new loads with
+`get_new_loads` and their rows with `get_new_data`, which should take the same time
+regardless of the size of the table. A scan over the whole table is shown for
+reference.
+
+Run from the root of the repository with e.g.
+    python benchmarks/bench_incremental_read.py 1000000 10000000 100000000
+where the arguments are the number of rows in the bronze table.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "silver"))
+
+import duckdb
+from db_operations.functions import get_new_data, get_new_loads
+
+DEFAULT_ROW_COUNTS = [1_000_000, 10_000_000, 100_000_000]
+ROWS_PER_LOAD = 1_000
+FIRST_LOAD = 1_700_000_000
+NEW_LOADS = 3
+
+
+def load_id(i: int) -> str:
+    return f"{FIRST_LOAD + i * 60}.123456"
+
+
+def create_bronze(db_path: str, rows: int):
+    # Loads are appended in order like dlt does, one load every minute.
+    with duckdb.connect(db_path) as db:
+        db.sql("CREATE SCHEMA bronze")
+        db.sql(
+            f"""CREATE TABLE bronze.journeys_data AS
+            SELECT
+                ({FIRST_LOAD} + (i // {ROWS_PER_LOAD}) * 60)::VARCHAR || '.123456'
+                    AS _dlt_load_id,
+                'TKL_' || (i % 300) AS monitored_vehicle_journey__vehicle_ref,
+                (i % 40)::VARCHAR AS monitored_vehicle_journey__line_ref,
+                '-P0Y0M0DT0H3M20.000S' AS monitored_vehicle_journey__delay,
+                23.7 + random() / 10 AS monitored_vehicle_journey__vehicle_location__longitude,
+                61.5 + random() / 10 AS monitored_vehicle_journey__vehicle_location__latitude
+            FROM range({rows}) r(i)"""
+        )
+        db.sql(
+            """CREATE TABLE bronze._dlt_loads AS
+            SELECT DISTINCT _dlt_load_id AS load_id, 0 AS status
+            FROM bronze.journeys_data"""
+        )
+
+
+def incremental_read(db_path: str, last_load: str) -> int:
+    loads = get_new_loads(db_path, "bronze", "journeys_data", last_load)
+    df = get_new_data(db_path, "bronze", "journeys_data", last_load, loads[-1][0])
+    return len(df)
+
+
+def full_scan(db_path: str) -> int:
+    with duckdb.connect(db_path, read_only=True) as db:
+        return len(
+            db.sql(
+                "SELECT _dlt_load_id, COUNT(*) FROM bronze.journeys_data GROUP BY 1"
+            ).fetchall()
+        )
+
+
+def timed(f, *args):
+    start = time.perf_counter()
+    f(*args)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    row_counts = [int(n) for n in sys.argv[1:]] or DEFAULT_ROW_COUNTS
+    print(f"{'rows':>11} {'full scan s':>12} {'incremental s':>14}")
+    for rows in row_counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "ingest_pipe.duckdb")
+            create_bronze(db_path, rows)
+            last_load = load_id(rows // ROWS_PER_LOAD - NEW_LOADS - 1)
+
+            # First runs warm up the OS page cache.
+            incremental_read(db_path, last_load)
+            assert full_scan(db_path) == rows // ROWS_PER_LOAD
+            scan_time = timed(full_scan, db_path)
+            incremental_time = timed(incremental_read, db_path, last_load)
+            assert incremental_read(db_path, last_load) == NEW_LOADS * ROWS_PER_LOAD
+            print(f"{rows:>11} {scan_time:>12.3f} {incremental_time:>14.3f}")
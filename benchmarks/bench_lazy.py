@@ -0,0 +1,107 @@
+"""
+Benchmark of the eager and lazy transformations of silver on synthetic vehicle activity
+data from `journeys_generator.py`. Compares reading all bronze columns and running
+`transform_bus_data`, `drop_nulls` and `deduplicate` one after another to reading only
+`BRONZE_COLUMNS` and running `clean_bus_data` as a single lazy query, with and without
+the streaming engine of Polars.
+
+Every variant is run in a fresh process, so the peak memory usage of the process
+(max RSS) can be compared. The memory used by the imports is measured before the
+variant is run and reported separately.
+
+Run from the root of the repository with e.g.
+    python benchmarks/bench_lazy.py --rows 1000000
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "silver"))
+
+from db_operations.functions import get_new_data, TARGET_TABLE_PK
+from journeys_generator import generate_vehicle_activity, write_bronze
+from utils.transformations import (
+    transform_bus_data,
+    drop_nulls,
+    deduplicate,
+    clean_bus_data,
+    BRONZE_COLUMNS,
+)
+
+VARIANTS = ["eager", "lazy", "lazy_streaming"]
+PK_COLS = TARGET_TABLE_PK.split(", ")
+
+
+def max_rss_bytes() -> int:
+    # ru_maxrss of a child process includes the peak of the parent before the exec on
+    # Linux, so use the high water mark of the process from /proc when available.
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def run_variant(variant: str, db_path: str):
+    """
+    Function reads all rows of the bronze database and transforms them with the
+    variant, then prints the time in seconds, peak RSS before the variant and peak RSS
+    after the variant in bytes.
+
+    Params:
+        - variant: one of VARIANTS.
+        - db_path: filepath to the bronze DuckDB database-file.
+    """
+    rss_before = max_rss_bytes()
+    start = time.perf_counter()
+    if variant == "eager":
+        df = get_new_data(db_path, "bronze", "journeys_data", "0")
+        df = deduplicate(drop_nulls(transform_bus_data(df)), PK_COLS)
+    else:
+        df = get_new_data(
+            db_path, "bronze", "journeys_data", "0", columns=BRONZE_COLUMNS
+        )
+        df, _ = clean_bus_data(df, PK_COLS, streaming=variant == "lazy_streaming")
+    seconds = time.perf_counter() - start
+    print(seconds, rss_before, max_rss_bytes())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--variant", choices=VARIANTS, help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant is not None:
+        run_variant(args.variant, args.db)
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "journeys.duckdb")
+        write_bronze(db_path, generate_vehicle_activity(args.rows))
+
+        print(f"{'variant':>15} {'rows':>10} {'s':>10} {'peak MiB':>10}")
+        for variant in VARIANTS:
+            runs = []
+            for _ in range(args.repeat):
+                output = subprocess.run(
+                    [sys.executable, __file__, "--variant", variant, "--db", db_path],
+                    check=True,
+                    capture_output=True,
+                    text=True,
+                ).stdout.split()
+                runs.append([float(x) for x in output])
+            seconds = min(run[0] for run in runs)
+            peak_mib = min(run[2] - run[1] for run in runs) / 2**20
+            print(f"{variant:>15} {args.rows:>10} {seconds:>10.3f} {peak_mib:>10.1f}")
@@ -0,0 +1,220 @@
+"""
+End-to-end benchmark suite of the silver and gold steps on synthetic vehicle activity
+data from `journeys_generator.py`. Times `transform_bus_data`, `drop_nulls`,
+`deduplicate` and `insert_new_data` of silver, and reading the new rows of gold from
+silver, the merge to the gold Delta table and optimizing the table, at each number of
+rows. Runs offline.
+
+Every benchmark is run `--repeat` times with a fresh setup and the fastest time is
+reported. With `--output` the results are saved as JSON, and with `--baseline` they are
+compared against the results of an earlier run: the script exits with status 1 if any
+benchmark is more than `--tolerance` slower than in the baseline, so it can be used in
+CI to catch performance regressions.
+
+Run from the root of the repository with e.g.
+    python benchmarks/bench_pipeline.py --rows 10000 1000000 10000000 --output results.json
+    python benchmarks/bench_pipeline.py --rows 10000 --baseline results.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "silver"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "gold"))
+
+import deltalake
+import duckdb
+import polars as pl
+from deltalake import DeltaTable, write_deltalake
+from db_operations.functions import (
+    create_or_replace_tables,
+    insert_new_data,
+    TARGET_TABLE_PK,
+)
+from delta_operations.functions import PARTITION_COLUMN, merge, to_gold_schema
+from journeys_generator import generate_vehicle_activity
+from utils.transformations import transform_bus_data, drop_nulls, deduplicate
+
+DEFAULT_ROWS = [10_000, 1_000_000, 10_000_000]
+PK_COLS = TARGET_TABLE_PK.split(", ")
+MERGE_WORKERS = 4
+# Number of appends the table to optimize is written in, i.e. the number of small
+# files in each partition.
+OPTIMIZE_APPENDS = 10
+
+
+def timed(setup, f) -> float:
+    """
+    Function times f called with the return value of setup.
+    """
+    args = setup()
+    start = time.perf_counter()
+    f(*args)
+    return time.perf_counter() - start
+
+
+def to_gold(df: pl.DataFrame) -> pl.DataFrame:
+    return pl.from_arrow(to_gold_schema(df.to_arrow()))
+
+
+def read_gold(db_path: str) -> pl.DataFrame:
+    # Same read as in gold/export.py.
+    with duckdb.connect(db_path, read_only=True) as db:
+        return pl.from_arrow(
+            to_gold_schema(db.sql("FROM silver.journeys_data").arrow())
+        )
+
+
+def run_benchmarks(rows: int, repeat: int) -> dict[str, float]:
+    """
+    Function runs all benchmarks with the given number of generated bronze rows and
+    returns the fastest time of each benchmark in seconds.
+
+    Params:
+        - rows: number of generated bronze rows.
+        - repeat: number of times to run each benchmark.
+    """
+    bronze_df = generate_vehicle_activity(rows)
+    transformed_df = transform_bus_data(bronze_df)
+    not_null_df = drop_nulls(transformed_df)
+    silver_df = deduplicate(not_null_df, PK_COLS)
+    gold_df = to_gold(silver_df)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        counter = iter(range(1_000_000))
+
+        def new_path(name: str) -> str:
+            return os.path.join(tmp, f"{name}_{next(counter)}")
+
+        def silver_setup():
+            db_path = new_path("cleaned") + ".duckdb"
+            create_or_replace_tables(db_path, "silver", "journeys_data")
+            return (db_path,)
+
+        def insert(db_path: str):
+            insert_new_data(
+                df=silver_df,
+                checkpoint=bronze_df["_dlt_load_id"].max(),
+                db_path=db_path,
+                schema="silver",
+                table="journeys_data",
+                reset_tables=False,
+            )
+
+        def read_setup():
+            db_path = silver_setup()[0]
+            insert(db_path)
+            return (db_path,)
+
+        def merge_setup():
+            # All rows of the batch update existing rows, so every partition is
+            # read and rewritten.
+            table_path = new_path("merge")
+            merge(gold_df, table_path)
+            return (table_path,)
+
+        def optimize_setup():
+            table_path = new_path("optimize")
+            for chunk in gold_df.iter_slices(len(gold_df) // OPTIMIZE_APPENDS + 1):
+                write_deltalake(
+                    table_path,
+                    chunk.to_arrow(),
+                    mode="append",
+                    partition_by=[PARTITION_COLUMN],
+                )
+            return (DeltaTable(table_path),)
+
+        benchmarks = {
+            "transform_bus_data": (lambda: (bronze_df,), transform_bus_data),
+            "drop_nulls": (lambda: (transformed_df,), drop_nulls),
+            "deduplicate": (lambda: (not_null_df, PK_COLS), deduplicate),
+            "insert_new_data": (silver_setup, insert),
+            "gold_read": (read_setup, read_gold),
+            "gold_merge": (
+                merge_setup,
+                lambda path: merge(gold_df, path, workers=MERGE_WORKERS),
+            ),
+            "optimize": (optimize_setup, lambda table: table.optimize.compact()),
+        }
+        return {
+            name: min(timed(setup, f) for _ in range(repeat))
+            for name, (setup, f) in benchmarks.items()
+        }
+
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float) -> bool:
+    """
+    Function prints the results compared to the baseline and returns whether any
+    benchmark is more than tolerance slower than in the baseline.
+
+    Params:
+        - results: results of this run.
+        - baseline: results of an earlier run.
+        - tolerance: allowed slowdown as a fraction, e.g. 0.25 for 25 %.
+    """
+    baseline_times = {(r["benchmark"], r["rows"]): r["seconds"] for r in baseline}
+    regressed = False
+    print()
+    print(f"{'benchmark':>20} {'rows':>10} {'baseline s':>12} {'s':>10} {'ratio':>7}")
+    for result in results:
+        key = (result["benchmark"], result["rows"])
+        if key not in baseline_times:
+            continue
+        ratio = result["seconds"] / baseline_times[key]
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = " REGRESSION"
+            regressed = True
+        print(
+            f"{key[0]:>20} {key[1]:>10} {baseline_times[key]:>12.3f} "
+            + f"{result['seconds']:>10.3f} {ratio:>7.2f}{flag}"
+        )
+    return regressed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="file to save the results to as JSON")
+    parser.add_argument("--baseline", help="JSON file of results to compare to")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'benchmark':>20} {'rows':>10} {'s':>10}")
+    for rows in args.rows:
+        for benchmark, seconds in run_benchmarks(rows, args.repeat).items():
+            print(f"{benchmark:>20} {rows:>10} {seconds:>10.3f}")
+            results.append({"benchmark": benchmark, "rows": rows, "seconds": seconds})
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "created_at": datetime.datetime.now(
+                        datetime.timezone.utc
+                    ).isoformat(),
+                    "machine": platform.machine(),
+                    "python": platform.python_version(),
+                    "polars": pl.__version__,
+                    "duckdb": duckdb.__version__,
+                    "deltalake": deltalake.__version__,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
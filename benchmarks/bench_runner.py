@@ -0,0 +1,142 @@
+"""
+Benchmark of running the pipeline every tick with a process per stage, like the
+containerized DAG without the container startup, compared to the single-process runner
+`pipeline/run.py` that keeps the imports and DuckDB connections warm between stages and
+ticks. Every tick appends TICK_LOADS new loads of synthetic vehicle activity data from
+`journeys_generator.py` to bronze and runs transform and export. Ingest is not run,
+since it needs the JourneysAPI.
+
+Prints the wall time of the first tick and the mean of the other ticks for both. The
+benchmark itself has already imported Polars and DuckDB, so the first tick of the runner
+only includes the rest of the imports of the stages.
+
+Run from the root of the repository with e.g.
+    python benchmarks/bench_runner.py --ticks 10
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import duckdb
+import polars as pl
+from journeys_generator import generate_vehicle_activity, write_bronze
+from pipeline.run import STAGES, read_env_file, run_once
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+RUN_STAGES = ["transform", "export"]
+# A minute of snapshots every tick.
+TICK_LOADS = 30
+VARIANTS = ["processes", "runner"]
+
+
+def append_bronze(db_path: str, df: pl.DataFrame):
+    """
+    Function appends generated rows and their loads to the bronze tables written with
+    `write_bronze`.
+
+    Params:
+        - db_path: filepath to the DuckDB database-file.
+        - df: rows generated with `generate_vehicle_activity`.
+    """
+    with duckdb.connect(db_path) as db:
+        db.sql("INSERT INTO bronze.journeys_data FROM df")
+        db.sql(
+            """INSERT INTO bronze._dlt_loads
+            SELECT DISTINCT
+                _dlt_load_id AS load_id,
+                0 AS status,
+                to_timestamp(_dlt_load_id::DOUBLE) AS inserted_at
+            FROM df
+            ORDER BY load_id"""
+        )
+
+
+def write_env_files(tmp: str, variant: str) -> dict[str, str]:
+    """
+    Function writes the env-files of the stages of a variant and returns the
+    environment variables of the runner that point to them.
+
+    Params:
+        - tmp: directory of the data of the benchmark.
+        - variant: one of VARIANTS.
+    """
+    envs = {
+        "transform": {
+            "SOURCE_DB": os.path.join(tmp, f"{variant}_bronze.duckdb"),
+            "SOURCE_SCHEMA": "bronze",
+            "SOURCE_TABLE": "journeys_data",
+            "TARGET_DB": os.path.join(tmp, f"{variant}_cleaned.duckdb"),
+            "TARGET_SCHEMA": "silver",
+            "TARGET_TABLE": "journeys_data",
+        },
+        "export": {
+            "SOURCE_DB": os.path.join(tmp, f"{variant}_cleaned.duckdb"),
+            "SOURCE_SCHEMA": "silver",
+            "SOURCE_TABLE": "journeys_data",
+            "TARGET_DIR": os.path.join(tmp, f"{variant}_gold"),
+        },
+    }
+    runner_env = {}
+    for stage, env in envs.items():
+        path = os.path.join(tmp, f"{variant}_{stage}.env")
+        with open(path, "w") as f:
+            f.writelines(f"{name}={value}\n" for name, value in env.items())
+        runner_env[f"{stage.upper()}_ENV_FILE"] = path
+    return runner_env
+
+
+def run_processes(runner_env: dict[str, str]):
+    # Same as running run_stage for every stage, but each stage in a new process.
+    for stage in RUN_STAGES:
+        directory, script = STAGES[stage]
+        env = read_env_file(runner_env[f"{stage.upper()}_ENV_FILE"])
+        subprocess.run(
+            [sys.executable, script],
+            cwd=os.path.join(ROOT, directory),
+            env=os.environ | {"PYTHONPATH": ROOT} | env,
+            check=True,
+            capture_output=True,
+        )
+
+
+def run_runner(runner_env: dict[str, str]):
+    os.environ.update(runner_env)
+    with contextlib.redirect_stdout(io.StringIO()):
+        run_once(RUN_STAGES)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--ticks", type=int, default=10)
+    parser.add_argument("--vehicles", type=int, default=300)
+    args = parser.parse_args()
+
+    tick_rows = TICK_LOADS * args.vehicles
+    df = generate_vehicle_activity(tick_rows * (args.ticks + 1), args.vehicles)
+    print(f"{args.ticks} ticks, {tick_rows} bronze rows per tick")
+
+    print(f"{'variant':>10} {'first s':>10} {'mean s':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for variant in VARIANTS:
+            bronze_db = os.path.join(tmp, f"{variant}_bronze.duckdb")
+            write_bronze(bronze_db, df.head(tick_rows))
+            runner_env = write_env_files(tmp, variant)
+            seconds = []
+            for tick in range(args.ticks):
+                start = time.perf_counter()
+                if variant == "processes":
+                    run_processes(runner_env)
+                else:
+                    run_runner(runner_env)
+                seconds.append(time.perf_counter() - start)
+                append_bronze(bronze_db, df.slice((tick + 1) * tick_rows, tick_rows))
+            mean = sum(seconds[1:]) / max(1, len(seconds) - 1)
+            print(f"{variant:>10} {seconds[0]:>10.2f} {mean:>10.2f}")
@@ -0,0 +1,139 @@
+"""
+Benchmark of the trajectory table of gold on synthetic vehicle activity data from
+`journeys_generator.py`. Times building the table with `update_trajectories`, and
+finding the journeys near a position with `vehicles_near` and reading a bounding box
+with `read_area` against scanning the whole fact table and filtering it by distance or
+coordinates. Also prints the number of files of each table the queries read.
+
+Run from the root of the repository with e.g.
+    python benchmarks/bench_trajectories.py --rows 1000000
+"""
+
+import argparse
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "silver"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "gold"))
+
+import polars as pl
+import pyarrow.dataset as ds
+from deltalake import DeltaTable
+from db_operations.functions import TARGET_TABLE_PK
+from delta_operations.functions import merge, to_gold_schema
+from delta_operations.trajectories import (
+    area_filter,
+    haversine,
+    JOURNEY_COLUMNS,
+    read_area,
+    time_filter,
+    update_trajectories,
+    vehicles_near,
+)
+from journeys_generator import START, generate_vehicle_activity
+from utils.transformations import transform_bus_data, drop_nulls, deduplicate
+
+PK_COLS = TARGET_TABLE_PK.split(", ")
+# A stop in the middle of the generated area, and a box of about 1 km by 1 km around it.
+LONGITUDE = 23.8
+LATITUDE = 61.5
+RADIUS_METERS = 100.0
+BOX = (23.79, 61.495, 23.81, 61.505)
+
+
+def timed(f, *args) -> tuple[float, pl.DataFrame]:
+    start = time.perf_counter()
+    result = f(*args)
+    return time.perf_counter() - start, result
+
+
+def files_read(table_path: str, filter: ds.Expression) -> tuple[int, int]:
+    """
+    Function returns the number of files of a Delta table the filter can not prune by
+    the partition values and statistics, and the number of all files.
+    """
+    dataset = DeltaTable(table_path).to_pyarrow_dataset()
+    return len(list(dataset.get_fragments(filter))), len(dataset.files)
+
+
+def scan_near(fact_path: str, start: datetime.datetime, end: datetime.datetime):
+    # Without the trajectory table: read every row and compute every distance.
+    distance = haversine(
+        pl.lit(LONGITUDE), pl.lit(LATITUDE), pl.col("longitude"), pl.col("latitude")
+    )
+    return (
+        pl.read_delta(fact_path)
+        .with_columns(distance=distance)
+        .filter(pl.col("distance") <= RADIUS_METERS)
+        .filter(
+            (
+                pl.col("date").cast(pl.Datetime("us"))
+                + pl.duration(microseconds="time")
+            ).is_between(start, end)
+        )
+    )
+
+
+def scan_area(fact_path: str):
+    min_longitude, min_latitude, max_longitude, max_latitude = BOX
+    return pl.read_delta(fact_path).filter(
+        pl.col("longitude").is_between(min_longitude, max_longitude),
+        pl.col("latitude").is_between(min_latitude, max_latitude),
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    bronze_df = generate_vehicle_activity(args.rows)
+    silver_df = deduplicate(drop_nulls(transform_bus_data(bronze_df)), PK_COLS)
+    gold_df = pl.from_arrow(to_gold_schema(silver_df.to_arrow()))
+    start = START.replace(tzinfo=None)
+    end = start + datetime.timedelta(days=365)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fact_path = os.path.join(tmp, "journeys_data")
+        trajectory_path = os.path.join(tmp, "trajectories")
+        build_time, journeys = timed(
+            update_trajectories, gold_df, fact_path, trajectory_path
+        )
+        merge(gold_df, fact_path)
+        print(f"{len(gold_df)} gold rows, {journeys} journeys")
+        print(f"build trajectory table: {build_time:.2f} s")
+
+        near_time, near = timed(
+            vehicles_near,
+            trajectory_path,
+            LONGITUDE,
+            LATITUDE,
+            RADIUS_METERS,
+            start,
+            end,
+        )
+        scan_near_time, scanned = timed(scan_near, fact_path, start, end)
+        assert len(near) == scanned.select(["date"] + JOURNEY_COLUMNS).n_unique()
+        area_time, area = timed(read_area, trajectory_path, *BOX, start, end)
+        scan_area_time, scanned = timed(scan_area, fact_path)
+        assert len(area) == len(scanned)
+
+        read, files = files_read(
+            trajectory_path, area_filter(*BOX) & time_filter(start, end)
+        )
+        print(f"read_area reads {read} of {files} files of the trajectory table")
+        files = len(DeltaTable(fact_path).files())
+        print(f"the scans read all {files} files of the fact table")
+
+        print(
+            f"{'query':>14} {'rows':>8} {'trajectory s':>13} {'scan s':>8} {'speedup':>8}"
+        )
+        for name, rows, t, scan_t in [
+            ("vehicles_near", len(near), near_time, scan_near_time),
+            ("read_area", len(area), area_time, scan_area_time),
+        ]:
+            print(f"{name:>14} {rows:>8} {t:>13.3f} {scan_t:>8.3f} {scan_t / t:>7.1f}x")
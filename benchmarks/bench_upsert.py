@@ -0,0 +1,122 @@
+"""
+Benchmark of inserting a batch to the silver DuckDB table as the table grows. Compares
+the previous `INSERT ... ON CONFLICT DO NOTHING` against the primary key index to
+`insert_new_data`, which joins the batch to the rows of the table in the date range of
+the batch, with and without updating the changed rows.
+
+The batch has BATCH_ROWS rows: 80 % new rows after the rows in the table, 10 % rows of
+the last day in the table unchanged and 10 % with a corrected delay. Every variant is
+run on a fresh copy of the table.
+
+Run from the root of the repository with e.g.
+    python benchmarks/bench_upsert.py 1000000 5000000 10000000
+where the arguments are the number of rows in the silver table.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "silver"))
+
+import duckdb
+import polars as pl
+from db_operations.functions import (
+    create_or_replace_tables,
+    insert_new_data,
+    TARGET_TABLE_PK,
+)
+from journeys_generator import generate_vehicle_activity
+from utils.transformations import clean_bus_data
+
+DEFAULT_ROW_COUNTS = [1_000_000, 5_000_000]
+BATCH_ROWS = 100_000
+# 864k rows a day, so the history in the table spans several days.
+VEHICLES = 20
+VARIANTS = ["on_conflict", "upsert", "upsert_update"]
+REPEAT = 3
+PK_COLS = TARGET_TABLE_PK.split(", ")
+
+
+def table_and_batch(rows: int) -> tuple[pl.DataFrame, pl.DataFrame]:
+    """
+    Function generates about `rows` silver rows for the table and a batch of
+    BATCH_ROWS rows to insert to it.
+
+    Params:
+        - rows: number of bronze rows to generate for the table.
+    """
+    new_rows = BATCH_ROWS * 8 // 10
+    df, _ = clean_bus_data(
+        generate_vehicle_activity(rows + new_rows, VEHICLES), PK_COLS
+    )
+    df = df.sort(PK_COLS)
+    table_df = df.head(len(df) - new_rows)
+    last_day = table_df.filter(pl.col("date") == pl.col("date").max())
+    existing = last_day.sample(BATCH_ROWS - new_rows, seed=0)
+    corrected = existing.tail(len(existing) // 2).with_columns(
+        delay=pl.col("delay") + 60
+    )
+    batch_df = pl.concat(
+        [df.tail(new_rows), existing.head(len(existing) - len(corrected)), corrected]
+    )
+    return table_df, batch_df
+
+
+def insert_on_conflict(df: pl.DataFrame, db_path: str):
+    # Previous implementation of insert_new_data.
+    with duckdb.connect(db_path) as db:
+        db.sql("BEGIN TRANSACTION")
+        db.sql("INSERT INTO silver.loads (load_id, loaded_rows) VALUES ('2', 0)")
+        db.sql(
+            f"""INSERT INTO silver.journeys_data BY NAME
+            FROM df
+            ON CONFLICT ({TARGET_TABLE_PK}) DO NOTHING"""
+        )
+        db.sql("COMMIT")
+
+
+def run_variant(variant: str, df: pl.DataFrame, db_path: str):
+    if variant == "on_conflict":
+        insert_on_conflict(df, db_path)
+    else:
+        insert_new_data(
+            df=df,
+            checkpoint="2",
+            db_path=db_path,
+            schema="silver",
+            table="journeys_data",
+            reset_tables=False,
+            update=variant == "upsert_update",
+        )
+
+
+if __name__ == "__main__":
+    row_counts = [int(n) for n in sys.argv[1:]] or DEFAULT_ROW_COUNTS
+    print(f"{'rows':>11} " + " ".join(f"{variant + ' s':>16}" for variant in VARIANTS))
+    for rows in row_counts:
+        table_df, batch_df = table_and_batch(rows)
+        with tempfile.TemporaryDirectory() as tmp:
+            table_db = os.path.join(tmp, "cleaned.duckdb")
+            create_or_replace_tables(table_db, "silver", "journeys_data")
+            insert_new_data(table_df, "1", table_db, "silver", "journeys_data", False)
+
+            seconds = {}
+            for variant in VARIANTS:
+                runs = []
+                for _ in range(REPEAT):
+                    db_path = os.path.join(tmp, f"{variant}.duckdb")
+                    shutil.copy(table_db, db_path)
+                    start = time.perf_counter()
+                    run_variant(variant, batch_df, db_path)
+                    runs.append(time.perf_counter() - start)
+                    os.remove(db_path)
+                seconds[variant] = min(runs)
+
+        print(
+            f"{len(table_df):>11} "
+            + " ".join(f"{seconds[variant]:>16.3f}" for variant in VARIANTS)
+        )
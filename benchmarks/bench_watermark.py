@@ -0,0 +1,71 @@
+"""
+Benchmark of getting the max update_time and row count of the gold Delta table from the
+statistics in the Delta log against reading the whole table.
+
+Run from the root of the repository with e.g.
+    python benchmarks/bench_watermark.py 10 1000 10000
+where the arguments are the number of files in the table.
+"""
+
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "gold"))
+
+import polars as pl
+from deltalake import write_deltalake
+from delta_operations.functions import get_table_stats
+
+DEFAULT_FILE_COUNTS = [10, 1_000, 10_000]
+ROWS_PER_FILE = 1_000
+
+
+def create_table(path: str, files: int):
+    n = files * ROWS_PER_FILE
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    rows = pl.DataFrame(
+        {
+            "line": (pl.int_range(0, n, eager=True) % 40).cast(pl.String),
+            "delay": pl.int_range(0, n, eager=True),
+            "update_time": pl.datetime_range(
+                start,
+                start + datetime.timedelta(seconds=n - 1),
+                interval="1s",
+                eager=True,
+            ),
+        }
+    )
+    write_deltalake(
+        path,
+        rows.to_arrow(),
+        max_rows_per_file=ROWS_PER_FILE,
+        max_rows_per_group=ROWS_PER_FILE,
+        min_rows_per_group=ROWS_PER_FILE,
+    )
+
+
+def full_read(path: str):
+    max_update = pl.read_delta(path).select("update_time").max().item()
+    row_count = pl.read_delta(path).select("line").count().item()
+    return max_update, row_count
+
+
+def timed(f, path: str):
+    start = time.perf_counter()
+    result = f(path)
+    return time.perf_counter() - start, result
+
+
+if __name__ == "__main__":
+    file_counts = [int(n) for n in sys.argv[1:]] or DEFAULT_FILE_COUNTS
+    print(f"{'files':>7} {'full read s':>12} {'log stats s':>12}")
+    for files in file_counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            create_table(tmp, files)
+            read_time, expected = timed(full_read, tmp)
+            stats_time, stats = timed(get_table_stats, tmp)
+            assert stats == expected
+            print(f"{files:>7} {read_time:>12.3f} {stats_time:>12.3f}")
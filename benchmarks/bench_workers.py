@@ -0,0 +1,87 @@
+"""
+Benchmark of the concurrency of the silver and gold stages on a multi-day backfill of
+synthetic vehicle activity data from `journeys_generator.py`. Runs `silver/transform.py`
+with each number of `WORKERS` on a fresh silver database, and `gold/export.py` with each
+number of `MERGE_WORKERS` on a fresh gold table, and prints the wall time and the
+speedup compared to a single worker.
+
+Run from the root of the repository with e.g.
+    python benchmarks/bench_workers.py --days 4 --workers 1 2 4
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from journeys_generator import SNAPSHOT_SECONDS, generate_vehicle_activity, write_bronze
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def run_stage(stage: str, script: str, env: dict[str, str]) -> float:
+    """
+    Function runs a stage script and returns its wall time in seconds.
+
+    Params:
+        - stage: directory of the stage, e.g. "silver".
+        - script: script to run in the directory, e.g. "transform.py".
+        - env: environment variables of the stage.
+    """
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, script],
+        cwd=os.path.join(ROOT, stage),
+        env=os.environ | {"PYTHONPATH": ROOT} | env,
+        check=True,
+        capture_output=True,
+    )
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--days", type=int, default=4)
+    parser.add_argument("--vehicles", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=100_000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    rows = args.days * 86_400 // SNAPSHOT_SECONDS * args.vehicles
+    with tempfile.TemporaryDirectory() as tmp:
+        bronze_db = os.path.join(tmp, "journeys.duckdb")
+        write_bronze(bronze_db, generate_vehicle_activity(rows, args.vehicles))
+        print(f"{args.days} days, {rows} bronze rows")
+
+        print(f"{'stage':>8} {'workers':>8} {'s':>10} {'speedup':>8}")
+        silver_db = None
+        for stage, script in [("silver", "transform.py"), ("gold", "export.py")]:
+            single = None
+            for workers in args.workers:
+                if stage == "silver":
+                    silver_db = os.path.join(tmp, f"cleaned_{workers}.duckdb")
+                    env = {
+                        "SOURCE_DB": bronze_db,
+                        "SOURCE_SCHEMA": "bronze",
+                        "SOURCE_TABLE": "journeys_data",
+                        "TARGET_DB": silver_db,
+                        "TARGET_SCHEMA": "silver",
+                        "TARGET_TABLE": "journeys_data",
+                        "BATCH_SIZE": str(args.batch_size),
+                        "WORKERS": str(workers),
+                    }
+                else:
+                    env = {
+                        "SOURCE_DB": silver_db,
+                        "SOURCE_SCHEMA": "silver",
+                        "SOURCE_TABLE": "journeys_data",
+                        "TARGET_DIR": os.path.join(tmp, f"gold_{workers}"),
+                        "MERGE_WORKERS": str(workers),
+                    }
+                seconds = run_stage(stage, script, env)
+                single = single or seconds
+                print(
+                    f"{stage:>8} {workers:>8} {seconds:>10.2f} {single / seconds:>8.2f}"
+                )
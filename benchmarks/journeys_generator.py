@@ -0,0 +1,180 @@
+"""
+Synthetic generator of bronze vehicle activity data, i.e. the vehicle activity payloads
+of the JourneysAPI as dlt loads them to the bronze table, with the same denormalized
+`monitored_vehicle_journey__*` columns. Runs offline and is deterministic for a seed.
+
+Every load is a snapshot of all vehicles a few seconds apart. Like in the real data,
+some vehicles do not send a new location before the next snapshot, so their rows are
+repeated in the next load with the same primary key, and a few rows have nulls.
+
+Run from the root of the repository with e.g.
+    python benchmarks/journeys_generator.py 1000000 bronze.duckdb
+to write a bronze DuckDB database with 1M generated rows.
+"""
+
+import datetime
+import sys
+
+import duckdb
+import numpy as np
+import polars as pl
+
+VEHICLES = 300
+LINES = 40
+SNAPSHOT_SECONDS = 2
+START = datetime.datetime(2024, 4, 20, 5, 0, tzinfo=datetime.timezone.utc)
+JOURNEYS_URL = "http://data.itsfactory.fi/journeys/api/1/journeys"
+
+
+def zfill(expr: pl.Expr, width: int) -> pl.Expr:
+    return expr.cast(pl.String).str.zfill(width)
+
+
+def generate_vehicle_activity(
+    rows: int,
+    vehicles: int = VEHICLES,
+    duplicate_fraction: float = 0.01,
+    null_fraction: float = 0.001,
+    seed: int = 0,
+) -> pl.DataFrame:
+    """
+    Function generates bronze vehicle activity rows.
+
+    Params:
+        - rows: number of rows to generate, including the duplicated rows.
+        - vehicles: number of vehicles in each snapshot.
+        - duplicate_fraction: fraction of rows repeated in the next snapshot.
+        - null_fraction: fraction of rows with a null recorded_at_time or origin_short_name.
+        - seed: seed of the random numbers.
+    """
+    rng = np.random.default_rng(seed)
+    duplicates = int(rows * duplicate_fraction)
+    unique_rows = rows - duplicates
+    snapshot_ms = SNAPSHOT_SECONDS * 1000
+
+    i = pl.int_range(0, unique_rows, dtype=pl.Int64, eager=True)
+    df = pl.DataFrame(
+        {
+            "snapshot": i // vehicles,
+            "vehicle": i % vehicles,
+            "delay": rng.integers(-300, 900, unique_rows),
+            "longitude": rng.uniform(23.6, 24.0, unique_rows),
+            "latitude": rng.uniform(61.4, 61.6, unique_rows),
+            "speed": rng.uniform(0.0, 20.0, unique_rows).round(1),
+            "bearing": rng.uniform(0.0, 360.0, unique_rows).round(1),
+        }
+    ).with_columns(
+        line=pl.col("vehicle") % LINES,
+        direction=pl.col("vehicle") // LINES % 2 + 1,
+        # Vehicles send their location at different times within the snapshot.
+        recorded_at_time=pl.lit(START)
+        + pl.duration(
+            milliseconds=pl.col("snapshot") * snapshot_ms
+            + pl.col("vehicle") * (snapshot_ms // vehicles)
+        ),
+    )
+    df = df.with_columns(
+        # Journeys departed from the origin up to an hour before.
+        departure=(
+            pl.col("recorded_at_time").dt.hour().cast(pl.Int64) * 60
+            + pl.col("recorded_at_time").dt.minute().cast(pl.Int64)
+            - pl.col("vehicle") % 60
+        )
+        % 1440,
+        load_time=int(START.timestamp())
+        + pl.col("snapshot") * SNAPSHOT_SECONDS
+        + SNAPSHOT_SECONDS,
+    )
+
+    # Repeat rows of vehicles that did not update their location in the next snapshot.
+    repeated = df.sample(duplicates, seed=seed).with_columns(
+        load_time=pl.col("load_time") + SNAPSHOT_SECONDS
+    )
+    df = pl.concat([df, repeated]).sort("load_time")
+
+    line = pl.col("line").cast(pl.String)
+    delay = pl.col("delay").abs()
+    df = df.select(
+        recorded_at_time=pl.col("recorded_at_time"),
+        valid_until_time=pl.col("recorded_at_time") + pl.duration(seconds=30),
+        monitored_vehicle_journey__line_ref=line,
+        monitored_vehicle_journey__direction_ref=pl.col("direction").cast(pl.String),
+        monitored_vehicle_journey__framed_vehicle_journey_ref__date_frame_ref=pl.col(
+            "recorded_at_time"
+        )
+        .dt.date()
+        .cast(pl.String),
+        monitored_vehicle_journey__framed_vehicle_journey_ref__dated_vehicle_journey_ref=pl.format(
+            JOURNEYS_URL + "/{}_{}", line, zfill(pl.col("departure"), 4)
+        ),
+        monitored_vehicle_journey__vehicle_location__longitude=pl.col("longitude").cast(
+            pl.String
+        ),
+        monitored_vehicle_journey__vehicle_location__latitude=pl.col("latitude").cast(
+            pl.String
+        ),
+        monitored_vehicle_journey__operator_ref=pl.lit("TKL"),
+        monitored_vehicle_journey__bearing=pl.col("bearing").cast(pl.String),
+        monitored_vehicle_journey__delay=pl.format(
+            "{}P0Y0M0DT0H{}M{}.000S",
+            pl.when(pl.col("delay") < 0).then(pl.lit("-")).otherwise(pl.lit("")),
+            delay // 60,
+            zfill(delay % 60, 2),
+        ),
+        monitored_vehicle_journey__vehicle_ref=pl.format(
+            "TKL_{}", zfill(pl.col("vehicle"), 3)
+        ),
+        monitored_vehicle_journey__journey_pattern_ref=pl.format("{}V", line),
+        monitored_vehicle_journey__origin_short_name=zfill(
+            pl.col("line") * 100 + 15, 4
+        ),
+        monitored_vehicle_journey__destination_short_name=zfill(
+            pl.col("line") * 100 + 28, 4
+        ),
+        monitored_vehicle_journey__speed=pl.col("speed").cast(pl.String),
+        monitored_vehicle_journey__origin_aimed_departure_time=pl.concat_str(
+            zfill(pl.col("departure") // 60, 2), zfill(pl.col("departure") % 60, 2)
+        ),
+        _dlt_load_id=pl.col("load_time").cast(pl.String) + ".3070812",
+        _dlt_id=pl.format("{}", pl.int_range(0, pl.len())),
+    )
+
+    nulls = pl.Series(rng.random(rows) < null_fraction)
+    return df.with_columns(
+        pl.when(nulls).then(None).otherwise(pl.col(c)).alias(c)
+        for c in ["recorded_at_time", "monitored_vehicle_journey__origin_short_name"]
+    )
+
+
+def write_bronze(db_path: str, df: pl.DataFrame, schema: str = "bronze"):
+    """
+    Function writes generated rows to a bronze DuckDB database with the table
+    journeys_data and dlt's _dlt_loads table.
+
+    Params:
+        - db_path: filepath to the DuckDB database-file.
+        - df: rows generated with `generate_vehicle_activity`.
+        - schema: schema of the bronze tables.
+    """
+    with duckdb.connect(db_path) as db:
+        db.sql(f"CREATE SCHEMA IF NOT EXISTS {schema}")
+        db.sql(f"CREATE TABLE {schema}.journeys_data AS FROM df")
+        db.sql(
+            f"""CREATE TABLE {schema}._dlt_loads AS
+            SELECT DISTINCT
+                _dlt_load_id AS load_id,
+                0 AS status,
+                to_timestamp(_dlt_load_id::DOUBLE) AS inserted_at
+            FROM df
+            ORDER BY load_id"""
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        raise Exception(
+            "Usage: python benchmarks/journeys_generator.py <rows> <database-file>"
+        )
+    df = generate_vehicle_activity(int(sys.argv[1]))
+    write_bronze(sys.argv[2], df)
+    print(df)
@@ -1,16 +1,131 @@
 import dlt
-from dlt.sources.helpers import requests
 from dlt.pipeline.exceptions import PipelineStepFailed
+from dlt.sources.helpers.requests import RequestException
+import datetime
+import os
+import signal
+import sys
+import string
+import threading
 import time
-
-# JourneysAPI Vehicle Activity endpoint does not use pagination
-# and the amount of data is relatively low so we can just use the
-# response body directly instead of making a generator or a DltResource.
-response = requests.get(
-    "http://data.itsfactory.fi/journeys/api/1/vehicle-activity",
-    headers={"User-Agent": "Just using the API to test dlt"},
+from journeys_api import (
+    BASE_URL,
+    ENDPOINTS,
+    fetch_endpoints,
+    ingest_lag,
+    load_validators,
+    new_vehicle_activity,
+    save_validators,
 )
-response.raise_for_status()
+from writer_lock import acquire_lock, backoff, release_lock
+from instrumentation.metrics import RunMetrics
+
+# Comma separated list of JourneysAPI endpoints to ingest. Defaults to all endpoints.
+ENDPOINTS_TO_INGEST = os.getenv("ENDPOINTS")
+if ENDPOINTS_TO_INGEST is None:
+    ENDPOINTS_TO_INGEST = list(ENDPOINTS)
+else:
+    ENDPOINTS_TO_INGEST = ENDPOINTS_TO_INGEST.split(",")
+    if not all(endpoint in ENDPOINTS for endpoint in ENDPOINTS_TO_INGEST):
+        raise Exception(
+            f"Environment variable ENDPOINTS can only contain endpoints {', '.join(ENDPOINTS)}. "
+            + f"Current value: {os.getenv('ENDPOINTS')}"
+        )
+
+# Base url of the API. Can be pointed to e.g. a local stub server for testing.
+API_URL = os.getenv("JOURNEYS_API_URL", BASE_URL)
+
+# Maximum number of concurrent requests to the API.
+MAX_CONNECTIONS = os.getenv("MAX_CONNECTIONS")
+if MAX_CONNECTIONS is None:
+    MAX_CONNECTIONS = len(ENDPOINTS)
+else:
+    if not all(c in string.digits for c in MAX_CONNECTIONS) or MAX_CONNECTIONS == "0":
+        raise Exception(
+            f"Environment variable MAX_CONNECTIONS must be a positive integer. Current value: {MAX_CONNECTIONS}"
+        )
+    MAX_CONNECTIONS = int(MAX_CONNECTIONS)
+
+# Seconds between polls. If set, ingest keeps running and polls the API until it
+# gets SIGTERM instead of loading a single snapshot.
+POLL_INTERVAL = os.getenv("POLL_INTERVAL")
+if POLL_INTERVAL is not None:
+    if not all(c in string.digits for c in POLL_INTERVAL) or POLL_INTERVAL == "0":
+        raise Exception(
+            f"Environment variable POLL_INTERVAL must be a positive integer. Current value: {POLL_INTERVAL}"
+        )
+    POLL_INTERVAL = int(POLL_INTERVAL)
+
+# When polling, buffered snapshots are loaded when there are at least FLUSH_ROWS rows
+# or the oldest buffered snapshot is FLUSH_SECONDS old, whichever comes first.
+FLUSH_ROWS = os.getenv("FLUSH_ROWS", "10000")
+if not all(c in string.digits for c in FLUSH_ROWS):
+    raise Exception(
+        f"Environment variable FLUSH_ROWS can only contain digits. Current value: {FLUSH_ROWS}"
+    )
+FLUSH_ROWS = int(FLUSH_ROWS)
+
+FLUSH_SECONDS = os.getenv("FLUSH_SECONDS", "60")
+if not all(c in string.digits for c in FLUSH_SECONDS):
+    raise Exception(
+        f"Environment variable FLUSH_SECONDS can only contain digits. Current value: {FLUSH_SECONDS}"
+    )
+FLUSH_SECONDS = int(FLUSH_SECONDS)
+
+# Maximum number of seconds to wait for the writer lock and DuckDB before leaving the
+# data in the spool for the next run.
+LOCK_TIMEOUT = os.getenv("LOCK_TIMEOUT", "15")
+if not all(c in string.digits for c in LOCK_TIMEOUT):
+    raise Exception(
+        f"Environment variable LOCK_TIMEOUT can only contain digits. Current value: {LOCK_TIMEOUT}"
+    )
+LOCK_TIMEOUT = int(LOCK_TIMEOUT)
+
+# DuckDB database of the pipeline and the lock file next to it. Processes writing to
+# the database hold the lock.
+DB_PATH = "ingest_pipe.duckdb"
+LOCK_PATH = f"{DB_PATH}.lock"
+
+# ETag and Last-Modified headers of the latest loaded responses for conditional requests.
+VALIDATORS_PATH = os.path.join("pipes", "journeys_api_validators.json")
+
+
+def fetch(validators: dict, metrics: RunMetrics) -> dict[str, list]:
+    """
+    Function gets the data of all endpoints to ingest. Updates `validators` in place
+    and returns the rows of each endpoint whose data has changed.
+
+    Params:
+        - validators: validators of the previous responses by endpoint.
+        - metrics: metrics of the run.
+    """
+    with metrics.phase("fetch"):
+        results = fetch_endpoints(
+            base_url=API_URL,
+            endpoints=ENDPOINTS_TO_INGEST,
+            validators=validators,
+            max_connections=MAX_CONNECTIONS,
+        )
+    data = {}
+    for endpoint, (rows, new_validators) in results.items():
+        if rows is not None:
+            data[endpoint] = rows
+        validators[endpoint] = new_validators
+    return data
+
+
+def make_resources(data: dict[str, list]) -> list:
+    # Vehicle activity is a snapshot so every response is appended. The other endpoints
+    # are reference data so the tables are replaced whenever the data has changed.
+    return [
+        dlt.resource(
+            rows,
+            name=ENDPOINTS[endpoint],
+            write_disposition="append" if endpoint == "vehicle-activity" else "replace",
+        )
+        for endpoint, rows in data.items()
+    ]
+
 
 pipeline = dlt.pipeline(
     pipeline_name="ingest_pipe",
@@ -19,44 +134,182 @@ pipeline = dlt.pipeline(
     dataset_name="bronze",
 )
 
-success = False
-for i in range(3):
-    try:
-        load_info = pipeline.run(
-            data=response.json()["body"],
-            table_name="journeys_data",
-        )
-        success = True
-        break
-    except PipelineStepFailed as e:
-        print(
-            f"Pipeline failed. Maybe DuckDB is locked? Waiting and trying again. Try #{i+1}."
-        )
-        print("Actual error message:")
-        print("-" * 50)
-        print(e)
-        print("-" * 50)
-        print()
-        time.sleep(5.0)
-
-if not success:
-    pipeline_fallback = dlt.pipeline(
-        pipeline_name="ingest_pipe_fallback",
-        pipelines_dir="pipes",
-        destination="duckdb",
-        dataset_name="bronze",
-        full_refresh=True,
-    )
 
-    load_info = pipeline_fallback.run(
-        data=response.json()["body"],
-        table_name="journeys_data",
+def spool(data: dict[str, list], metrics: RunMetrics):
+    """
+    Function extracts and normalizes the data of all endpoints to a load package in
+    the pipeline's working directory. Does not touch the DuckDB database, so the data
+    is safe even if it can not be loaded right away. Pending load packages are loaded
+    with `drain`.
+
+    Params:
+        - data: rows by endpoint.
+        - metrics: metrics of the run.
+    """
+    with metrics.phase("extract"):
+        pipeline.extract(make_resources(data))
+    with metrics.phase("normalize"):
+        pipeline.normalize()
+    print(pipeline.last_trace.last_extract_info)
+    metrics.count("rows_in", sum(len(rows) for rows in data.values()))
+
+
+def drain(metrics: RunMetrics) -> bool:
+    """
+    Function loads all pending load packages to the DuckDB database while holding the
+    writer lock. If the lock is held by another process or DuckDB is locked, waits with
+    exponential backoff for at most LOCK_TIMEOUT seconds. Packages that could not be
+    loaded stay in the spool and are loaded on the next run.
+
+    Returns whether the spool was drained.
+
+    Params:
+        - metrics: metrics of the run.
+    """
+    started = time.monotonic()
+    attempt = 0
+    drained = False
+    while True:
+        attempt_started = time.monotonic()
+        lock = acquire_lock(LOCK_PATH)
+        if lock is not None:
+            try:
+                with metrics.phase("load"):
+                    load_info = pipeline.load()
+                print("-" * 10)
+                print(load_info)
+                drained = True
+            except PipelineStepFailed as e:
+                print(f"Loading failed. Maybe DuckDB is locked? Try #{attempt+1}.")
+                error = e
+            finally:
+                release_lock(lock)
+        else:
+            print(f"Writer lock is held by another process. Try #{attempt+1}.")
+            error = None
+        if drained:
+            break
+        remaining = LOCK_TIMEOUT - (time.monotonic() - started)
+        if remaining <= 0:
+            break
+        time.sleep(min(backoff(attempt), remaining))
+        attempt += 1
+
+    lock_wait = (attempt_started if drained else time.monotonic()) - started
+    spool_depth = len(pipeline.list_normalized_load_packages())
+    print(f"Lock wait: {lock_wait:.1f} s. Spool depth: {spool_depth} load packages.")
+    metrics.count("lock_wait_seconds", lock_wait)
+    metrics.set("spool_depth", spool_depth)
+    if os.path.exists(DB_PATH):
+        metrics.set("db_bytes", os.path.getsize(DB_PATH))
+    if not drained:
+        if error is not None:
+            print("Actual error message:")
+            print("-" * 50)
+            print(error)
+            print("-" * 50)
+            print()
+        print("*" * 50)
+        print("Could not load data into DuckDB. Data is kept in the spool.")
+        print("*" * 50)
+    return drained
+
+
+def ingest_once():
+    metrics = RunMetrics("bronze")
+    validators = load_validators(VALIDATORS_PATH)
+    data = fetch(validators, metrics)
+    for endpoint in ENDPOINTS_TO_INGEST:
+        if endpoint in data:
+            print(f"{endpoint}: {len(data[endpoint])} rows")
+        else:
+            print(f"{endpoint}: not modified")
+
+    spooled = len(pipeline.list_normalized_load_packages())
+    if len(data) == 0 and spooled == 0:
+        print("No new data.")
+        metrics.finish(status="no_data")
+        sys.exit(0)
+
+    if len(data) > 0:
+        spool(data, metrics)
+        save_validators(VALIDATORS_PATH, validators)
+    metrics.finish(status="success" if drain(metrics) else "spooled")
+
+
+def poll():
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+
+    validators = load_validators(VALIDATORS_PATH)
+    last_recorded = {}
+    buffer = {}
+    buffered_rows = 0
+    buffer_started = None
+    # Every load of the buffered snapshots is recorded as its own run.
+    metrics = RunMetrics("bronze")
+
+    print(
+        f"Polling every {POLL_INTERVAL} s. Loading every {FLUSH_ROWS} rows or {FLUSH_SECONDS} s."
     )
+    while True:
+        poll_started = time.monotonic()
+        if not stop.is_set():
+            try:
+                data = fetch(validators, metrics)
+            except RequestException as e:
+                print(f"Polling failed, trying again on the next poll: {e}")
+                data = {}
+
+            for endpoint, rows in data.items():
+                if endpoint == "vehicle-activity":
+                    rows = new_vehicle_activity(rows, last_recorded)
+                    buffer.setdefault(endpoint, []).extend(rows)
+                else:
+                    buffered_rows -= len(buffer.get(endpoint, []))
+                    buffer[endpoint] = rows
+                buffered_rows += len(rows)
+                if buffer_started is None and len(rows) > 0:
+                    buffer_started = poll_started
+
+        flush = buffer_started is not None and (
+            stop.is_set()
+            or buffered_rows >= FLUSH_ROWS
+            or time.monotonic() - buffer_started >= FLUSH_SECONDS
+        )
+        if flush:
+            spool(buffer, metrics)
+            save_validators(VALIDATORS_PATH, validators)
+            if drain(metrics):
+                lag = ingest_lag(
+                    buffer.get("vehicle-activity", []),
+                    datetime.datetime.now(datetime.timezone.utc),
+                )
+                print(
+                    f"Loaded {buffered_rows} rows. "
+                    + f"Ingest lag: {'-' if lag is None else f'{lag:.1f}'} s"
+                )
+                if lag is not None:
+                    metrics.set("ingest_lag_seconds", lag)
+                metrics.finish(status="success")
+            else:
+                metrics.finish(status="spooled")
+            if not stop.is_set():
+                metrics = RunMetrics("bronze")
+            buffer = {}
+            buffered_rows = 0
+            buffer_started = None
+
+        if stop.is_set():
+            print("Stopped polling.")
+            # Does nothing if the run was already finished by the last load.
+            metrics.finish(status="no_data")
+            break
+        stop.wait(max(0.0, POLL_INTERVAL - (time.monotonic() - poll_started)))
 
-    print("*" * 50)
-    print("Failed to load data into primary DuckDB-file. Loaded to fallback instead.")
-    print("*" * 50)
 
-print(pipeline.last_trace.last_extract_info)
-print("-" * 10)
-print(load_info)
+if POLL_INTERVAL is None:
+    ingest_once()
+else:
+    poll()
@@ -0,0 +1,184 @@
+import datetime
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dlt.sources.helpers import requests
+
+BASE_URL = "http://data.itsfactory.fi/journeys/api/1"
+USER_AGENT = "Just using the API to test dlt"
+
+# JourneysAPI endpoints and the bronze tables they are loaded to.
+ENDPOINTS = {
+    "vehicle-activity": "journeys_data",
+    "lines": "lines",
+    "journeys": "journeys",
+    "stop-points": "stop_points",
+    "routes": "routes",
+}
+
+
+def make_client(max_connections: int) -> requests.Client:
+    """
+    Function creates a client with a connection pool shared by all threads and
+    dlt's default retries.
+
+    Params:
+        - max_connections: maximum number of pooled connections to the API.
+    """
+    return requests.Client(
+        max_connections=max_connections,
+        session_attrs={"headers": {"User-Agent": USER_AGENT}},
+    )
+
+
+def fetch_endpoint(
+    client: requests.Client, base_url: str, endpoint: str, validators: dict
+) -> tuple[list | None, dict]:
+    """
+    Function gets all pages of an endpoint. The first request is a conditional request
+    using the ETag and Last-Modified validators of the previous response, if any.
+
+    Returns the rows of the response body, or None if the data has not been modified,
+    and the validators of the new response.
+
+    Params:
+        - client: client created with `make_client`.
+        - base_url: base url of the JourneysAPI.
+        - endpoint: name of the endpoint, e.g. "vehicle-activity".
+        - validators: validators of the previous response of the endpoint.
+    """
+    headers = {}
+    if "etag" in validators:
+        headers["If-None-Match"] = validators["etag"]
+    if "last_modified" in validators:
+        headers["If-Modified-Since"] = validators["last_modified"]
+
+    response = client.get(f"{base_url}/{endpoint}", headers=headers)
+    if response.status_code == 304:
+        return None, validators
+
+    new_validators = {}
+    if "ETag" in response.headers:
+        new_validators["etag"] = response.headers["ETag"]
+    if "Last-Modified" in response.headers:
+        new_validators["last_modified"] = response.headers["Last-Modified"]
+
+    rows = []
+    while True:
+        payload = response.json()
+        rows.extend(payload["body"])
+        paging = payload.get("data", {}).get("headers", {}).get("paging", {})
+        if not paging.get("moreData", False):
+            break
+        response = client.get(
+            f"{base_url}/{endpoint}",
+            params={"startIndex": paging["startIndex"] + paging["pageSize"]},
+        )
+
+    return rows, new_validators
+
+
+def fetch_endpoints(
+    base_url: str, endpoints: list[str], validators: dict, max_connections: int
+) -> dict[str, tuple[list | None, dict]]:
+    """
+    Function gets all endpoints concurrently. The pages of a single endpoint are
+    fetched one after another since each page tells if there is more data.
+
+    Returns the result of `fetch_endpoint` for each endpoint.
+
+    Params:
+        - base_url: base url of the JourneysAPI.
+        - endpoints: names of the endpoints.
+        - validators: validators of the previous responses by endpoint.
+        - max_connections: maximum number of concurrent requests.
+    """
+    client = make_client(max_connections)
+    with ThreadPoolExecutor(max_workers=max_connections) as pool:
+        results = pool.map(
+            lambda endpoint: fetch_endpoint(
+                client, base_url, endpoint, validators.get(endpoint, {})
+            ),
+            endpoints,
+        )
+        return dict(zip(endpoints, results))
+
+
+def load_validators(path: str) -> dict:
+    """
+    Function reads the validators of the previous responses from a JSON file.
+
+    Params:
+        - path: path to the JSON file.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_validators(path: str, validators: dict):
+    """
+    Function writes the validators of the latest responses to a JSON file.
+    Should only be called after the responses have been spooled, i.e. extracted and
+    normalized to a load package. The load package is kept until it is loaded, so the
+    responses are not lost even if loading them fails, and fetching them again would
+    only load them twice.
+
+    Params:
+        - path: path to the JSON file.
+        - validators: validators by endpoint.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(validators, f)
+
+
+def new_vehicle_activity(rows: list, last_recorded: dict) -> list:
+    """
+    Function drops the vehicle activity rows that were already seen in an earlier
+    snapshot, i.e. the vehicle has not reported a new position since. Polling more
+    often than vehicles report their positions otherwise loads the same rows many
+    times.
+
+    Updates `last_recorded` in place.
+
+    Params:
+        - rows: rows of a vehicle activity response.
+        - last_recorded: latest recordedAtTime of each vehicle seen so far.
+    """
+    new_rows = []
+    for row in rows:
+        vehicle = row.get("monitoredVehicleJourney", {}).get("vehicleRef")
+        recorded_at = row.get("recordedAtTime")
+        if vehicle is not None and last_recorded.get(vehicle) == recorded_at:
+            continue
+        last_recorded[vehicle] = recorded_at
+        new_rows.append(row)
+    return new_rows
+
+
+def ingest_lag(rows: list, loaded_at: datetime.datetime) -> float | None:
+    """
+    Function calculates the ingest lag in seconds, i.e. the time between recording
+    the oldest vehicle activity row and loading it. Returns None if no row has a
+    valid recordedAtTime.
+
+    Params:
+        - rows: loaded vehicle activity rows.
+        - loaded_at: time the rows were loaded, timezone aware.
+    """
+    recorded_at_times = []
+    for row in rows:
+        try:
+            recorded_at = datetime.datetime.fromisoformat(
+                row["recordedAtTime"].replace("Z", "+00:00")
+            )
+        except (KeyError, AttributeError, ValueError):
+            continue
+        if recorded_at.tzinfo is None:
+            recorded_at = recorded_at.replace(tzinfo=datetime.timezone.utc)
+        recorded_at_times.append(recorded_at)
+    if len(recorded_at_times) == 0:
+        return None
+    return (loaded_at - min(recorded_at_times)).total_seconds()
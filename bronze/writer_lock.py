@@ -0,0 +1,48 @@
+import fcntl
+import os
+import random
+
+
+def acquire_lock(path: str) -> int | None:
+    """
+    Function tries to take an exclusive lock on a lock file without waiting. Only one
+    process holding the lock writes to the bronze DuckDB database at a time.
+
+    Returns the file descriptor of the lock file, or None if another process holds
+    the lock. The lock is released with `release_lock` or when the process exits.
+
+    Params:
+        - path: path to the lock file. Created if it does not exist.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def release_lock(fd: int):
+    """
+    Function releases a lock taken with `acquire_lock`.
+
+    Params:
+        - fd: file descriptor returned by `acquire_lock`.
+    """
+    fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
+
+
+def backoff(attempt: int, base: float = 0.1, cap: float = 5.0) -> float:
+    """
+    Function returns how many seconds to wait before the next attempt. Exponential
+    backoff with full jitter so processes waiting for the same lock do not retry in
+    lockstep.
+
+    Params:
+        - attempt: number of failed attempts so far, starting from 0.
+        - base: maximum wait after the first failed attempt.
+        - cap: maximum wait after any attempt.
+    """
+    return random.uniform(0, min(cap, base * 2**attempt))
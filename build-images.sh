@@ -1,9 +1,9 @@
 #!/bin/sh
 
 eval $(minikube docker-env)
-docker build -t ingest:0.1 ./bronze
-docker build -t transform:0.1 ./silver
-docker build -t export:0.1 ./gold
+docker build -t ingest:0.1 -f bronze/Dockerfile .
+docker build -t transform:0.1 -f silver/Dockerfile .
+docker build -t export:0.1 -f gold/Dockerfile .
 
 kubectl create secret generic transform-env --from-env-file=silver/env --namespace=argo
 kubectl create secret generic export-env --from-env-file=gold/env --namespace=argo
@@ -0,0 +1,241 @@
+import duckdb
+import fcntl
+import os
+import pyarrow.compute as pc
+import string
+import sys
+from deltalake import DeltaTable
+from instrumentation.metrics import RunMetrics
+
+SOURCE_DB = os.getenv("SOURCE_DB")
+SOURCE_SCHEMA = os.getenv("SOURCE_SCHEMA")
+SOURCE_TABLE = os.getenv("SOURCE_TABLE")
+TARGET_DB = os.getenv("TARGET_DB")
+TARGET_SCHEMA = os.getenv("TARGET_SCHEMA")
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR")
+RETENTION_HOURS = os.getenv("RETENTION_HOURS")
+
+# Storage of the silver tables. With "duckdb" TARGET_DB is a DuckDB database-file, with
+# "delta" it is the directory of the silver Delta tables.
+SILVER_STORAGE = os.getenv("SILVER_STORAGE", "duckdb").lower()
+if SILVER_STORAGE not in ["duckdb", "delta"]:
+    raise Exception(
+        f"Environment variable SILVER_STORAGE must be either duckdb or delta. Current value: {SILVER_STORAGE}"
+    )
+
+# If true, the bronze database file is also rewritten after archiving. DuckDB reuses
+# the space freed by the deleted rows but never shrinks the file by itself.
+COMPACT = os.getenv("COMPACT")
+if COMPACT is not None and COMPACT.lower() == "true":
+    COMPACT = True
+else:
+    COMPACT = False
+
+if None in [
+    SOURCE_DB,
+    SOURCE_SCHEMA,
+    SOURCE_TABLE,
+    TARGET_DB,
+    TARGET_SCHEMA,
+    ARCHIVE_DIR,
+]:
+    raise Exception(
+        "You must set environment variables $SOURCE_DB, $SOURCE_SCHEMA, "
+        + "$SOURCE_TABLE, $TARGET_DB, $TARGET_SCHEMA, and $ARCHIVE_DIR"
+    )
+
+if RETENTION_HOURS is None:
+    RETENTION_HOURS = 7 * 24  # Default retention time of 7 days.
+else:
+    if not all(c in string.digits for c in RETENTION_HOURS):
+        raise Exception(
+            f"Environment variable RETENTION_HOURS can only contain digits. Current value: {RETENTION_HOURS}"
+        )
+    RETENTION_HOURS = int(RETENTION_HOURS)
+
+
+def get_silver_checkpoint() -> str | None:
+    """
+    Function gets the load id of the latest load in silver. Loads after it have not
+    been transformed yet, so they are never archived.
+    """
+    if not os.path.exists(TARGET_DB):
+        return None
+    if SILVER_STORAGE == "delta":
+        loads = DeltaTable(os.path.join(TARGET_DB, TARGET_SCHEMA, "loads"))
+        return pc.max(loads.to_pyarrow_table(columns=["load_id"])["load_id"]).as_py()
+    with duckdb.connect(TARGET_DB, read_only=True) as db:
+        checkpoint = db.sql(
+            f"SELECT MAX(load_id) FROM {TARGET_SCHEMA}.loads"
+        ).fetchall()[0][0]
+
+    return checkpoint
+
+
+def get_archive_until(db: duckdb.DuckDBPyConnection, checkpoint: str) -> str | None:
+    """
+    Function gets the load id of the latest load to archive, i.e. the latest completed
+    load older than RETENTION_HOURS that has already been transformed to silver.
+    Returns None if the bronze table has no such loads left.
+
+    Params:
+        - db: connection to the bronze database.
+        - checkpoint: load id of the latest load in silver.
+    """
+    return db.sql(
+        f"""SELECT MAX(load_id) FROM {SOURCE_SCHEMA}._dlt_loads
+        WHERE status = 0
+            AND load_id <= {checkpoint}::VARCHAR
+            AND inserted_at < now() - INTERVAL ({RETENTION_HOURS}) HOUR
+            AND load_id >= (SELECT MIN(_dlt_load_id) FROM {SOURCE_SCHEMA}.{SOURCE_TABLE})"""
+    ).fetchall()[0][0]
+
+
+def get_child_tables(db: duckdb.DuckDBPyConnection) -> list[tuple[str, str]]:
+    """
+    Function gets the tables dlt created for the nested lists of the bronze table and
+    their parent tables. Parents come before their children.
+
+    Params:
+        - db: connection to the bronze database.
+    """
+    children = sorted(
+        (
+            row[0]
+            for row in db.sql(
+                f"""SELECT table_name FROM information_schema.columns
+                WHERE table_schema = '{SOURCE_SCHEMA}'
+                    AND column_name = '_dlt_parent_id'
+                    AND starts_with(table_name, '{SOURCE_TABLE}__')"""
+            ).fetchall()
+        ),
+        key=len,
+    )
+    child_tables = []
+    for child in children:
+        parent = max(
+            (t for t in [SOURCE_TABLE] + children if child.startswith(f"{t}__")),
+            key=len,
+        )
+        child_tables.append((child, parent))
+    return child_tables
+
+
+def archive(db: duckdb.DuckDBPyConnection, until_load: str) -> int:
+    """
+    Function exports all rows of the loads up to and including until_load from the
+    bronze table and its child tables to ZSTD compressed Parquet files partitioned by
+    the date of the load, and deletes them from the bronze database. Returns the total
+    number of archived rows.
+
+    Rows of the child tables do not have a load id, so the load id of their root row
+    is added to the archived rows.
+
+    Params:
+        - db: connection to the bronze database.
+        - until_load: load id of the latest load to archive.
+    """
+    db.sql("BEGIN TRANSACTION")
+
+    # Ids and load ids of the rows to archive from each table.
+    ids = {SOURCE_TABLE: "archive_ids_0"}
+    db.sql(
+        f"""CREATE TEMP TABLE archive_ids_0 AS
+        SELECT _dlt_id, _dlt_load_id FROM {SOURCE_SCHEMA}.{SOURCE_TABLE}
+        WHERE _dlt_load_id <= {until_load}::VARCHAR"""
+    )
+    for i, (child, parent) in enumerate(get_child_tables(db)):
+        ids[child] = f"archive_ids_{i + 1}"
+        db.sql(
+            f"""CREATE TEMP TABLE {ids[child]} AS
+            SELECT t._dlt_id, parent_ids._dlt_load_id
+            FROM {SOURCE_SCHEMA}.{child} AS t
+            JOIN {ids[parent]} AS parent_ids ON t._dlt_parent_id = parent_ids._dlt_id"""
+        )
+
+    archived_rows = 0
+    for table, ids_table in ids.items():
+        archive_path = os.path.join(ARCHIVE_DIR, table)
+        os.makedirs(archive_path, exist_ok=True)
+        load_id_column = "" if table == SOURCE_TABLE else "ids._dlt_load_id,"
+        db.sql(
+            f"""COPY (
+                SELECT
+                    t.*,
+                    {load_id_column}
+                    to_timestamp(ids._dlt_load_id::DOUBLE)::TIMESTAMP::DATE AS load_date
+                FROM {SOURCE_SCHEMA}.{table} AS t
+                JOIN {ids_table} AS ids ON t._dlt_id = ids._dlt_id
+            ) TO '{archive_path}' (
+                FORMAT PARQUET,
+                COMPRESSION ZSTD,
+                PARTITION_BY (load_date),
+                OVERWRITE_OR_IGNORE true,
+                FILENAME_PATTERN 'data_{{uuid}}'
+            )"""
+        )
+        deleted_rows = db.execute(
+            f"""DELETE FROM {SOURCE_SCHEMA}.{table}
+            WHERE _dlt_id IN (SELECT _dlt_id FROM {ids_table})"""
+        ).fetchone()[0]
+        print(f"{table}: archived {deleted_rows} rows")
+        archived_rows += deleted_rows
+
+    db.sql("COMMIT")
+    return archived_rows
+
+
+def compact():
+    """
+    Function rewrites the bronze database to a new file and replaces the old file with
+    it to give the space of the deleted rows back to the file system.
+    """
+    compacted = f"{SOURCE_DB}.compact"
+    if os.path.exists(compacted):
+        os.remove(compacted)
+    with duckdb.connect(SOURCE_DB) as db:
+        catalog = db.sql("SELECT current_database()").fetchall()[0][0]
+        db.sql(f"ATTACH '{compacted}' AS compacted")
+        db.sql(f"COPY FROM DATABASE {catalog} TO compacted")
+        db.sql("DETACH compacted")
+    os.replace(compacted, SOURCE_DB)
+
+
+metrics = RunMetrics("archive_old_loads")
+
+# Hold the same lock as bronze ingestion while writing to the bronze database.
+# Waits for a running ingestion to finish.
+with metrics.phase("lock_wait"):
+    lock = os.open(f"{SOURCE_DB}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+    fcntl.flock(lock, fcntl.LOCK_EX)
+
+checkpoint = get_silver_checkpoint()
+if checkpoint is None:
+    print("Nothing has been loaded to silver yet. Nothing to archive.")
+    metrics.finish(status="no_data")
+    sys.exit(0)
+
+size_before = os.path.getsize(SOURCE_DB)
+with duckdb.connect(SOURCE_DB) as db:
+    until_load = get_archive_until(db, checkpoint)
+    if until_load is None:
+        print(f"No loads older than {RETENTION_HOURS} hours to archive.")
+        metrics.finish(status="no_data")
+        sys.exit(0)
+
+    print(f"Archiving loads up to {until_load} to {ARCHIVE_DIR}")
+    print("*" * 50)
+    with metrics.phase("archive"):
+        metrics.set("rows_archived", archive(db, until_load))
+        db.sql("CHECKPOINT")
+
+if COMPACT:
+    with metrics.phase("compact"):
+        compact()
+
+size_after = os.path.getsize(SOURCE_DB)
+print("*" * 50)
+print(f"Bronze database size: {size_before} -> {size_after} bytes")
+metrics.set("db_bytes_before", size_before)
+metrics.set("db_bytes_after", size_after)
+metrics.finish()
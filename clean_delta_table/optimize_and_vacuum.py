@@ -1,33 +1,232 @@
 from deltalake import DeltaTable
+import datetime
 import os
 import string
+from instrumentation.metrics import RunMetrics
 
-TABLE_PATH = os.getenv("TARGET_TABLE_PATH")
-RETENTION_HOURS = os.getenv("RETENTION_HOURS")
 
-if TABLE_PATH is None:
-    raise Exception("You must set the environment variable $TARGET_TABLE_PATH")
+def get_target_size(table: DeltaTable, target_file_size_mb: int | None = None) -> int:
+    """
+    Function gets the target file size of optimize in bytes.
 
-if RETENTION_HOURS is None:
-    RETENTION_HOURS = 7 * 24  # Default retention time of 7 days.
-else:
-    if not all(c in string.digits for c in RETENTION_HOURS):
+    Params:
+        - table: the Delta table.
+        - target_file_size_mb: if given, used instead of the table's
+          delta.targetFileSize.
+    """
+    if target_file_size_mb is not None:
+        return target_file_size_mb * 1024 * 1024
+    configuration = table.metadata().configuration
+    return int(configuration.get("delta.targetFileSize", 256 * 1024 * 1024))
+
+
+def get_file_stats(table: DeltaTable) -> tuple[int, int]:
+    """
+    Function gets the number of files and their total size in bytes from the Delta log.
+
+    Params:
+        - table: the Delta table.
+    """
+    actions = table.get_add_actions(flatten=True)
+    return actions.num_rows, sum(actions.column("size_bytes").to_pylist())
+
+
+def plan_partitions(
+    table: DeltaTable,
+    target_size: int,
+    min_small_files: int,
+    changed_within_hours: int | None = None,
+    max_partitions: int | None = None,
+) -> list[list[tuple[str, str, str | list[str]]]] | None:
+    """
+    Function decides which partitions to optimize based on the files in the Delta log.
+    A partition is optimized if it has at least min_small_files files smaller than
+    target_size and, if changed_within_hours is given, files added within that time.
+
+    Returns a list of partition filters to run optimize with, an empty list if there is
+    nothing to optimize, or None if the table is not partitioned and should be
+    optimized as a whole.
+
+    Params:
+        - table: the Delta table.
+        - target_size: target file size of optimize in bytes.
+        - min_small_files: partitions with fewer small files are not optimized.
+        - changed_within_hours: if given, only optimize partitions with files added
+          within this many hours.
+        - max_partitions: if given, optimize at most this many partitions, the ones
+          with the most small files first.
+    """
+    partition_columns = table.metadata().partition_columns
+    actions = table.get_add_actions(flatten=True).to_pylist()
+    changed_after = None
+    if changed_within_hours is not None:
+        changed_after = datetime.datetime.now(
+            datetime.timezone.utc
+        ) - datetime.timedelta(hours=changed_within_hours)
+
+    small_files = {}
+    changed = set()
+    for action in actions:
+        partition = tuple(str(action[f"partition.{c}"]) for c in partition_columns)
+        if action["size_bytes"] < target_size:
+            small_files[partition] = small_files.get(partition, 0) + 1
+        modification_time = action["modification_time"]
+        if modification_time.tzinfo is None:
+            modification_time = modification_time.replace(tzinfo=datetime.timezone.utc)
+        if changed_after is None or modification_time >= changed_after:
+            changed.add(partition)
+
+    partitions = sorted(
+        (
+            partition
+            for partition, count in small_files.items()
+            if count >= min_small_files and partition in changed
+        ),
+        key=lambda partition: small_files[partition],
+        reverse=True,
+    )
+    if max_partitions is not None:
+        partitions = partitions[:max_partitions]
+
+    for partition in partitions:
+        print(f"Partition {partition}: {small_files[partition]} small files")
+
+    if len(partitions) == 0:
+        return []
+    if len(partition_columns) == 0:
+        return None
+    if len(partition_columns) == 1:
+        return [[(partition_columns[0], "in", [p[0] for p in partitions])]]
+    # Optimize does not support OR between partition filters, so each partition is
+    # optimized separately when the table has multiple partition columns.
+    return [
+        [(c, "=", value) for c, value in zip(partition_columns, partition)]
+        for partition in partitions
+    ]
+
+
+if __name__ == "__main__":
+    TABLE_PATH = os.getenv("TARGET_TABLE_PATH")
+    RETENTION_HOURS = os.getenv("RETENTION_HOURS")
+
+    # Comma separated list of columns to Z-order the files by, e.g. "line,vehicle".
+    # If not set, the files are only compacted.
+    Z_ORDER_COLUMNS = os.getenv("Z_ORDER_COLUMNS")
+
+    # Size of the files written by optimize in megabytes. Files smaller than this are
+    # counted as small files. Defaults to the table's delta.targetFileSize or 256 MB.
+    TARGET_FILE_SIZE_MB = os.getenv("TARGET_FILE_SIZE_MB")
+
+    # Partitions with fewer small files than this are not optimized.
+    MIN_SMALL_FILES = os.getenv("MIN_SMALL_FILES", "5")
+
+    # If set, only partitions with files added in the last CHANGED_WITHIN_HOURS hours
+    # are optimized.
+    CHANGED_WITHIN_HOURS = os.getenv("CHANGED_WITHIN_HOURS")
+
+    # If set, at most this many partitions are optimized, the ones with the most small
+    # files first.
+    MAX_PARTITIONS = os.getenv("MAX_PARTITIONS")
+
+    if TABLE_PATH is None:
+        raise Exception("You must set the environment variable $TARGET_TABLE_PATH")
+
+    if RETENTION_HOURS is None:
+        RETENTION_HOURS = 7 * 24  # Default retention time of 7 days.
+    else:
+        if not all(c in string.digits for c in RETENTION_HOURS):
+            raise Exception(
+                f"Environment variable RETENTION_HOURS can only contain digits. Current value: {RETENTION_HOURS}"
+            )
+        RETENTION_HOURS = int(RETENTION_HOURS)
+
+    if Z_ORDER_COLUMNS is not None:
+        Z_ORDER_COLUMNS = Z_ORDER_COLUMNS.split(",")
+
+    if TARGET_FILE_SIZE_MB is not None:
+        if not all(c in string.digits for c in TARGET_FILE_SIZE_MB):
+            raise Exception(
+                f"Environment variable TARGET_FILE_SIZE_MB can only contain digits. Current value: {TARGET_FILE_SIZE_MB}"
+            )
+        TARGET_FILE_SIZE_MB = int(TARGET_FILE_SIZE_MB)
+
+    if not all(c in string.digits for c in MIN_SMALL_FILES):
         raise Exception(
-            f"Environment variable RETENTION_HOURS can only contain digits. Current value: {RETENTION_HOURS}"
+            f"Environment variable MIN_SMALL_FILES can only contain digits. Current value: {MIN_SMALL_FILES}"
+        )
+    MIN_SMALL_FILES = int(MIN_SMALL_FILES)
+
+    if CHANGED_WITHIN_HOURS is not None:
+        if not all(c in string.digits for c in CHANGED_WITHIN_HOURS):
+            raise Exception(
+                f"Environment variable CHANGED_WITHIN_HOURS can only contain digits. Current value: {CHANGED_WITHIN_HOURS}"
+            )
+        CHANGED_WITHIN_HOURS = int(CHANGED_WITHIN_HOURS)
+
+    if MAX_PARTITIONS is not None:
+        if not all(c in string.digits for c in MAX_PARTITIONS):
+            raise Exception(
+                f"Environment variable MAX_PARTITIONS can only contain digits. Current value: {MAX_PARTITIONS}"
+            )
+        MAX_PARTITIONS = int(MAX_PARTITIONS)
+
+    metrics = RunMetrics("optimize_and_vacuum")
+
+    table = DeltaTable(TABLE_PATH)
+    files_before, bytes_before = get_file_stats(table)
+
+    print(f"Cleaning up delta table {TABLE_PATH}")
+    print(f"Files: {files_before}, bytes: {bytes_before}")
+    print()
+
+    with metrics.phase("plan"):
+        target_size = get_target_size(table, TARGET_FILE_SIZE_MB)
+        partition_filters = plan_partitions(
+            table, target_size, MIN_SMALL_FILES, CHANGED_WITHIN_HOURS, MAX_PARTITIONS
         )
-    RETENTION_HOURS = int(RETENTION_HOURS)
+    print(f"Planning took {metrics.phases['plan']:.2f} s")
+    print("*" * 50)
 
-table = DeltaTable(TABLE_PATH)
+    if partition_filters is not None and len(partition_filters) == 0:
+        print(
+            f"No partitions with at least {MIN_SMALL_FILES} small files. Skipping optimize."
+        )
+    with metrics.phase("optimize"):
+        for filters in [None] if partition_filters is None else partition_filters:
+            if Z_ORDER_COLUMNS is not None:
+                print(f"Z-ordering by {', '.join(Z_ORDER_COLUMNS)}:")
+                optimize_metrics = table.optimize.z_order(
+                    Z_ORDER_COLUMNS, partition_filters=filters, target_size=target_size
+                )
+            else:
+                print("Optimizing table:")
+                optimize_metrics = table.optimize.compact(
+                    partition_filters=filters, target_size=target_size
+                )
+            print(optimize_metrics)
+            metrics.count("files_added", optimize_metrics["numFilesAdded"])
+            metrics.count("files_removed", optimize_metrics["numFilesRemoved"])
+    print(f"Optimize took {metrics.phases['optimize']:.2f} s")
+    print("*" * 50)
 
-print(f"Cleaning up delta table {TABLE_PATH}")
-print()
-print("Optimizing table:")
-print(table.optimize.compact())
-print("*" * 50)
+    print(f"Vacuuming table with retention {RETENTION_HOURS}:")
+    with metrics.phase("vacuum"):
+        vacuumed_files = table.vacuum(
+            retention_hours=RETENTION_HOURS,
+            enforce_retention_duration=False,
+            dry_run=False,
+        )
+    print(vacuumed_files)
+    print(f"Vacuum took {metrics.phases['vacuum']:.2f} s")
+    print("*" * 50)
 
-print(f"Vacuuming table with retention {RETENTION_HOURS}:")
-print(
-    table.vacuum(
-        retention_hours=RETENTION_HOURS, enforce_retention_duration=False, dry_run=False
+    files_after, bytes_after = get_file_stats(table)
+    print(
+        f"Files: {files_before} -> {files_after}, bytes: {bytes_before} -> {bytes_after}"
     )
-)
+    metrics.set("files_before", files_before)
+    metrics.set("files_after", files_after)
+    metrics.set("bytes_before", bytes_before)
+    metrics.set("bytes_after", bytes_after)
+    metrics.set("files_vacuumed", len(vacuumed_files))
+    metrics.finish()
@@ -0,0 +1,189 @@
+import deltalake
+import os
+import polars as pl
+from deltalake import DeltaTable, write_deltalake
+from delta_operations.functions import (
+    PARTITION_COLUMN,
+    TARGET_TABLE_PK,
+    WRITE_OPTIONS,
+    check_time_columns,
+    merge_partitioned,
+    read_partitions,
+    upsert,
+)
+
+# Dimension tables and their key columns. Every distinct key is stored once with the
+# first and last date it was seen on.
+DIMENSIONS = {
+    "dim_line": ["line", "operator"],
+    "dim_vehicle": ["vehicle", "operator"],
+    "dim_journey_pattern": [
+        "journey_pattern",
+        "line",
+        "direction",
+        "origin_short_name",
+        "destination_short_name",
+    ],
+    "dim_stop": ["stop_short_name"],
+}
+
+# Delay statistics per line, direction and hour of the day, partitioned by date like
+# the fact table.
+ROLLUP_TABLE = "delay_hourly"
+ROLLUP_PK = [PARTITION_COLUMN, "line", "direction", "hour"]
+ROLLUP_COLUMNS = list(dict.fromkeys(TARGET_TABLE_PK + ["delay", "speed"]))
+HOUR_MICROSECONDS = 3_600_000_000
+HOUR = (pl.col("time") // HOUR_MICROSECONDS).cast(pl.Int8).alias("hour")
+
+
+def table_exists(table_path: str) -> bool:
+    """
+    Function checks if there is a Delta table in table_path.
+
+    Params:
+        - table_path: path to the Delta table.
+    """
+    try:
+        DeltaTable(table_path)
+    except deltalake._internal.TableNotFoundError:
+        return False
+    return True
+
+
+def dimension_rows(source_df: pl.DataFrame, dimension: str) -> pl.DataFrame:
+    """
+    Function gets the distinct keys of a dimension in source_df with the first and last
+    date they were seen on.
+
+    Params:
+        - source_df: new rows of the fact table.
+        - dimension: name of the dimension table, a key of DIMENSIONS.
+    """
+    if dimension == "dim_stop":
+        # Stops are both origins and destinations of journeys.
+        source_df = pl.concat(
+            [
+                source_df.select(
+                    PARTITION_COLUMN, stop_short_name=pl.col(col_name)
+                ).unique()
+                for col_name in ["origin_short_name", "destination_short_name"]
+            ]
+        )
+    return (
+        source_df.group_by(DIMENSIONS[dimension])
+        .agg(
+            first_seen=pl.col(PARTITION_COLUMN).min(),
+            last_seen=pl.col(PARTITION_COLUMN).max(),
+        )
+        .sort(DIMENSIONS[dimension])
+    )
+
+
+def update_dimension(source_df: pl.DataFrame, table_path: str, dimension: str) -> bool:
+    """
+    Function inserts the new keys of a dimension in source_df to the dimension table and
+    updates the dates the existing keys were last seen on. The dimension tables are
+    small, so the table is rewritten as a whole, but only if something changed.
+    Returns whether the table was written.
+
+    Params:
+        - source_df: new rows of the fact table.
+        - table_path: path to the dimension Delta table.
+        - dimension: name of the dimension table, a key of DIMENSIONS.
+    """
+    new_df = dimension_rows(source_df, dimension)
+    if table_exists(table_path):
+        current_df = pl.read_delta(table_path).cast(dict(new_df.schema))
+        new_df = (
+            pl.concat([current_df, new_df])
+            .group_by(DIMENSIONS[dimension])
+            .agg(pl.col("first_seen").min(), pl.col("last_seen").max())
+            .sort(DIMENSIONS[dimension])
+        )
+        if new_df.equals(current_df.sort(DIMENSIONS[dimension])):
+            return False
+
+    write_deltalake(table_path, new_df.to_arrow(), mode="overwrite", **WRITE_OPTIONS)
+    return True
+
+
+def update_dimensions(source_df: pl.DataFrame, target_dir: str) -> list[str]:
+    """
+    Function updates all dimension tables in DIMENSIONS with the new rows of the fact
+    table. Returns the names of the tables that changed.
+
+    Params:
+        - source_df: new rows of the fact table.
+        - target_dir: directory of the gold Delta tables.
+    """
+    return [
+        dimension
+        for dimension in DIMENSIONS
+        if update_dimension(source_df, os.path.join(target_dir, dimension), dimension)
+    ]
+
+
+def hourly_delays(rows: pl.DataFrame) -> pl.DataFrame:
+    """
+    Function computes the delay statistics of each date, line, direction and hour of the
+    day. The hour is the hour of `time`.
+
+    Params:
+        - rows: rows of the fact table with ROLLUP_COLUMNS.
+    """
+    return (
+        rows.with_columns(HOUR)
+        .group_by(ROLLUP_PK)
+        .agg(
+            observations=pl.len().cast(pl.Int64),
+            mean_delay=pl.col("delay").mean(),
+            p50_delay=pl.col("delay").quantile(0.5),
+            p95_delay=pl.col("delay").quantile(0.95),
+            mean_speed=pl.col("speed").mean(),
+        )
+        .sort(ROLLUP_PK)
+    )
+
+
+def update_rollups(
+    source_df: pl.DataFrame, fact_path: str, rollup_path: str, workers: int = 1
+) -> int:
+    """
+    Function recomputes the rollups of the groups in ROLLUP_PK that have new rows in
+    source_df and upserts them to the rollup table. The groups are recomputed from the
+    rows of the fact table upserted with source_df, so this can be called before
+    merging source_df to the fact table, and calling it again with the same rows gives
+    the same result. Only the partitions of the fact table with new rows are read.
+    Returns the number of recomputed groups.
+
+    Params:
+        - source_df: new rows of the fact table, deduplicated by primary key.
+        - fact_path: path to the fact Delta table.
+        - rollup_path: path to the rollup Delta table.
+        - workers: maximum number of rollup partitions to merge concurrently.
+    """
+    source_df = source_df.select(ROLLUP_COLUMNS)
+    touched = source_df.select(PARTITION_COLUMN, "line", "direction", HOUR).unique()
+
+    rows = source_df
+    if table_exists(fact_path):
+        check_time_columns(fact_path)
+        partitions = touched[PARTITION_COLUMN].unique().cast(pl.String).to_list()
+        current_df = read_partitions(fact_path, partitions, ROLLUP_COLUMNS).cast(
+            dict(source_df.schema)
+        )
+        rows = upsert(current_df, source_df)
+    rows = rows.with_columns(HOUR).join(touched, on=ROLLUP_PK, how="semi")
+    rollups = hourly_delays(rows.drop("hour"))
+
+    if table_exists(rollup_path):
+        merge_partitioned(rollups, rollup_path, workers, pk=ROLLUP_PK)
+    else:
+        write_deltalake(
+            rollup_path,
+            rollups.to_arrow(),
+            mode="overwrite",
+            partition_by=[PARTITION_COLUMN],
+            **WRITE_OPTIONS,
+        )
+    return len(rollups)
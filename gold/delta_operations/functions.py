@@ -0,0 +1,417 @@
+import deltalake
+import datetime
+import polars as pl
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from deltalake import DeltaTable, write_deltalake
+from concurrent.futures import ThreadPoolExecutor
+
+TARGET_TABLE_PK = ["date", "time", "line", "direction", "origin_aimed_departure_time"]
+PARTITION_COLUMN = "date"
+WATERMARK_COLUMN = "update_time"
+# Delta Lake has no time type, so the TIME columns of silver are stored as microseconds
+# since midnight in int64 columns.
+TIME_COLUMNS = ["time", "origin_aimed_departure_time"]
+# Columns added to silver after the gold table was created, with the type and the value
+# of the rows written before them. Departures past midnight were dropped in silver
+# before origin_day_offset was added, so the old rows all have offset 0.
+ADDED_COLUMNS = {"origin_day_offset": (pa.int8(), 0)}
+# Only columns with few distinct values in a row group are dictionary encoded in the
+# Parquet files, e.g. line and vehicle have at most a few hundred. Dictionaries of the
+# other columns, e.g. coordinates, would be as large as the data itself.
+DICTIONARY_COLUMNS = [
+    "line",
+    "operator",
+    "vehicle",
+    "journey_pattern",
+    "origin_short_name",
+    "destination_short_name",
+    "direction",
+    "origin_aimed_departure_time",
+    "origin_day_offset",
+    "speed",
+    "delay",
+    WATERMARK_COLUMN,
+]
+# Options of the Parquet files written to the Delta table. A partition of a day is
+# usually written in a single row group.
+WRITE_OPTIONS = {
+    "file_options": ds.ParquetFileFormat().make_write_options(
+        use_dictionary=DICTIONARY_COLUMNS
+    ),
+    "min_rows_per_group": 131_072,
+    "max_rows_per_group": 1_048_576,
+}
+
+
+def to_gold_schema(source: pa.Table) -> pa.Table:
+    """
+    Function converts the time64 columns of silver rows read from DuckDB as an Arrow table
+    to microseconds since midnight. The int64 columns reuse the buffers of the time64[us]
+    columns, so no data is copied. Columns that already are int64 are kept as they are.
+
+    Params:
+        - source: silver rows, e.g. from `duckdb.DuckDBPyRelation.arrow()`.
+    """
+    for col in TIME_COLUMNS:
+        i = source.schema.get_field_index(col)
+        source = source.set_column(
+            i, col, source[col].cast(pa.time64("us")).cast(pa.int64())
+        )
+    return source
+
+
+def read_silver_delta(table_path: str, min_update: datetime.datetime) -> pa.Table:
+    """
+    Function reads the rows of a silver Delta table newer than min_update as an Arrow
+    table. Silver stores the times as microseconds like gold, so `to_gold_schema` leaves
+    them as they are.
+
+    Params:
+        - table_path: path to the silver Delta table.
+        - min_update: only rows with a later WATERMARK_COLUMN are read.
+    """
+    if min_update.tzinfo is None:
+        min_update = min_update.replace(tzinfo=datetime.timezone.utc)
+    watermark = pa.scalar(min_update, type=pa.timestamp("us", "UTC"))
+    return (
+        DeltaTable(table_path)
+        .to_pyarrow_dataset()
+        .to_table(filter=ds.field(WATERMARK_COLUMN) > watermark)
+    )
+
+
+def has_time_columns_as_strings(table_path: str) -> bool:
+    """
+    Function checks if the Delta table stores TIME_COLUMNS as strings, i.e. if the table
+    was created before times were stored as microseconds and needs to be migrated with
+    migrate.py.
+
+    Params:
+        - table_path: path to the Delta table.
+    """
+    schema = DeltaTable(table_path).schema().to_pyarrow()
+    return any(pa.types.is_string(schema.field(col).type) for col in TIME_COLUMNS)
+
+
+def check_time_columns(table_path: str):
+    """
+    Function raises an exception if the Delta table stores TIME_COLUMNS as strings.
+
+    Params:
+        - table_path: path to the Delta table.
+    """
+    if has_time_columns_as_strings(table_path):
+        raise Exception(
+            f"Table {table_path} stores {', '.join(TIME_COLUMNS)} as strings. "
+            + "Run migrate.py to store them as microseconds."
+        )
+
+
+def time_strings_to_microseconds(data: pa.Table) -> pa.Table:
+    """
+    Function converts TIME_COLUMNS stored as strings, e.g. "23:19:00", to microseconds
+    since midnight.
+
+    Params:
+        - data: rows of a Delta table created before times were stored as microseconds.
+    """
+    return (
+        pl.from_arrow(data)
+        .with_columns(
+            pl.col(col).str.to_time("%H:%M:%S%.f").cast(pl.Int64) // 1000
+            for col in TIME_COLUMNS
+        )
+        .to_arrow()
+    )
+
+
+def missing_columns(table_path: str) -> list[str]:
+    """
+    Function returns the columns of ADDED_COLUMNS the Delta table does not have, i.e.
+    that need to be added with migrate.py.
+
+    Params:
+        - table_path: path to the Delta table.
+    """
+    names = DeltaTable(table_path).schema().to_pyarrow().names
+    return [col for col in ADDED_COLUMNS if col not in names]
+
+
+def check_added_columns(table_path: str):
+    """
+    Function raises an exception if the Delta table is missing columns of ADDED_COLUMNS.
+
+    Params:
+        - table_path: path to the Delta table.
+    """
+    missing = missing_columns(table_path)
+    if missing:
+        raise Exception(
+            f"Table {table_path} is missing the columns {', '.join(missing)}. "
+            + "Run migrate.py to add them."
+        )
+
+
+def add_missing_columns(data: pa.Table, columns: list[str]) -> pa.Table:
+    """
+    Function appends columns of ADDED_COLUMNS to rows read from a Delta table created
+    before them, filled with the value of the old rows.
+
+    Params:
+        - data: rows of the Delta table.
+        - columns: names of the missing columns, from `missing_columns`.
+    """
+    for col in columns:
+        datatype, value = ADDED_COLUMNS[col]
+        data = data.append_column(
+            pa.field(col, datatype),
+            pa.repeat(pa.scalar(value, datatype), data.num_rows),
+        )
+    return data
+
+
+def is_partitioned(table_path: str) -> bool:
+    """
+    Function checks if the Delta table is partitioned by PARTITION_COLUMN, i.e. if the table
+    has the current layout or needs to be migrated with migrate.py.
+
+    Params:
+        - table_path: path to the Delta table.
+    """
+    return DeltaTable(table_path).metadata().partition_columns == [PARTITION_COLUMN]
+
+
+def scan_table_stats(table_path: str) -> tuple[datetime.datetime | None, int]:
+    """
+    Function gets MAX(WATERMARK_COLUMN) and the row count of the Delta table by scanning
+    the table. Returns None as the max for an empty table.
+
+    Params:
+        - table_path: path to the Delta table.
+    """
+    return (
+        pl.scan_delta(table_path)
+        .select(pl.col(WATERMARK_COLUMN).max(), pl.len())
+        .collect()
+        .row(0)
+    )
+
+
+def get_table_stats(
+    table_path: str, verify: bool = False
+) -> tuple[datetime.datetime | None, int]:
+    """
+    Function gets MAX(WATERMARK_COLUMN) and the row count of the Delta table from the
+    file statistics in the Delta log without reading any data files. Falls back to
+    scanning the table if some file is missing statistics. Returns None as the max for
+    an empty table.
+
+    Params:
+        - table_path: path to the Delta table.
+        - verify: if True, also scan the table and use the scanned values if they differ
+          from the statistics.
+    """
+    actions = DeltaTable(table_path).get_add_actions(flatten=True)
+    max_column = f"max.{WATERMARK_COLUMN}"
+    if (
+        max_column not in actions.column_names
+        or actions["num_records"].null_count > 0
+        or actions[max_column].null_count > 0
+    ):
+        print("Delta log is missing file statistics. Scanning the table instead.")
+        return scan_table_stats(table_path)
+
+    stats = (
+        pc.max(actions[max_column]).as_py(),
+        pc.sum(actions["num_records"]).as_py() or 0,
+    )
+
+    if verify:
+        scanned = scan_table_stats(table_path)
+        if scanned != stats:
+            print(
+                f"Statistics from the Delta log {stats} differ from the scanned values "
+                + f"{scanned}. Using the scanned values."
+            )
+            return scanned
+
+    return stats
+
+
+def read_partitions(
+    table_path: str, partitions: list[str], columns: list[str] | None = None
+) -> pl.DataFrame:
+    """
+    Function reads only the files of the given partitions of the Delta table.
+
+    Params:
+        - table_path: path to the Delta table.
+        - partitions: values of PARTITION_COLUMN formatted as strings, e.g. "2024-04-20".
+        - columns: if given, only read these columns.
+    """
+    return pl.read_delta(
+        table_path,
+        columns=columns,
+        pyarrow_options={"partitions": [(PARTITION_COLUMN, "in", partitions)]},
+    )
+
+
+def upsert(
+    target_df: pl.DataFrame, source_df: pl.DataFrame, pk: list[str] = TARGET_TABLE_PK
+) -> pl.DataFrame:
+    """
+    Function upserts the rows of source_df to target_df. Rows of target_df with the same
+    primary key as a row in source_df are replaced.
+
+    Params:
+        - target_df: current rows.
+        - source_df: new rows, deduplicated by primary key.
+        - pk: primary key columns.
+    """
+    return pl.concat([target_df.join(source_df, on=pk, how="anti"), source_df])
+
+
+def merge_partition(
+    table_path: str,
+    partition: str,
+    source_df: pl.DataFrame,
+    pk: list[str] = TARGET_TABLE_PK,
+    sort_by: list[str] | None = None,
+) -> pl.DataFrame:
+    """
+    Function reads one partition of the Delta table and upserts the new rows of the
+    partition to it. Returns the new contents of the partition.
+
+    Params:
+        - table_path: path to the Delta table.
+        - partition: value of PARTITION_COLUMN formatted as a string.
+        - source_df: new rows of the partition.
+        - pk: primary key columns.
+        - sort_by: if given, sort the rows of the partition by these columns.
+    """
+    target_df = (
+        read_partitions(table_path, [partition])
+        .select(source_df.columns)
+        .cast(dict(source_df.schema))
+    )
+    merged = upsert(target_df, source_df, pk)
+    return merged if sort_by is None else merged.sort(sort_by)
+
+
+def merge_partitioned(
+    source_df: pl.DataFrame,
+    table_path: str,
+    workers: int,
+    pk: list[str] = TARGET_TABLE_PK,
+    sort_by: list[str] | None = None,
+    write_options: dict = WRITE_OPTIONS,
+) -> list[str]:
+    """
+    Function merges source_df to a Delta table partitioned by PARTITION_COLUMN.
+
+    Only the partitions that have new rows are read and rewritten. Up to `workers`
+    partitions are merged concurrently on a thread pool and all of them are then written
+    in a single commit that overwrites only those partitions. The watermark of the
+    export is the max update_time of the table, so writing the partitions in separate
+    commits could move it past new rows of partitions that were not written yet if the
+    export failed in between, and those rows would never be read again.
+
+    Returns the list of partitions that were rewritten.
+
+    Params:
+        - source_df: new rows, deduplicated by primary key.
+        - table_path: path to the Delta table.
+        - workers: maximum number of partitions to merge concurrently.
+        - pk: primary key columns.
+        - sort_by: if given, sort the rows of each partition by these columns.
+        - write_options: options of the Parquet files, e.g. WRITE_OPTIONS.
+    """
+    partition_values = pl.col(PARTITION_COLUMN).cast(pl.String)
+    partitions = source_df.select(partition_values.unique().sort())
+    partitions = partitions.to_series().to_list()
+    if len(partitions) == 0:
+        return partitions
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        merged = pool.map(
+            lambda partition: merge_partition(
+                table_path,
+                partition,
+                source_df.filter(partition_values == partition),
+                pk,
+                sort_by,
+            ),
+            partitions,
+        )
+        merged = pl.concat(merged).to_arrow()
+    write_deltalake(
+        table_path,
+        merged,
+        mode="overwrite",
+        partition_by=[PARTITION_COLUMN],
+        partition_filters=[(PARTITION_COLUMN, "in", partitions)],
+        **write_options,
+    )
+
+    return partitions
+
+
+def merge_full_table(source_df: pl.DataFrame, table_path: str):
+    """
+    Function merges source_df to an unpartitioned Delta table with a full table merge.
+    Used for tables that have not been migrated to the partitioned layout yet.
+
+    Params:
+        - source_df: new rows, deduplicated by primary key.
+        - table_path: path to the Delta table.
+    """
+    predicate = " AND ".join(f"s.{col} = t.{col}" for col in TARGET_TABLE_PK)
+    (
+        source_df.write_delta(
+            table_path,
+            mode="merge",
+            delta_merge_options={
+                "source_alias": "s",
+                "target_alias": "t",
+                "predicate": predicate,
+            },
+        )
+        .when_matched_update_all()
+        .when_not_matched_insert_all()
+        .execute()
+    )
+
+
+def merge(source_df: pl.DataFrame, table_path: str, workers: int = 1):
+    """
+    Function merges source_df to the Delta table. Creates the table partitioned by
+    PARTITION_COLUMN if it does not exist.
+
+    Params:
+        - source_df: new rows, deduplicated by primary key.
+        - table_path: path to the Delta table.
+        - workers: maximum number of partitions to merge concurrently.
+    """
+    try:
+        partitioned = is_partitioned(table_path)
+    except deltalake._internal.TableNotFoundError:
+        write_deltalake(
+            table_path,
+            source_df.to_arrow(),
+            mode="overwrite",
+            partition_by=[PARTITION_COLUMN],
+            **WRITE_OPTIONS,
+        )
+        return
+
+    check_time_columns(table_path)
+    check_added_columns(table_path)
+
+    if partitioned:
+        partitions = merge_partitioned(source_df, table_path, workers)
+        print(f"Merged partitions: {', '.join(partitions)}")
+    else:
+        print("Table is not partitioned. Run migrate.py to partition the table.")
+        merge_full_table(source_df, table_path)
@@ -0,0 +1,372 @@
+import datetime
+import math
+import polars as pl
+import pyarrow as pa
+import pyarrow.dataset as ds
+from deltalake import DeltaTable, write_deltalake
+from delta_operations.aggregates import table_exists
+from delta_operations.functions import (
+    PARTITION_COLUMN,
+    TARGET_TABLE_PK,
+    WRITE_OPTIONS,
+    check_time_columns,
+    merge_partitioned,
+    read_partitions,
+    upsert,
+)
+
+# Every row of the fact table with the distance, time and heading from the previous
+# position of the same vehicle on the same journey, and the grid cell of its position.
+# Partitioned by date like the fact table, and sorted by the cell within each partition,
+# so queries of an area only read the files and row groups whose cells, longitudes and
+# latitudes overlap it.
+TRAJECTORY_TABLE = "trajectories"
+JOURNEY_COLUMNS = ["vehicle", "line", "direction", "origin_aimed_departure_time"]
+TRAJECTORY_SOURCE_COLUMNS = list(
+    dict.fromkeys(
+        TARGET_TABLE_PK + JOURNEY_COLUMNS + ["longitude", "latitude", "speed", "delay"]
+    )
+)
+TRAJECTORY_SORT = ["cell", "time"]
+# Small row groups and files, so the min/max statistics of the cells and coordinates
+# cover small areas.
+TRAJECTORY_WRITE_OPTIONS = WRITE_OPTIONS | {
+    "min_rows_per_group": 16_384,
+    "max_rows_per_group": 16_384,
+    "max_rows_per_file": 262_144,
+}
+
+# Positions of a journey more than GAP_SECONDS apart start a new trajectory, e.g. the
+# same departure on the next day. Positions less than DWELL_METERS apart are counted
+# as dwelling, e.g. at a stop.
+GAP_SECONDS = 600
+DWELL_METERS = 5.0
+EARTH_RADIUS_METERS = 6_371_000.0
+DAY_MICROSECONDS = 86_400_000_000
+
+# The grid cell is the Z-order (Morton) code of the position on a grid of 2^CELL_BITS
+# by 2^CELL_BITS cells over the whole globe, i.e. about 300 m by 300 m in Tampere.
+# Like geohashes, nearby positions mostly have close codes, and every cell of an area
+# has a code between the codes of its south-west and north-east corners.
+CELL_BITS = 16
+# Masks and shifts spreading the bits of a 16-bit integer to the even bits of a 32-bit
+# integer.
+CELL_MASKS = [(8, 0x00FF00FF), (4, 0x0F0F0F0F), (2, 0x33333333), (1, 0x55555555)]
+
+
+def with_grid_cell(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Function adds the grid cell of `longitude` and `latitude` as the Int64 column
+    `cell`. The bits of the cell are interleaved with integer arithmetic on the whole
+    columns in a few steps, so every step only refers to the result of the previous
+    one.
+
+    Params:
+        - df: rows with the columns longitude and latitude.
+    """
+    cells = 2**CELL_BITS
+    lf = df.lazy().with_columns(
+        cell_x=((pl.col("longitude") + 180) * (cells / 360))
+        .clip(0, cells - 1)
+        .cast(pl.UInt32),
+        cell_y=((pl.col("latitude") + 90) * (cells / 180))
+        .clip(0, cells - 1)
+        .cast(pl.UInt32),
+    )
+    for shift, mask in CELL_MASKS:
+        # Integer literals need their type, or Polars computes the result in Int32.
+        lf = lf.with_columns(
+            (pl.col(col) | pl.col(col) * pl.lit(2**shift, dtype=pl.UInt32))
+            & pl.lit(mask, dtype=pl.UInt32)
+            for col in ["cell_x", "cell_y"]
+        )
+    return (
+        lf.with_columns(
+            cell=pl.col("cell_x").cast(pl.Int64) * 2 + pl.col("cell_y").cast(pl.Int64)
+        )
+        .drop("cell_x", "cell_y")
+        .collect()
+    )
+
+
+def haversine(
+    longitude_1: pl.Expr, latitude_1: pl.Expr, longitude_2: pl.Expr, latitude_2: pl.Expr
+) -> pl.Expr:
+    """
+    Function returns the great-circle distance in meters between two positions.
+    """
+    a = (latitude_2 - latitude_1).radians() / 2
+    b = (longitude_2 - longitude_1).radians() / 2
+    h = a.sin() ** 2 + latitude_1.radians().cos() * latitude_2.radians().cos() * (
+        b.sin() ** 2
+    )
+    return 2 * EARTH_RADIUS_METERS * h.sqrt().arcsin()
+
+
+def heading(
+    longitude_1: pl.Expr, latitude_1: pl.Expr, longitude_2: pl.Expr, latitude_2: pl.Expr
+) -> pl.Expr:
+    """
+    Function returns the initial bearing in degrees clockwise from north from the first
+    position to the second.
+    """
+    d = (longitude_2 - longitude_1).radians()
+    y = d.sin() * latitude_2.radians().cos()
+    x = latitude_1.radians().cos() * latitude_2.radians().sin() - (
+        latitude_1.radians().sin() * latitude_2.radians().cos() * d.cos()
+    )
+    return (pl.arctan2(y, x).degrees() + 360) % 360
+
+
+def trajectory_rows(rows: pl.DataFrame) -> pl.DataFrame:
+    """
+    Function computes the trajectories of journeys: the rows of each vehicle and journey
+    in JOURNEY_COLUMNS are ordered by date and time, and every row gets the seconds,
+    distance in meters and heading from the previous row, and the seconds spent in
+    place since the previous row. The first row of a trajectory has nulls. The rows
+    are returned with their grid cell, ordered by journey.
+
+    Params:
+        - rows: rows of the fact table with TRAJECTORY_SOURCE_COLUMNS, deduplicated by
+          primary key.
+    """
+    timestamp = pl.col(PARTITION_COLUMN).cast(pl.Int64) * DAY_MICROSECONDS + pl.col(
+        "time"
+    )
+    df = rows.with_columns(timestamp=timestamp).sort(JOURNEY_COLUMNS + ["timestamp"])
+    previous = {
+        col: pl.col(col).shift()
+        for col in JOURNEY_COLUMNS + ["timestamp", "longitude", "latitude"]
+    }
+    df = df.with_columns(
+        step_seconds=(pl.col("timestamp") - previous["timestamp"]) / 1_000_000,
+        same_journey=pl.all_horizontal(
+            pl.col(col) == previous[col] for col in JOURNEY_COLUMNS
+        ).fill_null(False),
+        step_distance=haversine(
+            previous["longitude"],
+            previous["latitude"],
+            pl.col("longitude"),
+            pl.col("latitude"),
+        ),
+        heading=heading(
+            previous["longitude"],
+            previous["latitude"],
+            pl.col("longitude"),
+            pl.col("latitude"),
+        ),
+    )
+    continued = pl.col("same_journey") & (pl.col("step_seconds") <= GAP_SECONDS)
+    moved = pl.col("step_distance") >= DWELL_METERS
+    df = df.with_columns(
+        pl.when(continued).then(pl.col(col)).alias(col)
+        for col in ["step_seconds", "step_distance"]
+    ).with_columns(
+        heading=pl.when(continued & moved).then(pl.col("heading")),
+        dwell_seconds=pl.when(continued).then(
+            pl.when(moved).then(0.0).otherwise(pl.col("step_seconds"))
+        ),
+    )
+    return with_grid_cell(df.drop("timestamp", "same_journey"))
+
+
+def update_trajectories(
+    source_df: pl.DataFrame, fact_path: str, trajectory_path: str, workers: int = 1
+) -> int:
+    """
+    Function recomputes the trajectories of the journeys that have new rows in source_df
+    and upserts them to the trajectory table. Like `update_rollups`, the trajectories
+    are recomputed from the rows of the fact table upserted with source_df, so this can
+    be called before merging source_df to the fact table. Only the partitions of the
+    fact table with new rows are read, and the partitions of the previous dates if the
+    new rows could continue journeys from before midnight. Returns the number of
+    recomputed journeys.
+
+    Params:
+        - source_df: new rows of the fact table, deduplicated by primary key.
+        - fact_path: path to the fact Delta table.
+        - trajectory_path: path to the trajectory Delta table.
+        - workers: maximum number of trajectory partitions to merge concurrently.
+    """
+    source_df = source_df.select(TRAJECTORY_SOURCE_COLUMNS)
+    touched = source_df.select([PARTITION_COLUMN] + JOURNEY_COLUMNS).unique()
+
+    if table_exists(fact_path):
+        check_time_columns(fact_path)
+        previous_dates = source_df.filter(
+            pl.col("time") < GAP_SECONDS * 1_000_000
+        ).select(pl.col(PARTITION_COLUMN) - pl.duration(days=1))
+        partitions = (
+            pl.concat([touched.select(PARTITION_COLUMN), previous_dates])
+            .to_series()
+            .unique()
+            .cast(pl.String)
+            .to_list()
+        )
+        current_df = read_partitions(
+            fact_path, partitions, TRAJECTORY_SOURCE_COLUMNS
+        ).cast(dict(source_df.schema))
+        rows = upsert(current_df, source_df).join(
+            touched.select(JOURNEY_COLUMNS).unique(), on=JOURNEY_COLUMNS, how="semi"
+        )
+        trajectories = trajectory_rows(rows).join(
+            touched, on=[PARTITION_COLUMN] + JOURNEY_COLUMNS, how="semi"
+        )
+    else:
+        # Without the fact table all rows are new, so every journey is touched.
+        trajectories = trajectory_rows(source_df)
+
+    if table_exists(trajectory_path):
+        merge_partitioned(
+            trajectories,
+            trajectory_path,
+            workers,
+            pk=TARGET_TABLE_PK,
+            sort_by=[PARTITION_COLUMN] + TRAJECTORY_SORT,
+            write_options=TRAJECTORY_WRITE_OPTIONS,
+        )
+    else:
+        write_deltalake(
+            trajectory_path,
+            trajectories.sort([PARTITION_COLUMN] + TRAJECTORY_SORT).to_arrow(),
+            mode="overwrite",
+            partition_by=[PARTITION_COLUMN],
+            **TRAJECTORY_WRITE_OPTIONS,
+        )
+    return len(touched)
+
+
+def time_filter(start: datetime.datetime, end: datetime.datetime) -> ds.Expression:
+    """
+    Function returns a filter of the rows from start to end, inclusive, on the date and
+    time columns. The dates outside the range are pruned by the partitions.
+
+    Params:
+        - start: start of the range.
+        - end: end of the range.
+    """
+    date = ds.field(PARTITION_COLUMN)
+    time = ds.field("time")
+
+    def microseconds(value: datetime.datetime) -> pa.Scalar:
+        since_midnight = value - datetime.datetime.combine(
+            value.date(), datetime.time()
+        )
+        return pa.scalar(since_midnight // datetime.timedelta(microseconds=1))
+
+    return (
+        (date >= start.date())
+        & (date <= end.date())
+        & ((date > start.date()) | (time >= microseconds(start)))
+        & ((date < end.date()) | (time <= microseconds(end)))
+    )
+
+
+def area_filter(
+    min_longitude: float, min_latitude: float, max_longitude: float, max_latitude: float
+) -> ds.Expression:
+    """
+    Function returns a filter of the rows in a bounding box. The range of grid cells of
+    the box prunes the files and row groups by their statistics before the coordinates
+    are compared.
+
+    Params:
+        - min_longitude, min_latitude, max_longitude, max_latitude: corners of the box.
+    """
+    corners = with_grid_cell(
+        pl.DataFrame(
+            {
+                "longitude": [min_longitude, max_longitude],
+                "latitude": [min_latitude, max_latitude],
+            }
+        )
+    )
+    min_cell, max_cell = corners["cell"].to_list()
+    return (
+        (ds.field("cell") >= min_cell)
+        & (ds.field("cell") <= max_cell)
+        & (ds.field("longitude") >= min_longitude)
+        & (ds.field("longitude") <= max_longitude)
+        & (ds.field("latitude") >= min_latitude)
+        & (ds.field("latitude") <= max_latitude)
+    )
+
+
+def read_area(
+    trajectory_path: str,
+    min_longitude: float,
+    min_latitude: float,
+    max_longitude: float,
+    max_latitude: float,
+    start: datetime.datetime,
+    end: datetime.datetime,
+    columns: list[str] | None = None,
+) -> pl.DataFrame:
+    """
+    Function reads the rows of the trajectory table in a bounding box from start to
+    end. Only the files and row groups that can have rows in the box and time range
+    are read.
+
+    Params:
+        - trajectory_path: path to the trajectory Delta table.
+        - min_longitude, min_latitude, max_longitude, max_latitude: corners of the box.
+        - start: start of the time range, in the time zone of the date and time
+          columns.
+        - end: end of the time range.
+        - columns: if given, only read these columns.
+    """
+    area = area_filter(min_longitude, min_latitude, max_longitude, max_latitude)
+    dataset = DeltaTable(trajectory_path).to_pyarrow_dataset()
+    return pl.from_arrow(
+        dataset.to_table(columns=columns, filter=area & time_filter(start, end))
+    )
+
+
+def vehicles_near(
+    trajectory_path: str,
+    longitude: float,
+    latitude: float,
+    radius_meters: float,
+    start: datetime.datetime,
+    end: datetime.datetime,
+) -> pl.DataFrame:
+    """
+    Function finds the journeys that passed within radius_meters of a position, e.g.
+    a stop, from start to end. Returns a row per journey with the date and time of its
+    closest position and the distance to it in meters.
+
+    Params:
+        - trajectory_path: path to the trajectory Delta table.
+        - longitude: longitude of the position.
+        - latitude: latitude of the position.
+        - radius_meters: maximum distance from the position.
+        - start: start of the time range, in the time zone of the date and time
+          columns.
+        - end: end of the time range.
+    """
+    latitude_delta = math.degrees(radius_meters / EARTH_RADIUS_METERS)
+    longitude_delta = latitude_delta / math.cos(math.radians(latitude))
+    rows = read_area(
+        trajectory_path,
+        longitude - longitude_delta,
+        latitude - latitude_delta,
+        longitude + longitude_delta,
+        latitude + latitude_delta,
+        start,
+        end,
+        columns=[PARTITION_COLUMN, "time"]
+        + JOURNEY_COLUMNS
+        + ["longitude", "latitude"],
+    )
+    distance = haversine(
+        pl.lit(longitude), pl.lit(latitude), pl.col("longitude"), pl.col("latitude")
+    )
+    return (
+        rows.with_columns(distance=distance)
+        .filter(pl.col("distance") <= radius_meters)
+        .sort("distance")
+        .group_by([PARTITION_COLUMN] + JOURNEY_COLUMNS, maintain_order=True)
+        .first()
+        .select([PARTITION_COLUMN, "time"] + JOURNEY_COLUMNS + ["distance"])
+        .sort(PARTITION_COLUMN, "time")
+    )
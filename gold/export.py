@@ -1,9 +1,19 @@
-import duckdb
 import polars as pl
 import os
 import sys
+import string
 import deltalake
 import datetime
+from delta_operations.functions import (
+    merge,
+    get_table_stats,
+    read_silver_delta,
+    to_gold_schema,
+)
+from delta_operations.aggregates import update_dimensions, update_rollups, ROLLUP_TABLE
+from delta_operations.trajectories import update_trajectories, TRAJECTORY_TABLE
+from instrumentation.metrics import RunMetrics
+from pipeline.connections import connect
 
 SOURCE_DB = os.getenv("SOURCE_DB")
 SOURCE_SCHEMA = os.getenv("SOURCE_SCHEMA")
@@ -21,61 +31,118 @@ if None in [
         + "$SOURCE_TABLE, and $TARGET_DIR"
     )
 
+# Storage of the silver tables. With "duckdb" SOURCE_DB is a DuckDB database-file, with
+# "delta" it is the directory of the silver Delta tables.
+SILVER_STORAGE = os.getenv("SILVER_STORAGE", "duckdb").lower()
+if SILVER_STORAGE not in ["duckdb", "delta"]:
+    raise Exception(
+        f"Environment variable SILVER_STORAGE must be either duckdb or delta. Current value: {SILVER_STORAGE}"
+    )
+
+# Maximum number of partitions to merge concurrently.
+MERGE_WORKERS = os.getenv("MERGE_WORKERS")
+if MERGE_WORKERS is None:
+    MERGE_WORKERS = 4
+else:
+    if not all(c in string.digits for c in MERGE_WORKERS) or MERGE_WORKERS == "0":
+        raise Exception(
+            f"Environment variable MERGE_WORKERS must be a positive integer. Current value: {MERGE_WORKERS}"
+        )
+    MERGE_WORKERS = int(MERGE_WORKERS)
+
+# If set to true, the max update_time and row count read from the Delta log are verified
+# by scanning the whole table.
+VERIFY_STATS = os.getenv("VERIFY_STATS")
+if VERIFY_STATS is not None and VERIFY_STATS.lower() == "true":
+    VERIFY_STATS = True
+else:
+    VERIFY_STATS = False
+
+# With "debug" the rows read from silver are printed, with "info" only the row count.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "info").lower()
+if LOG_LEVEL not in ["debug", "info"]:
+    raise Exception(
+        f"Environment variable LOG_LEVEL must be either debug or info. Current value: {LOG_LEVEL}"
+    )
+
 TARGET_TABLE = "journeys_data"
 TARGET_PATH = os.path.join(TARGET_DIR, TARGET_TABLE)
+ROLLUP_PATH = os.path.join(TARGET_DIR, ROLLUP_TABLE)
+TRAJECTORY_PATH = os.path.join(TARGET_DIR, TRAJECTORY_TABLE)
 
-try:
-    max_update = pl.read_delta(TARGET_PATH).select("update_time").max().item()
-except FileNotFoundError:
-    max_update = datetime.datetime.fromisoformat("1970-01-01 00:00:00.000")
-except deltalake._internal.TableNotFoundError:
+metrics = RunMetrics("gold")
+
+with metrics.phase("watermark"):
+    try:
+        max_update, _ = get_table_stats(TARGET_PATH, verify=VERIFY_STATS)
+    except FileNotFoundError:
+        max_update = None
+    except deltalake._internal.TableNotFoundError:
+        max_update = None
+if max_update is None:
     max_update = datetime.datetime.fromisoformat("1970-01-01 00:00:00.000")
 
-with duckdb.connect(SOURCE_DB, read_only=True) as db:
-    source_df = (
-        db.sql(
-            f"FROM {SOURCE_SCHEMA}.{SOURCE_TABLE} WHERE update_time > '{max_update}'"
+# New rows are read from silver as Arrow and the times are converted to microseconds
+# in the Arrow table, so the rows are not copied between DuckDB, Polars and deltalake.
+with metrics.phase("read"):
+    if SILVER_STORAGE == "duckdb":
+        with connect(SOURCE_DB, read_only=True) as db:
+            source = db.sql(
+                f"FROM {SOURCE_SCHEMA}.{SOURCE_TABLE} WHERE update_time > '{max_update}'"
+            ).arrow()
+    else:
+        source = read_silver_delta(
+            os.path.join(SOURCE_DB, SOURCE_SCHEMA, SOURCE_TABLE), max_update
         )
-        .pl()
-        .cast({"time": pl.String, "origin_aimed_departure_time": pl.String})
-    )
+    source_df = pl.from_arrow(to_gold_schema(source))
+metrics.set("rows_in", len(source_df))
+metrics.set("bytes_in", source_df.estimated_size())
 
 if len(source_df) == 0:
     print("No new data.")
+    metrics.finish(status="no_data")
     sys.exit(0)
 
-with pl.Config() as cfg:
-    cfg.set_tbl_cols(source_df.width)
-    print("Loading new data from silver:")
-    print(source_df)
-    print("*" * 50)
-
-try:
-    (
-        source_df.write_delta(
-            TARGET_PATH,
-            mode="merge",
-            delta_merge_options={
-                "source_alias": "s",
-                "target_alias": "t",
-                "predicate": """
-                s.date = t.date AND
-                s.time = t.time AND
-                s.line = t.line AND
-                s.direction = t.direction AND
-                s.origin_aimed_departure_time = t.origin_aimed_departure_time
-                """,
-            },
-        )
-        .when_matched_update_all()
-        .when_not_matched_insert_all()
-        .execute()
+print(f"Loading {len(source_df)} new rows from silver.")
+if LOG_LEVEL == "debug":
+    with pl.Config() as cfg:
+        cfg.set_tbl_cols(source_df.width)
+        print(source_df)
+print("*" * 50)
+
+# The dimension, rollup and trajectory tables are updated before the fact table, since
+# the next run only gets rows newer than the latest update_time in the fact table. If
+# the run fails before the merge, the same rows are read again and the updates are
+# redone.
+with metrics.phase("dimensions"):
+    updated_dimensions = update_dimensions(source_df=source_df, target_dir=TARGET_DIR)
+print(f"Updated dimensions: {', '.join(updated_dimensions) or 'none'}")
+
+with metrics.phase("rollups"):
+    rollup_groups = update_rollups(
+        source_df=source_df,
+        fact_path=TARGET_PATH,
+        rollup_path=ROLLUP_PATH,
+        workers=MERGE_WORKERS,
     )
-except deltalake._internal.TableNotFoundError:
-    source_df.write_delta(
-        TARGET_PATH,
-        mode="overwrite",
+print(f"Recomputed {rollup_groups} groups of {ROLLUP_TABLE}")
+metrics.set("rollup_groups", rollup_groups)
+
+with metrics.phase("trajectories"):
+    trajectory_journeys = update_trajectories(
+        source_df=source_df,
+        fact_path=TARGET_PATH,
+        trajectory_path=TRAJECTORY_PATH,
+        workers=MERGE_WORKERS,
     )
+print(f"Recomputed {trajectory_journeys} journeys of {TRAJECTORY_TABLE}")
+metrics.set("trajectory_journeys", trajectory_journeys)
+
+with metrics.phase("merge"):
+    merge(source_df=source_df, table_path=TARGET_PATH, workers=MERGE_WORKERS)
 
-row_count = pl.read_delta(TARGET_PATH).select("date").count().item()
+with metrics.phase("stats"):
+    _, row_count = get_table_stats(TARGET_PATH, verify=VERIFY_STATS)
 print(f"New row count: {row_count}")
+metrics.set("table_rows", row_count)
+metrics.finish()
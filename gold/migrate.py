@@ -0,0 +1,61 @@
+import os
+import sys
+import datetime
+from deltalake import DeltaTable, write_deltalake
+from delta_operations.functions import (
+    PARTITION_COLUMN,
+    TIME_COLUMNS,
+    WRITE_OPTIONS,
+    is_partitioned,
+    has_time_columns_as_strings,
+    time_strings_to_microseconds,
+    missing_columns,
+    add_missing_columns,
+)
+
+# Migrates an existing gold Delta table to the current layout, i.e. partitioned by date,
+# with the time columns stored as microseconds since midnight instead of strings and
+# with the columns added to silver since the table was created. Delta Lake does not allow
+# changing the partitioning or column types of a table in place, so the table is written
+# to a new directory which then replaces the old table. The old table is kept as a
+# backup next to the new one and can be deleted after checking the results.
+# Do not run this concurrently with export.py.
+
+TARGET_DIR = os.getenv("TARGET_DIR")
+
+if TARGET_DIR is None:
+    raise Exception("You must set the environment variable $TARGET_DIR")
+
+TARGET_TABLE = "journeys_data"
+TARGET_PATH = os.path.join(TARGET_DIR, TARGET_TABLE)
+
+time_strings = has_time_columns_as_strings(TARGET_PATH)
+missing = missing_columns(TARGET_PATH)
+if is_partitioned(TARGET_PATH) and not time_strings and not missing:
+    print(f"Table {TARGET_PATH} already has the current layout.")
+    sys.exit(0)
+
+timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+migrated_path = f"{TARGET_PATH}_migrated_{timestamp}"
+backup_path = f"{TARGET_PATH}_backup_{timestamp}"
+
+print(f"Rewriting table {TARGET_PATH} partitioned by {PARTITION_COLUMN}")
+data = DeltaTable(TARGET_PATH).to_pyarrow_table()
+if time_strings:
+    print(f"Converting {', '.join(TIME_COLUMNS)} to microseconds since midnight")
+    data = time_strings_to_microseconds(data)
+if missing:
+    print(f"Adding columns {', '.join(missing)}")
+    data = add_missing_columns(data, missing)
+write_deltalake(migrated_path, data, partition_by=[PARTITION_COLUMN], **WRITE_OPTIONS)
+
+migrated_rows = DeltaTable(migrated_path).to_pyarrow_dataset().count_rows()
+if migrated_rows != data.num_rows:
+    raise Exception(
+        f"Row count mismatch after migration: {data.num_rows} rows before, {migrated_rows} after. "
+        + f"Original table left untouched, migrated table in {migrated_path}"
+    )
+
+os.rename(TARGET_PATH, backup_path)
+os.rename(migrated_path, TARGET_PATH)
+print(f"Migrated {migrated_rows} rows. Old table moved to {backup_path}")
@@ -0,0 +1,253 @@
+import atexit
+import datetime
+import json
+import os
+import resource
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+METRIC_PREFIX = "journeys_pipeline"
+
+# Number of times to try inserting the summary of a run to the pipeline_runs table.
+INSERT_ATTEMPTS = 5
+
+RUNS_TABLE = "pipeline_runs"
+RUNS_TABLE_SCHEMA = """
+run_id VARCHAR PRIMARY KEY,
+stage VARCHAR,
+status VARCHAR,
+started_at TIMESTAMPTZ,
+finished_at TIMESTAMPTZ,
+duration_seconds DOUBLE,
+peak_rss_bytes BIGINT,
+phases JSON,
+counters JSON
+"""
+
+
+def peak_rss_bytes() -> int:
+    """
+    Function gets the peak resident set size of the process in bytes.
+    """
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RunMetrics:
+    """
+    Class collects the performance metrics of a single run of a pipeline stage: the
+    duration of each phase, counters like rows in and out, bytes and lock waits, and
+    the peak RSS of the process.
+
+    Every finished phase and the summary of the run are printed as JSON lines. When
+    the run finishes, the metrics are also written to a Prometheus textfile
+    `<stage>.prom` in metrics_dir and the summary is inserted to the pipeline_runs
+    table in the DuckDB database runs_db, if these are set.
+
+    If the process exits without calling `finish`, e.g. due to an exception, the run
+    is finished with status "failed".
+
+    Params:
+        - stage: name of the pipeline stage, e.g. "silver".
+        - metrics_dir: directory of the Prometheus textfiles. Defaults to the
+          environment variable METRICS_DIR.
+        - runs_db: filepath to the DuckDB database-file of the pipeline_runs table.
+          Defaults to the environment variable RUNS_DB.
+    """
+
+    def __init__(
+        self,
+        stage: str,
+        metrics_dir: str | None = None,
+        runs_db: str | None = None,
+    ):
+        self.stage = stage
+        self.metrics_dir = metrics_dir or os.getenv("METRICS_DIR")
+        self.runs_db = runs_db or os.getenv("RUNS_DB")
+        self.run_id = uuid.uuid4().hex
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.counters = {}
+        # Phases and counters can be updated from multiple threads, e.g. by the batches
+        # silver transforms concurrently.
+        self.lock = threading.Lock()
+        self.finished = False
+        atexit.register(self._finish_at_exit)
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Context manager that times a phase of the run. Time spent in a phase with the
+        same name multiple times, e.g. once per batch, is summed up, also when the
+        phases run concurrently in multiple threads.
+
+        Params:
+            - name: name of the phase, e.g. "transform".
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0.0) + duration
+            self.log({"event": "phase", "phase": name, "duration_seconds": duration})
+
+    def count(self, name: str, value: int | float = 1):
+        """
+        Function adds value to a counter, e.g. "rows_in".
+
+        Params:
+            - name: name of the counter.
+            - value: value to add.
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name: str, value: int | float):
+        """
+        Function sets the value of a counter, e.g. "table_bytes".
+
+        Params:
+            - name: name of the counter.
+            - value: new value.
+        """
+        self.counters[name] = value
+
+    def log(self, record: dict):
+        """
+        Function prints a JSON line with the stage and run id of the run.
+
+        Params:
+            - record: fields of the JSON line.
+        """
+        print(json.dumps({"stage": self.stage, "run_id": self.run_id} | record))
+
+    def summary(self, status: str) -> dict:
+        """
+        Function returns the summary of the run.
+
+        Params:
+            - status: status of the run, e.g. "success".
+        """
+        return {
+            "run_id": self.run_id,
+            "stage": self.stage,
+            "status": status,
+            "started_at": self.started_at.isoformat(),
+            "finished_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "duration_seconds": time.perf_counter() - self.start,
+            "peak_rss_bytes": peak_rss_bytes(),
+            "phases": self.phases,
+            "counters": self.counters,
+        }
+
+    def finish(self, status: str = "success"):
+        """
+        Function finishes the run: prints the summary and writes it to the Prometheus
+        textfile and the pipeline_runs table. Only the first call has an effect.
+
+        Params:
+            - status: status of the run, e.g. "success" or "no_data".
+        """
+        if self.finished:
+            return
+        self.finished = True
+        atexit.unregister(self._finish_at_exit)
+
+        summary = self.summary(status)
+        self.log({"event": "summary"} | summary)
+        if self.metrics_dir is not None:
+            write_textfile(self.metrics_dir, summary)
+        if self.runs_db is not None:
+            # The database is shared by all stages, so it can be locked for a moment by
+            # another stage recording its run.
+            for attempt in range(INSERT_ATTEMPTS):
+                try:
+                    insert_run(self.runs_db, summary)
+                    break
+                except Exception as e:
+                    error = e
+                    time.sleep(0.5 * (attempt + 1))
+            else:
+                print(f"Could not record run to {self.runs_db}: {error}")
+
+    def _finish_at_exit(self):
+        self.finish(status="failed")
+
+
+def to_prometheus(summary: dict) -> str:
+    """
+    Function formats the summary of a run in the Prometheus text format.
+
+    Params:
+        - summary: summary of the run as returned by `RunMetrics.summary`.
+    """
+    stage = summary["stage"]
+    finished_at = datetime.datetime.fromisoformat(summary["finished_at"])
+    gauges = {
+        "run_success": int(summary["status"] in ["success", "no_data"]),
+        "run_duration_seconds": summary["duration_seconds"],
+        "run_finished_timestamp_seconds": finished_at.timestamp(),
+        "peak_rss_bytes": summary["peak_rss_bytes"],
+    } | summary["counters"]
+
+    lines = []
+    for name, value in gauges.items():
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} gauge")
+        lines.append(f'{METRIC_PREFIX}_{name}{{stage="{stage}"}} {value}')
+    lines.append(f"# TYPE {METRIC_PREFIX}_phase_duration_seconds gauge")
+    for phase, duration in summary["phases"].items():
+        lines.append(
+            f'{METRIC_PREFIX}_phase_duration_seconds{{stage="{stage}",phase="{phase}"}} {duration}'
+        )
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(metrics_dir: str, summary: dict):
+    """
+    Function writes the summary of a run to the Prometheus textfile `<stage>.prom`
+    in metrics_dir. The file is replaced atomically, so it can be read by the textfile
+    collector of node_exporter or pushed to a Pushgateway at any time.
+
+    Params:
+        - metrics_dir: directory of the textfiles.
+        - summary: summary of the run as returned by `RunMetrics.summary`.
+    """
+    os.makedirs(metrics_dir, exist_ok=True)
+    path = os.path.join(metrics_dir, f"{summary['stage']}.prom")
+    with open(f"{path}.tmp", "w") as f:
+        f.write(to_prometheus(summary))
+    os.replace(f"{path}.tmp", path)
+
+
+def insert_run(db_path: str, summary: dict):
+    """
+    Function inserts the summary of a run to the pipeline_runs table. Creates the
+    table if it does not exist.
+
+    Params:
+        - db_path: filepath to the DuckDB database-file.
+        - summary: summary of the run as returned by `RunMetrics.summary`.
+    """
+    import duckdb
+
+    with duckdb.connect(db_path) as db:
+        db.sql(f"CREATE TABLE IF NOT EXISTS {RUNS_TABLE} ({RUNS_TABLE_SCHEMA})")
+        db.execute(
+            f"INSERT INTO {RUNS_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                summary["run_id"],
+                summary["stage"],
+                summary["status"],
+                summary["started_at"],
+                summary["finished_at"],
+                summary["duration_seconds"],
+                summary["peak_rss_bytes"],
+                json.dumps(summary["phases"]),
+                json.dumps(summary["counters"]),
+            ],
+        )
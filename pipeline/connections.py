@@ -0,0 +1,63 @@
+import duckdb
+import os
+import threading
+from contextlib import contextmanager
+
+# Open connections by the real path of the database-file while pooling is enabled.
+_pool: dict[str, duckdb.DuckDBPyConnection] = {}
+_pool_lock = threading.Lock()
+_pooling = False
+
+
+def enable_pool():
+    """
+    Function makes `connect` reuse a single connection per database-file until
+    `close_pool` is called. Used by the single-process runner, where the stages connect
+    to the same files many times, e.g. silver once per batch.
+    """
+    global _pooling
+    _pooling = True
+
+
+def close_pool():
+    """
+    Function closes the pooled connections, which releases the locks of the
+    database-files, and disables pooling.
+    """
+    global _pooling
+    with _pool_lock:
+        for db in _pool.values():
+            db.close()
+        _pool.clear()
+        _pooling = False
+
+
+@contextmanager
+def connect(db_path: str, read_only: bool = False):
+    """
+    Context manager that connects to a DuckDB database-file like `duckdb.connect`.
+
+    If pooling is enabled, yields a cursor of the pooled connection of the file
+    instead, so the file is opened and its catalog read only once. The pooled
+    connection is never read-only, since DuckDB does not allow read-only and
+    read-write connections to the same file in one process. Cursors can be used from
+    multiple threads and are closed when the context exits.
+
+    Params:
+        - db_path: filepath to the DuckDB database-file.
+        - read_only: if True, open the file read-only when pooling is disabled.
+    """
+    if not _pooling:
+        with duckdb.connect(db_path, read_only=read_only) as db:
+            yield db
+        return
+
+    key = os.path.realpath(db_path)
+    with _pool_lock:
+        if key not in _pool:
+            _pool[key] = duckdb.connect(db_path)
+        cursor = _pool[key].cursor()
+    try:
+        yield cursor
+    finally:
+        cursor.close()
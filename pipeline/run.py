@@ -0,0 +1,151 @@
+import os
+import runpy
+import signal
+import string
+import sys
+import threading
+import time
+from instrumentation.metrics import RunMetrics
+from pipeline.connections import close_pool, enable_pool
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Directory and script of each stage in the order the stages run.
+STAGES = {
+    "ingest": ("bronze", "ingest.py"),
+    "transform": ("silver", "transform.py"),
+    "export": ("gold", "export.py"),
+    "optimize": ("clean_delta_table", "optimize_and_vacuum.py"),
+}
+
+
+def read_env_file(path: str) -> dict[str, str]:
+    """
+    Function reads the environment variables of an env-file like `silver/env`, i.e.
+    lines `NAME=value`. Empty lines and lines starting with # are skipped, and quotes
+    around the values are removed.
+
+    Params:
+        - path: filepath to the env-file.
+    """
+    env = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+            name, value = line.split("=", 1)
+            if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+                value = value[1:-1]
+            env[name.strip()] = value
+    return env
+
+
+def stage_env(stage: str) -> dict[str, str]:
+    """
+    Function gets the environment variables of a stage from the env-file in the
+    environment variable `<STAGE>_ENV_FILE`, e.g. TRANSFORM_ENV_FILE. Without an
+    env-file the stage only gets the environment of the runner.
+
+    Params:
+        - stage: name of the stage, one of STAGES.
+    """
+    env_file = os.getenv(f"{stage.upper()}_ENV_FILE")
+    env = {} if env_file is None else read_env_file(env_file)
+    if stage == "ingest" and "POLL_INTERVAL" in os.environ | env:
+        raise Exception(
+            "Environment variable POLL_INTERVAL can not be set for ingest in the runner. "
+            + "Set RUN_INTERVAL to run the pipeline repeatedly instead."
+        )
+    return env
+
+
+def run_stage(stage: str, env: dict[str, str]):
+    """
+    Function runs the script of a stage in this process with the environment variables
+    env set and the directory of the stage on sys.path, like its container does. The
+    modules the script imports stay imported for the next stages and runs. The script
+    exiting with sys.exit(0), e.g. when there is no new data, is not an error.
+
+    Params:
+        - stage: name of the stage, one of STAGES.
+        - env: environment variables of the stage.
+    """
+    directory, script = STAGES[stage]
+    stage_dir = os.path.join(ROOT, directory)
+    previous_env = {name: os.environ.get(name) for name in env}
+    os.environ.update(env)
+    sys.path.insert(0, stage_dir)
+    try:
+        runpy.run_path(os.path.join(stage_dir, script), run_name="__main__")
+    except SystemExit as e:
+        if e.code not in [None, 0]:
+            raise
+    finally:
+        sys.path.remove(stage_dir)
+        for name, value in previous_env.items():
+            if value is None:
+                del os.environ[name]
+            else:
+                os.environ[name] = value
+
+
+def run_once(stages: list[str]):
+    """
+    Function runs the stages once in order and times each of them as a phase of the run
+    of the runner. The stages share a pooled DuckDB connection per database-file, which
+    is closed after the last stage, so other processes can open the files between runs.
+
+    Params:
+        - stages: names of the stages to run.
+    """
+    metrics = RunMetrics("runner")
+    # Reading the env-files validates them before any stage runs.
+    envs = {stage: stage_env(stage) for stage in stages}
+    enable_pool()
+    try:
+        for stage in stages:
+            print(f"Running stage {stage}")
+            print("=" * 50)
+            with metrics.phase(stage):
+                run_stage(stage, envs[stage])
+            metrics.count("stages")
+    finally:
+        close_pool()
+    metrics.finish()
+
+
+if __name__ == "__main__":
+    # Comma separated list of stages to run. Defaults to ingest, transform and export.
+    # The stages always run in the order of STAGES.
+    RUN_STAGES = os.getenv("STAGES", "ingest,transform,export").split(",")
+    if not all(stage in STAGES for stage in RUN_STAGES):
+        raise Exception(
+            f"Environment variable STAGES can only contain stages {', '.join(STAGES)}. "
+            + f"Current value: {os.getenv('STAGES')}"
+        )
+    RUN_STAGES = [stage for stage in STAGES if stage in RUN_STAGES]
+
+    # Seconds between the starts of runs. If set, the runner keeps running the stages
+    # until it gets SIGTERM, so the imports are only done once, instead of running them
+    # once.
+    RUN_INTERVAL = os.getenv("RUN_INTERVAL")
+    if RUN_INTERVAL is not None:
+        if not all(c in string.digits for c in RUN_INTERVAL) or RUN_INTERVAL == "0":
+            raise Exception(
+                f"Environment variable RUN_INTERVAL must be a positive integer. Current value: {RUN_INTERVAL}"
+            )
+        RUN_INTERVAL = int(RUN_INTERVAL)
+
+    if RUN_INTERVAL is None:
+        run_once(RUN_STAGES)
+    else:
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+        signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+        print(f"Running {', '.join(RUN_STAGES)} every {RUN_INTERVAL} s.")
+        while not stop.is_set():
+            run_started = time.monotonic()
+            run_once(RUN_STAGES)
+            stop.wait(max(0.0, RUN_INTERVAL - (time.monotonic() - run_started)))
+        print("Stopped running.")
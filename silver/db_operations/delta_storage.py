@@ -0,0 +1,311 @@
+import os
+import polars as pl
+import pyarrow as pa
+from deltalake import DeltaTable, write_deltalake
+from deltalake.exceptions import TableNotFoundError
+from db_operations.functions import (
+    ADDED_COLUMNS,
+    METADATA_COUNT_COLUMNS,
+    METADATA_TABLE,
+    QUARANTINE_TABLE,
+    TARGET_TABLE_PK,
+    TARGET_TABLE_VALUE_COLUMNS,
+)
+from db_operations.storage import SilverStorage
+
+# Delta Lake has no time type, so the TIME columns of silver are stored as microseconds
+# since midnight in int64 columns like in gold. update_time is stored in UTC.
+TIME_COLUMNS = ["time", "origin_aimed_departure_time"]
+PARTITION_COLUMN = "date"
+DELTA_TABLE_SCHEMA = pa.schema(
+    [
+        ("date", pa.date32()),
+        ("time", pa.int64()),
+        ("line", pa.string()),
+        ("operator", pa.string()),
+        ("vehicle", pa.string()),
+        ("journey_pattern", pa.string()),
+        ("origin_short_name", pa.string()),
+        ("destination_short_name", pa.string()),
+        ("direction", pa.string()),
+        ("longitude", pa.float64()),
+        ("latitude", pa.float64()),
+        ("speed", pa.float32()),
+        ("origin_aimed_departure_time", pa.int64()),
+        ("origin_day_offset", pa.int8()),
+        ("delay", pa.int64()),
+        ("update_time", pa.timestamp("us", "UTC")),
+    ]
+)
+DELTA_METADATA_SCHEMA = pa.schema(
+    [("load_id", pa.string()), ("loaded_rows", pa.int32())]
+    + [(col, pa.int32()) for col in METADATA_COUNT_COLUMNS]
+)
+DELTA_QUARANTINE_SCHEMA = pa.schema(
+    [("load_id", pa.string()), ("reason", pa.string())] + list(DELTA_TABLE_SCHEMA)
+)
+
+
+class DeltaStorage(SilverStorage):
+    """
+    Silver tables as Delta tables in the directory `root_dir/schema/`. The silver table
+    is partitioned by date. Every write is a new version of the table, so the tables can
+    be read by other processes while they are written.
+
+    Delta Lake has no transactions over multiple tables, so the checkpoint is written
+    last. If a run fails before it, the next run inserts the same batch again and the
+    rows already in the silver table are skipped by their primary key. Only the
+    quarantine table can get the rejected rows of the batch twice. When the tables are
+    reset, the checkpoints are reset first, so a failed reset is redone from the first
+    load.
+
+    Params:
+        - root_dir: directory of the Delta tables.
+        - schema: subdirectory of the silver tables.
+        - table: name of the silver table.
+    """
+
+    def __init__(self, root_dir: str, schema: str, table: str):
+        self.root_dir = root_dir
+        self.schema = schema
+        self.table = table
+        self.schemas = {
+            table: DELTA_TABLE_SCHEMA,
+            METADATA_TABLE: DELTA_METADATA_SCHEMA,
+            QUARANTINE_TABLE: DELTA_QUARANTINE_SCHEMA,
+        }
+
+    def table_path(self, table: str) -> str:
+        return os.path.join(self.root_dir, self.schema, table)
+
+    def write(
+        self,
+        table: str,
+        df: pl.DataFrame,
+        mode: str,
+        partitions: list[str] | None = None,
+    ):
+        """
+        Function writes rows with silver datatypes to a Delta table.
+
+        Params:
+            - table: name of the table.
+            - df: rows to write.
+            - mode: mode of `deltalake.write_deltalake`, e.g. "append".
+            - partitions: if given, only overwrite these dates of the silver table,
+              formatted as strings, e.g. "2024-04-20".
+        """
+        df = df.with_columns(
+            (pl.col(col).cast(pl.Int64) // 1000)
+            for col in TIME_COLUMNS
+            if col in df.columns
+        )
+        if "update_time" in df.columns:
+            df = df.with_columns(pl.col("update_time").dt.replace_time_zone("UTC"))
+        write_deltalake(
+            self.table_path(table),
+            df.to_arrow().select(self.schemas[table].names).cast(self.schemas[table]),
+            mode=mode,
+            partition_by=[PARTITION_COLUMN] if table == self.table else None,
+            partition_filters=(
+                None if partitions is None else [(PARTITION_COLUMN, "in", partitions)]
+            ),
+        )
+
+    def read(
+        self,
+        table: str,
+        partitions: list[str] | None = None,
+        columns: list[str] | None = None,
+    ) -> pl.DataFrame:
+        """
+        Function reads a Delta table and converts the rows to silver datatypes.
+
+        Params:
+            - table: name of the table.
+            - partitions: if given, only read these dates of the silver table,
+              formatted as strings, e.g. "2024-04-20".
+            - columns: if given, only read these columns.
+        """
+        pyarrow_options = None
+        if partitions is not None:
+            pyarrow_options = {"partitions": [(PARTITION_COLUMN, "in", partitions)]}
+        df = pl.read_delta(
+            self.table_path(table), columns=columns, pyarrow_options=pyarrow_options
+        )
+        return df.with_columns(
+            (pl.col(col) * 1000).cast(pl.Time)
+            for col in TIME_COLUMNS
+            if col in df.columns
+        )
+
+    def create_tables(self):
+        for table, schema in self.schemas.items():
+            try:
+                names = DeltaTable(self.table_path(table)).schema().to_pyarrow().names
+            except TableNotFoundError:
+                write_deltalake(
+                    self.table_path(table),
+                    schema.empty_table(),
+                    mode="ignore",
+                    partition_by=[PARTITION_COLUMN] if table == self.table else None,
+                )
+                continue
+            if table in [self.table, QUARANTINE_TABLE]:
+                self.add_columns(table, names)
+
+    def add_columns(self, table: str, names: list[str]):
+        """
+        Function adds the columns in ADDED_COLUMNS to a table created before them, with
+        the value of the rows from before them. Delta Lake can not add columns in place
+        with deltalake, so the whole table is rewritten once.
+
+        Params:
+            - table: name of the table.
+            - names: current columns of the table.
+        """
+        missing = [col for col in ADDED_COLUMNS if col not in names]
+        if len(missing) == 0:
+            return
+        print(f"Adding columns {', '.join(missing)} to silver table {table}.")
+        df = pl.read_delta(self.table_path(table)).with_columns(
+            pl.lit(ADDED_COLUMNS[col][1]).alias(col) for col in missing
+        )
+        write_deltalake(
+            self.table_path(table),
+            df.to_arrow().select(self.schemas[table].names).cast(self.schemas[table]),
+            mode="overwrite",
+            schema_mode="overwrite",
+            partition_by=[PARTITION_COLUMN] if table == self.table else None,
+        )
+
+    def get_last_load(self, reset_tables: bool) -> str:
+        last_load = self.read(METADATA_TABLE)["load_id"].max()
+        if last_load is None or reset_tables:
+            last_load = "0"
+
+        return last_load
+
+    def upsert(self, df: pl.DataFrame, update: bool) -> tuple[int, int, int]:
+        """
+        Function upserts rows to the silver table like
+        `db_operations.functions.upsert_batch`. Only the partitions with new rows are
+        read. Rows with a new primary key are appended, and the partitions with
+        changed rows are rewritten. Returns the numbers of inserted, updated and
+        skipped rows.
+
+        Params:
+            - df: new rows, deduplicated by primary key.
+            - update: if True, update the changed rows.
+        """
+        pk_cols = TARGET_TABLE_PK.split(", ")
+        df = df.with_columns(pl.col("update_time").dt.replace_time_zone("UTC"))
+        partitions = df[PARTITION_COLUMN].unique().cast(pl.String).to_list()
+        current_df = self.read(
+            self.table,
+            partitions,
+            pk_cols + (TARGET_TABLE_VALUE_COLUMNS if update else []),
+        )
+        new_df = df.join(current_df, on=pk_cols, how="anti")
+        changed_df = df.clear()
+        if update:
+            changed_df = (
+                df.join(current_df, on=pk_cols, how="inner", suffix="_current")
+                .filter(
+                    pl.any_horizontal(
+                        pl.col(col).ne_missing(pl.col(f"{col}_current"))
+                        for col in TARGET_TABLE_VALUE_COLUMNS
+                    )
+                )
+                .select(df.columns)
+            )
+        counts = (len(new_df), len(changed_df), len(df) - len(new_df) - len(changed_df))
+
+        if len(changed_df) > 0:
+            # The new rows of the rewritten partitions are written with them.
+            changed = changed_df[PARTITION_COLUMN].unique().cast(pl.String).to_list()
+            in_changed = pl.col(PARTITION_COLUMN).cast(pl.String).is_in(changed)
+            current_df = (
+                self.read(self.table, changed)
+                .select(df.columns)
+                .join(changed_df, on=pk_cols, how="anti")
+            )
+            self.write(
+                self.table,
+                pl.concat([current_df, changed_df, new_df.filter(in_changed)]),
+                "overwrite",
+                changed,
+            )
+            new_df = new_df.filter(~in_changed)
+        if len(new_df) > 0:
+            self.write(self.table, new_df, "append")
+
+        return counts
+
+    def insert_new_data(
+        self,
+        df: pl.DataFrame,
+        checkpoint: str,
+        reset_tables: bool,
+        quarantine: pl.DataFrame | None = None,
+        update: bool = False,
+    ) -> tuple[int, int, int]:
+        if reset_tables:
+            print("Resetting silver tables.")
+            print("*" * 50)
+            # The checkpoints are reset before the silver table, so if the run fails
+            # before the checkpoint of this batch is written, the next run starts from
+            # the first load instead of the old checkpoint.
+            write_deltalake(
+                self.table_path(METADATA_TABLE),
+                DELTA_METADATA_SCHEMA.empty_table(),
+                mode="overwrite",
+            )
+            self.write(self.table, df, "overwrite")
+            counts = (len(df), 0, 0)
+            mode = "overwrite"
+        else:
+            counts = self.upsert(df, update)
+            mode = "append"
+
+        if quarantine is not None:
+            self.write(
+                QUARANTINE_TABLE,
+                quarantine.with_columns(load_id=pl.lit(checkpoint, dtype=pl.String)),
+                mode,
+            )
+        elif reset_tables:
+            write_deltalake(
+                self.table_path(QUARANTINE_TABLE),
+                DELTA_QUARANTINE_SCHEMA.empty_table(),
+                mode="overwrite",
+            )
+        inserted_rows, updated_rows, skipped_rows = counts
+        self.write(
+            METADATA_TABLE,
+            pl.DataFrame(
+                [
+                    [checkpoint],
+                    [inserted_rows + updated_rows],
+                    [inserted_rows],
+                    [updated_rows],
+                    [skipped_rows],
+                ],
+                schema=DELTA_METADATA_SCHEMA.names,
+            ),
+            "append",
+        )
+
+        return counts
+
+    def read_table(self, table: str | None = None) -> pl.DataFrame:
+        return self.read(table or self.table)
+
+    def size_bytes(self) -> int:
+        # Includes the files of the old versions of the tables that have not been
+        # vacuumed yet.
+        return sum(
+            os.path.getsize(os.path.join(dir_path, file))
+            for dir_path, _, files in os.walk(os.path.join(self.root_dir, self.schema))
+            for file in files
+        )
@@ -1,11 +1,20 @@
 import duckdb
+import glob
+import os
 import polars as pl
+from pipeline.connections import connect
 
 METADATA_TABLE = "loads"
-METADATA_TABLE_SCHEMA = "load_id VARCHAR, loaded_rows INTEGER"
+# loaded_rows is the number of inserted and updated rows. The numbers of rows inserted,
+# updated and skipped as unchanged are also stored separately. Loads from before the
+# separate counts were added have nulls in them.
+METADATA_COUNT_COLUMNS = ["inserted_rows", "updated_rows", "skipped_rows"]
+METADATA_TABLE_SCHEMA = "load_id VARCHAR, loaded_rows INTEGER, " + ", ".join(
+    f"{col} INTEGER" for col in METADATA_COUNT_COLUMNS
+)
 
 TARGET_TABLE_PK = "date, time, line, direction, origin_aimed_departure_time"
-TARGET_TABLE_SCHEMA = f"""
+TARGET_TABLE_COLUMNS = """
 date DATE,
 time TIME,
 line VARCHAR,
@@ -19,27 +28,135 @@ longitude DOUBLE,
 latitude DOUBLE,
 speed REAL,
 origin_aimed_departure_time TIME,
+origin_day_offset TINYINT,
 delay BIGINT,
-update_time TIMESTAMPTZ,
+update_time TIMESTAMPTZ
+"""
+# Columns compared to find the rows of a batch that changed. update_time is always
+# different.
+TARGET_TABLE_VALUE_COLUMNS = [
+    "operator",
+    "vehicle",
+    "journey_pattern",
+    "origin_short_name",
+    "destination_short_name",
+    "longitude",
+    "latitude",
+    "speed",
+    "origin_day_offset",
+    "delay",
+]
+TARGET_TABLE_SCHEMA = f"""{TARGET_TABLE_COLUMNS},
 PRIMARY KEY ({TARGET_TABLE_PK})
 """
+# Columns added to the silver tables after they were first created, with their type and
+# the value of the rows from before them. Departures past midnight, e.g. 2415, failed
+# to parse before origin_day_offset was added, so all older rows have the offset 0.
+ADDED_COLUMNS = {"origin_day_offset": ("TINYINT", 0)}
+
+# Sample of the rows dropped by the transformations with the reason they were dropped
+# and the load id of the batch they were dropped from.
+QUARANTINE_TABLE = "quarantine"
+QUARANTINE_TABLE_SCHEMA = f"""
+load_id VARCHAR,
+reason VARCHAR,
+{TARGET_TABLE_COLUMNS}
+"""
+
+# Same transformation as utils.transformations.transform_bus_data, drop_nulls and
+# deduplicate, but as a single DuckDB query for the duckdb engine.
+DELAY_PATTERN = r"^(-)?P(\d+)Y(\d+)M(\d+)DT(\d+)H(\d+)M(\d+)(?:\.\d+)?S$"
+# HHMM departure times with hours up to utils.format.DEPARTURE_MAX_HOURS, e.g. 2415.
+DEPARTURE_PATTERN = r"^([0-3][0-9]|4[0-7])[0-5][0-9]$"
+TRANSFORM_QUERY = f"""
+WITH renamed AS (
+    SELECT
+        recorded_at_time::TIMESTAMP::DATE AS date,
+        recorded_at_time::TIMESTAMP::TIME AS time,
+        monitored_vehicle_journey__line_ref AS line,
+        monitored_vehicle_journey__operator_ref AS operator,
+        monitored_vehicle_journey__vehicle_ref AS vehicle,
+        monitored_vehicle_journey__journey_pattern_ref AS journey_pattern,
+        monitored_vehicle_journey__origin_short_name AS origin_short_name,
+        monitored_vehicle_journey__destination_short_name AS destination_short_name,
+        monitored_vehicle_journey__direction_ref AS direction,
+        monitored_vehicle_journey__vehicle_location__longitude::DOUBLE AS longitude,
+        monitored_vehicle_journey__vehicle_location__latitude::DOUBLE AS latitude,
+        monitored_vehicle_journey__speed::REAL AS speed,
+        CASE
+            WHEN regexp_matches(
+                monitored_vehicle_journey__origin_aimed_departure_time,
+                '{DEPARTURE_PATTERN}'
+            )
+            THEN monitored_vehicle_journey__origin_aimed_departure_time[1:2]::INTEGER * 60
+                + monitored_vehicle_journey__origin_aimed_departure_time[3:4]::INTEGER
+        END AS departure_minutes,
+        regexp_extract(
+            monitored_vehicle_journey__delay,
+            '{DELAY_PATTERN}',
+            ['sign', 'years', 'months', 'days', 'hours', 'minutes', 'seconds']
+        ) AS delay_parts,
+        now() AS update_time
+    FROM {{source}}
+    WHERE _dlt_load_id > {{last_load}}::VARCHAR AND _dlt_load_id <= {{until_load}}::VARCHAR
+),
+transformed AS (
+    SELECT
+        * EXCLUDE (delay_parts, departure_minutes),
+        make_time(departure_minutes // 60 % 24, departure_minutes % 60, 0)
+            AS origin_aimed_departure_time,
+        (departure_minutes // 1440)::TINYINT AS origin_day_offset,
+        CASE WHEN delay_parts.sign = '-' THEN -1 ELSE 1 END * (
+            (
+                (
+                    TRY_CAST(delay_parts.years AS BIGINT) * 365
+                    + TRY_CAST(delay_parts.months AS BIGINT) * 30
+                    + TRY_CAST(delay_parts.days AS BIGINT)
+                ) * 24
+                + TRY_CAST(delay_parts.hours AS BIGINT)
+            ) * 3600
+            + TRY_CAST(delay_parts.minutes AS BIGINT) * 60
+            + TRY_CAST(delay_parts.seconds AS BIGINT)
+        ) AS delay
+    FROM renamed
+)
+SELECT
+    date, time, line, operator, vehicle, journey_pattern, origin_short_name,
+    destination_short_name, direction, longitude, latitude, speed,
+    origin_aimed_departure_time, origin_day_offset, delay, update_time
+FROM transformed
+WHERE COLUMNS(*) IS NOT NULL
+QUALIFY row_number() OVER (PARTITION BY {TARGET_TABLE_PK}) = 1
+"""
 
 
 def create_or_replace_tables(db_path: str, schema: str, table: str):
     """
-    Function creates the silver target table and/or metadata tables if they do not exist.
+    Function creates the silver target table, metadata and quarantine tables if they do not exist.
 
     Params:
         - db_path: filepath to the DuckDB database-file.
         - schema: schema of the silver tables.
         - table: name of the silver table.
     """
-    with duckdb.connect(db_path) as db:
+    with connect(db_path) as db:
         db.sql(f"CREATE SCHEMA IF NOT EXISTS {schema}")
         db.sql(
-            f"CREATE TABLE IF NOT EXISTS {schema}.{METADATA_TABLE} (load_id VARCHAR, loaded_rows INTEGER)"
+            f"CREATE TABLE IF NOT EXISTS {schema}.{METADATA_TABLE} ({METADATA_TABLE_SCHEMA})"
         )
+        for col in METADATA_COUNT_COLUMNS:
+            db.sql(
+                f"ALTER TABLE {schema}.{METADATA_TABLE} ADD COLUMN IF NOT EXISTS {col} INTEGER"
+            )
         db.sql(f"CREATE TABLE IF NOT EXISTS {schema}.{table} ({TARGET_TABLE_SCHEMA})")
+        db.sql(
+            f"CREATE TABLE IF NOT EXISTS {schema}.{QUARANTINE_TABLE} ({QUARANTINE_TABLE_SCHEMA})"
+        )
+        for col, (datatype, value) in ADDED_COLUMNS.items():
+            for t in [table, QUARANTINE_TABLE]:
+                db.sql(
+                    f"ALTER TABLE {schema}.{t} ADD COLUMN IF NOT EXISTS {col} {datatype} DEFAULT {value}"
+                )
 
 
 def get_last_load(db_path: str, schema: str, reset_tables: bool) -> str:
@@ -53,7 +170,7 @@ def get_last_load(db_path: str, schema: str, reset_tables: bool) -> str:
         - db_path: filepath to the DuckDB database-file.
         - schema: schema of the silver tables.
     """
-    with duckdb.connect(db_path) as db:
+    with connect(db_path) as db:
         last_load = db.sql(
             f"SELECT MAX(load_id) FROM {schema}.{METADATA_TABLE}"
         ).fetchall()[0][0]
@@ -64,7 +181,113 @@ def get_last_load(db_path: str, schema: str, reset_tables: bool) -> str:
     return last_load
 
 
-def get_new_data(db_path: str, schema: str, table: str, last_load: str) -> pl.DataFrame:
+def source_relation(table_ref: str, table: str, archive_dir: str | None) -> str:
+    """
+    Function returns the bronze table as a relation to select from. If archive_dir is
+    given, the loads archived from the bronze table to Parquet files in archive_dir
+    are included.
+
+    Params:
+        - table_ref: name of the bronze table including the schema.
+        - table: name of the bronze table.
+        - archive_dir: directory of the archived bronze loads or None.
+    """
+    if archive_dir is None:
+        return table_ref
+
+    archive_files = os.path.join(archive_dir, table, "*", "*.parquet")
+    if len(glob.glob(archive_files)) == 0:
+        return table_ref
+
+    return f"""(
+        SELECT * FROM {table_ref}
+        UNION ALL BY NAME
+        SELECT * EXCLUDE (load_date)
+        FROM read_parquet('{archive_files}', hive_partitioning = true, union_by_name = true)
+    )"""
+
+
+def get_new_loads(
+    db_path: str,
+    schema: str,
+    table: str,
+    last_load: str,
+    archive_dir: str | None = None,
+) -> list[tuple[str, int]]:
+    """
+    Function gets the load ids and row counts of all new loads in the bronze table,
+    ordered by load id.
+
+    New loads are read from dlt's _dlt_loads table, which has a single row per load,
+    and only loads that dlt has marked as completed are returned. This way a load that
+    is still being written is never read partially. The bronze table is only filtered
+    with a range of load ids, which DuckDB answers from the min/max statistics of the
+    row groups, so the history before last_load is not scanned.
+
+    Params:
+        - db_path: filepath to the DuckDB database-file.
+        - schema: schema of the bronze table.
+        - table: name of the bronze table.
+        - last_load: load id of the latest load.
+        - archive_dir: if given, also get loads archived to this directory.
+    """
+    source = source_relation(f"{schema}.{table}", table, archive_dir)
+    with connect(db_path, read_only=True) as db:
+        loads = db.sql(
+            f"""SELECT data._dlt_load_id, COUNT(*)
+            FROM {source} AS data
+            JOIN {schema}._dlt_loads AS loads ON data._dlt_load_id = loads.load_id
+            WHERE data._dlt_load_id > {last_load}::VARCHAR
+                AND loads.load_id > {last_load}::VARCHAR
+                AND loads.status = 0
+            GROUP BY data._dlt_load_id
+            ORDER BY data._dlt_load_id"""
+        ).fetchall()
+
+    return loads
+
+
+def batch_loads(
+    loads: list[tuple[str, int]], last_load: str, batch_size: int | None
+) -> list[tuple[str, str]]:
+    """
+    Function groups consecutive loads into batches of at most batch_size rows.
+    A single load is never split between batches, so a load larger than batch_size
+    gets a batch of its own. If batch_size is None, all loads go into a single batch.
+
+    Returns a list of (previous load id, last load id of the batch) tuples that can be
+    passed to `get_new_data` as last_load and until_load.
+
+    Params:
+        - loads: load ids and row counts as returned by `get_new_loads`.
+        - last_load: load id of the latest load.
+        - batch_size: maximum number of rows in a batch.
+    """
+    batches = []
+    batch_start = last_load
+    batch_rows = 0
+    for i, (load_id, rows) in enumerate(loads):
+        batch_rows += rows
+        is_last = i == len(loads) - 1
+        if is_last or (
+            batch_size is not None and batch_rows + loads[i + 1][1] > batch_size
+        ):
+            batches.append((batch_start, load_id))
+            batch_start = load_id
+            batch_rows = 0
+
+    return batches
+
+
+def get_new_data(
+    db_path: str,
+    schema: str,
+    table: str,
+    last_load: str,
+    until_load: str | None = None,
+    archive_dir: str | None = None,
+    columns: list[str] | None = None,
+) -> pl.DataFrame:
     """
     Function gets all new rows from the bronze table.
 
@@ -73,16 +296,124 @@ def get_new_data(db_path: str, schema: str, table: str, last_load: str) -> pl.Da
         - schema: schema of the silver tables.
         - table: name of the silver table.
         - last_load: load id of the latest load.
+        - until_load: if given, only get rows up to and including this load id.
+        - archive_dir: if given, also get rows archived to this directory.
+        - columns: if given, only get these columns.
     """
-    with duckdb.connect(db_path, read_only=True) as db:
+    until_filter = (
+        "" if until_load is None else f"AND _dlt_load_id <= {until_load}::VARCHAR"
+    )
+    select = "*" if columns is None else ", ".join(columns)
+    source = source_relation(f"{schema}.{table}", table, archive_dir)
+    with connect(db_path, read_only=True) as db:
         df = db.sql(
-            f"""FROM {schema}.{table}
-            WHERE _dlt_load_id > {last_load}::VARCHAR"""
+            f"""SELECT {select} FROM {source}
+            WHERE _dlt_load_id > {last_load}::VARCHAR {until_filter}"""
         ).pl()
 
     return df
 
 
+def upsert_batch(
+    db: duckdb.DuckDBPyConnection, batch: str, schema: str, table: str, update: bool
+) -> tuple[int, int, int]:
+    """
+    Function upserts the rows of a batch staged to a table to the silver table and
+    returns the numbers of inserted, updated and skipped rows.
+
+    Rows with a new primary key are inserted and the other rows are skipped with
+    ON CONFLICT DO NOTHING. If update == True, the rows of the batch are first joined
+    to the rows of the silver table in the date range of the batch, which DuckDB reads
+    using the min/max statistics of the row groups, and the rows whose values in
+    TARGET_TABLE_VALUE_COLUMNS changed are updated, e.g. late corrections of delays.
+    Only the columns that changed in some row are set, since the cost of an update in
+    DuckDB grows with the number of updated columns.
+
+    Params:
+        - db: connection to the silver database.
+        - batch: name of the table with the rows of the batch, deduplicated by primary
+          key.
+        - schema: schema of the silver tables.
+        - table: name of the silver table.
+        - update: if True, update the changed rows.
+    """
+    batch_rows, min_date, max_date = db.sql(
+        f"SELECT COUNT(*), MIN(date), MAX(date) FROM {batch}"
+    ).fetchone()
+    if batch_rows == 0:
+        return 0, 0, 0
+
+    updated_rows = 0
+    if update:
+        on = " AND ".join(f"b.{col} = t.{col}" for col in TARGET_TABLE_PK.split(", "))
+        changed = ", ".join(
+            f"CASE WHEN b.{col} IS DISTINCT FROM t.{col} THEN '{col}' END"
+            for col in TARGET_TABLE_VALUE_COLUMNS
+        )
+        db.sql(
+            f"""CREATE OR REPLACE TEMP TABLE upsert_changes AS
+            SELECT b.*, [{changed}] AS changed_columns
+            FROM {batch} AS b
+            JOIN (
+                SELECT * FROM {schema}.{table}
+                WHERE date BETWEEN '{min_date}' AND '{max_date}'
+            ) AS t ON {on}
+            WHERE list_count(changed_columns) > 0"""
+        )
+        updated_rows, changed_columns = db.sql(
+            """SELECT COUNT(*), list_distinct(flatten(list(changed_columns)))
+            FROM upsert_changes"""
+        ).fetchone()
+        if updated_rows > 0:
+            set_columns = ", ".join(
+                f"{col} = b.{col}" for col in changed_columns + ["update_time"]
+            )
+            db.sql(
+                f"""UPDATE {schema}.{table} AS t SET {set_columns}
+                FROM upsert_changes AS b
+                WHERE {on}"""
+            )
+        db.sql("DROP TABLE upsert_changes")
+
+    inserted_rows = db.execute(
+        f"""INSERT INTO {schema}.{table} BY NAME
+        FROM {batch}
+        ON CONFLICT ({TARGET_TABLE_PK}) DO NOTHING"""
+    ).fetchone()[0]
+
+    return inserted_rows, updated_rows, batch_rows - inserted_rows - updated_rows
+
+
+def insert_checkpoint(
+    db: duckdb.DuckDBPyConnection,
+    checkpoint: str,
+    schema: str,
+    counts: tuple[int, int, int],
+):
+    """
+    Function inserts a load id to the metadata/checkpoint table with the numbers of
+    rows the batch inserted, updated and skipped.
+
+    Params:
+        - db: connection to the silver database.
+        - checkpoint: new load id to be inserted to the metadata/checkpoint table.
+        - schema: schema of the silver tables.
+        - counts: numbers of inserted, updated and skipped rows.
+    """
+    inserted_rows, updated_rows, skipped_rows = counts
+    db.sql(
+        f"""INSERT INTO {schema}.{METADATA_TABLE}
+            (load_id, loaded_rows, {", ".join(METADATA_COUNT_COLUMNS)})
+        VALUES (
+            {checkpoint},
+            {inserted_rows + updated_rows},
+            {inserted_rows},
+            {updated_rows},
+            {skipped_rows}
+        )"""
+    )
+
+
 def insert_new_data(
     df: pl.DataFrame,
     checkpoint: str,
@@ -90,13 +421,16 @@ def insert_new_data(
     schema: str,
     table: str,
     reset_tables: bool,
-):
+    quarantine: pl.DataFrame | None = None,
+    update: bool = False,
+) -> tuple[int, int, int]:
     """
-    Function inserts new rows to the silver table and inserts the new MAX(load id)
-    to the metadata/checkpoint table. If reset_tables == True, then also recreates
-    the silver tables.
+    Function upserts new rows to the silver table with `upsert_batch` and inserts the
+    new MAX(load id) to the metadata/checkpoint table. If reset_tables == True, then
+    also recreates the silver tables.
 
-    Everything done in a single transaction.
+    Everything done in a single transaction. Returns the numbers of inserted, updated
+    and skipped rows.
 
     Params:
         - df: Polars DataFrame containing new rows.
@@ -104,9 +438,12 @@ def insert_new_data(
         - db_path: filepath to the DuckDB database-file.
         - schema: schema of the silver tables.
         - table: name of the silver table.
-        - reset_tables: if True, recreate the .
+        - reset_tables: if True, recreate the silver tables.
+        - quarantine: if given, rejected rows with their reason to insert to the
+          quarantine table, e.g. from `utils.transformations.quarantine_sample`.
+        - update: if True, update the rows that changed instead of skipping them.
     """
-    with duckdb.connect(db_path) as db:
+    with connect(db_path) as db:
         db.sql("BEGIN TRANSACTION")
         if reset_tables:
             print("Resetting silver tables.")
@@ -115,14 +452,85 @@ def insert_new_data(
                 f"CREATE OR REPLACE TABLE {schema}.{METADATA_TABLE} ({METADATA_TABLE_SCHEMA})"
             )
             db.sql(f"CREATE OR REPLACE TABLE {schema}.{table} ({TARGET_TABLE_SCHEMA})")
-        db.sql(
-            f"""INSERT INTO {schema}.{METADATA_TABLE} (load_id, loaded_rows)
-            VALUES ({checkpoint}, {len(df)})"""
-        )
-        all_columns = ", ".join(df.columns)
-        db.sql(
-            f"""INSERT INTO {schema}.{table} ({all_columns})
-            FROM df
-            ON CONFLICT ({TARGET_TABLE_PK}) DO NOTHING"""
+            db.sql(
+                f"CREATE OR REPLACE TABLE {schema}.{QUARANTINE_TABLE} ({QUARANTINE_TABLE_SCHEMA})"
+            )
+        db.sql("CREATE OR REPLACE TEMP TABLE silver_batch AS FROM df")
+        counts = upsert_batch(db, "silver_batch", schema, table, update)
+        db.sql("DROP TABLE silver_batch")
+        insert_checkpoint(db, checkpoint, schema, counts)
+        if quarantine is not None:
+            db.sql(
+                f"""INSERT INTO {schema}.{QUARANTINE_TABLE} BY NAME
+                SELECT {checkpoint}::VARCHAR AS load_id, * FROM quarantine"""
+            )
+        db.sql("COMMIT")
+
+    return counts
+
+
+def transform_and_insert_new_data(
+    source_db: str,
+    source_schema: str,
+    source_table: str,
+    last_load: str,
+    until_load: str,
+    db_path: str,
+    schema: str,
+    table: str,
+    reset_tables: bool,
+    archive_dir: str | None = None,
+    update: bool = False,
+) -> tuple[int, int, int]:
+    """
+    Function transforms new rows from the bronze table to a temporary table and upserts
+    them to the silver table with `upsert_batch` without moving any rows through Python.
+    Inserts until_load to the metadata/checkpoint table. If reset_tables == True,
+    then also recreates the silver tables.
+
+    Everything done in a single transaction. Returns the numbers of inserted, updated
+    and skipped rows, which are also stored in the metadata/checkpoint table.
+
+    Params:
+        - source_db: filepath to the bronze DuckDB database-file.
+        - source_schema: schema of the bronze table.
+        - source_table: name of the bronze table.
+        - last_load: load id of the latest load.
+        - until_load: load id of the last load to transform.
+        - db_path: filepath to the DuckDB database-file.
+        - schema: schema of the silver tables.
+        - table: name of the silver table.
+        - reset_tables: if True, recreate the silver tables.
+        - archive_dir: if given, also transform rows archived to this directory.
+        - update: if True, update the rows that changed instead of skipping them.
+    """
+    with connect(db_path) as db:
+        db.sql(f"ATTACH '{source_db}' AS transform_source (READ_ONLY)")
+        db.sql("BEGIN TRANSACTION")
+        if reset_tables:
+            print("Resetting silver tables.")
+            print("*" * 50)
+            db.sql(
+                f"CREATE OR REPLACE TABLE {schema}.{METADATA_TABLE} ({METADATA_TABLE_SCHEMA})"
+            )
+            db.sql(f"CREATE OR REPLACE TABLE {schema}.{table} ({TARGET_TABLE_SCHEMA})")
+            db.sql(
+                f"CREATE OR REPLACE TABLE {schema}.{QUARANTINE_TABLE} ({QUARANTINE_TABLE_SCHEMA})"
+            )
+        query = TRANSFORM_QUERY.format(
+            source=source_relation(
+                f"transform_source.{source_schema}.{source_table}",
+                source_table,
+                archive_dir,
+            ),
+            last_load=last_load,
+            until_load=until_load,
         )
+        db.sql(f"CREATE OR REPLACE TEMP TABLE silver_batch AS {query}")
+        counts = upsert_batch(db, "silver_batch", schema, table, update)
+        db.sql("DROP TABLE silver_batch")
+        insert_checkpoint(db, until_load, schema, counts)
         db.sql("COMMIT")
+        db.sql("DETACH transform_source")
+
+    return counts
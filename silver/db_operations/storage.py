@@ -0,0 +1,154 @@
+import os
+import polars as pl
+from abc import ABC, abstractmethod
+from db_operations.functions import (
+    create_or_replace_tables,
+    get_last_load,
+    insert_new_data,
+)
+from pipeline.connections import connect
+
+STORAGE_BACKENDS = ["duckdb", "delta"]
+
+
+class SilverStorage(ABC):
+    """
+    Interface of the storage of the silver table with its metadata/checkpoint table and
+    quarantine table. Rows are inserted with the primary key TARGET_TABLE_PK, and rows
+    with a key that is already in the table are skipped.
+    """
+
+    @abstractmethod
+    def create_tables(self):
+        """
+        Function creates the silver target table, metadata and quarantine tables if they
+        do not exist.
+        """
+
+    @abstractmethod
+    def get_last_load(self, reset_tables: bool) -> str:
+        """
+        Function gets the load id of the latest load. If there are no previous loads or
+        if reset_tables == True, returns "0".
+
+        Params:
+            - reset_tables: if True, the tables will be recreated.
+        """
+
+    @abstractmethod
+    def insert_new_data(
+        self,
+        df: pl.DataFrame,
+        checkpoint: str,
+        reset_tables: bool,
+        quarantine: pl.DataFrame | None = None,
+        update: bool = False,
+    ) -> tuple[int, int, int]:
+        """
+        Function upserts new rows to the silver table and inserts the new MAX(load id)
+        with the numbers of inserted, updated and skipped rows to the
+        metadata/checkpoint table. If reset_tables == True, then also recreates the
+        silver tables. Returns the numbers of inserted, updated and skipped rows.
+
+        Params:
+            - df: Polars DataFrame containing new rows.
+            - checkpoint: new load id to be inserted to the metadata/checkpoint table.
+            - reset_tables: if True, recreate the silver tables.
+            - quarantine: if given, rejected rows with their reason to insert to the
+              quarantine table.
+            - update: if True, update the rows whose values in
+              TARGET_TABLE_VALUE_COLUMNS changed instead of skipping them.
+        """
+
+    @abstractmethod
+    def read_table(self, table: str | None = None) -> pl.DataFrame:
+        """
+        Function reads all rows of a silver table with the datatypes of the silver table
+        in DuckDB.
+
+        Params:
+            - table: name of the table, e.g. METADATA_TABLE. Defaults to the silver table.
+        """
+
+    @abstractmethod
+    def size_bytes(self) -> int:
+        """
+        Function gets the total size of the files of the silver tables in bytes.
+        """
+
+
+class DuckDBStorage(SilverStorage):
+    """
+    Silver tables in a DuckDB database-file. Inserts are done in a single transaction,
+    but the file can only be opened by one process while it is written.
+
+    Params:
+        - db_path: filepath to the DuckDB database-file.
+        - schema: schema of the silver tables.
+        - table: name of the silver table.
+    """
+
+    def __init__(self, db_path: str, schema: str, table: str):
+        self.db_path = db_path
+        self.schema = schema
+        self.table = table
+
+    def create_tables(self):
+        create_or_replace_tables(
+            db_path=self.db_path, schema=self.schema, table=self.table
+        )
+
+    def get_last_load(self, reset_tables: bool) -> str:
+        return get_last_load(
+            db_path=self.db_path, schema=self.schema, reset_tables=reset_tables
+        )
+
+    def insert_new_data(
+        self,
+        df: pl.DataFrame,
+        checkpoint: str,
+        reset_tables: bool,
+        quarantine: pl.DataFrame | None = None,
+        update: bool = False,
+    ) -> tuple[int, int, int]:
+        return insert_new_data(
+            df=df,
+            checkpoint=checkpoint,
+            db_path=self.db_path,
+            schema=self.schema,
+            table=self.table,
+            reset_tables=reset_tables,
+            quarantine=quarantine,
+            update=update,
+        )
+
+    def read_table(self, table: str | None = None) -> pl.DataFrame:
+        with connect(self.db_path, read_only=True) as db:
+            return db.sql(f"FROM {self.schema}.{table or self.table}").pl()
+
+    def size_bytes(self) -> int:
+        return os.path.getsize(self.db_path)
+
+
+def get_storage(backend: str, db_path: str, schema: str, table: str) -> SilverStorage:
+    """
+    Function returns the storage of the silver tables.
+
+    Params:
+        - backend: one of STORAGE_BACKENDS.
+        - db_path: filepath to the DuckDB database-file, or the directory of the Delta
+          tables.
+        - schema: schema of the silver tables.
+        - table: name of the silver table.
+    """
+    if backend == "duckdb":
+        return DuckDBStorage(db_path, schema, table)
+    if backend == "delta":
+        # Imported only when used, since importing deltalake takes longer than
+        # connecting to DuckDB and reading the checkpoint.
+        from db_operations.delta_storage import DeltaStorage
+
+        return DeltaStorage(db_path, schema, table)
+    raise Exception(
+        f"Storage backend must be one of {', '.join(STORAGE_BACKENDS)}. Current value: {backend}"
+    )
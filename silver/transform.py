@@ -1,14 +1,28 @@
 import polars as pl
 import os
 import sys
+import string
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from db_operations.functions import (
-    create_or_replace_tables,
-    get_last_load,
+    get_new_loads,
+    batch_loads,
     get_new_data,
-    insert_new_data,
+    transform_and_insert_new_data,
     TARGET_TABLE_PK,
 )
-from utils.transformations import transform_bus_data, drop_nulls, deduplicate
+from db_operations.storage import get_storage, STORAGE_BACKENDS
+from utils.transformations import (
+    transform_bus_data_lazy,
+    clean_bus_data,
+    split_nulls,
+    split_duplicates,
+    quarantine_sample,
+    count_departure_errors,
+    BRONZE_COLUMNS,
+)
+from utils.cache import BatchCache
+from instrumentation.metrics import RunMetrics
 
 SOURCE_DB = os.getenv("SOURCE_DB")
 SOURCE_SCHEMA = os.getenv("SOURCE_SCHEMA")
@@ -23,6 +37,101 @@ if RESET_TABLES is not None and RESET_TABLES.lower() == "true":
 else:
     RESET_TABLES = False
 
+# Engine used for the transformations. With "polars" the bronze rows are transformed
+# in Python with Polars, with "duckdb" the whole transformation runs inside DuckDB.
+ENGINE = os.getenv("ENGINE", "polars").lower()
+if ENGINE not in ["polars", "duckdb"]:
+    raise Exception(
+        f"Environment variable ENGINE must be either polars or duckdb. Current value: {ENGINE}"
+    )
+
+# Storage of the silver tables. With "duckdb" the tables are in the DuckDB database-file
+# TARGET_DB, with "delta" they are Delta tables in the directory TARGET_DB that can be
+# read while silver is written.
+SILVER_STORAGE = os.getenv("SILVER_STORAGE", "duckdb").lower()
+if SILVER_STORAGE not in STORAGE_BACKENDS:
+    raise Exception(
+        f"Environment variable SILVER_STORAGE must be either duckdb or delta. Current value: {SILVER_STORAGE}"
+    )
+if ENGINE == "duckdb" and SILVER_STORAGE != "duckdb":
+    raise Exception(
+        "Environment variable ENGINE can only be duckdb when SILVER_STORAGE is duckdb."
+    )
+
+# If true, rows that are already in silver are updated if their values changed, e.g.
+# when a delay is corrected in a later load, and gold picks up the new update_time. By
+# default such rows are skipped.
+UPSERT = os.getenv("UPSERT")
+if UPSERT is not None and UPSERT.lower() == "true":
+    UPSERT = True
+else:
+    UPSERT = False
+
+# Maximum number of bronze rows to transform and load at once. Bounds the memory usage
+# when there is a large backlog of new data, e.g. when resetting tables.
+BATCH_SIZE = os.getenv("BATCH_SIZE")
+if BATCH_SIZE is not None:
+    if not all(c in string.digits for c in BATCH_SIZE):
+        raise Exception(
+            f"Environment variable BATCH_SIZE can only contain digits. Current value: {BATCH_SIZE}"
+        )
+    BATCH_SIZE = int(BATCH_SIZE)
+
+# Number of batches to read and transform concurrently with the Polars engine. The
+# batches are still inserted to silver one at a time in order, each with its own
+# checkpoint, so a failed run continues from the last inserted batch.
+WORKERS = os.getenv("WORKERS")
+if WORKERS is None:
+    WORKERS = 1
+else:
+    if not all(c in string.digits for c in WORKERS) or WORKERS == "0":
+        raise Exception(
+            f"Environment variable WORKERS must be a positive integer. Current value: {WORKERS}"
+        )
+    WORKERS = int(WORKERS)
+
+# Collect the lazy transformation with the streaming engine of Polars. Processes the
+# batch in chunks, which lowers the peak memory usage further.
+STREAMING = os.getenv("STREAMING")
+if STREAMING is not None and STREAMING.lower() == "true":
+    STREAMING = True
+else:
+    STREAMING = False
+
+# With "debug" the transformed rows and the quarantined rows of each batch are printed,
+# with "info" only the row counts.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "info").lower()
+if LOG_LEVEL not in ["debug", "info"]:
+    raise Exception(
+        f"Environment variable LOG_LEVEL must be either debug or info. Current value: {LOG_LEVEL}"
+    )
+
+# Maximum number of rows dropped for nulls and for duplicates to insert to the
+# quarantine table from each batch. Set to 0 to disable the quarantine.
+QUARANTINE_ROWS = os.getenv("QUARANTINE_ROWS", "100")
+if not all(c in string.digits for c in QUARANTINE_ROWS):
+    raise Exception(
+        f"Environment variable QUARANTINE_ROWS can only contain digits. Current value: {QUARANTINE_ROWS}"
+    )
+QUARANTINE_ROWS = int(QUARANTINE_ROWS)
+
+# Directory of the cache of transformed batches. If set, the Polars engine caches every
+# transformed batch by its range of load ids, and a rerun of the same loads reads the
+# cached rows instead of reading bronze and transforming them again. The least recently
+# used batches are removed when the cache takes more than CACHE_MAX_MB (default 1024).
+CACHE_DIR = os.getenv("CACHE_DIR")
+CACHE_MAX_MB = os.getenv("CACHE_MAX_MB", "1024")
+if not all(c in string.digits for c in CACHE_MAX_MB):
+    raise Exception(
+        f"Environment variable CACHE_MAX_MB can only contain digits. Current value: {CACHE_MAX_MB}"
+    )
+CACHE_MAX_MB = int(CACHE_MAX_MB)
+
+# Directory of the bronze loads archived by clean_bronze/archive_old_loads.py. The
+# archive is only read when resetting tables, since the loads after the checkpoint
+# are never archived.
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR") if RESET_TABLES else None
+
 if None in [
     SOURCE_DB,
     SOURCE_SCHEMA,
@@ -36,49 +145,225 @@ if None in [
         + "$SOURCE_TABLE, $TARGET_DB, $TARGET_SCHEMA, and $TARGET_TABLE"
     )
 
+metrics = RunMetrics("silver")
+
+storage = get_storage(
+    backend=SILVER_STORAGE, db_path=TARGET_DB, schema=TARGET_SCHEMA, table=TARGET_TABLE
+)
+
 # Create the silver table and metadata/checkpoint table if they do not exist.
-create_or_replace_tables(db_path=TARGET_DB, schema=TARGET_SCHEMA, table=TARGET_TABLE)
+storage.create_tables()
 
 # Get the load id of the latest silver load.
-last_load = get_last_load(
-    db_path=TARGET_DB, schema=TARGET_SCHEMA, reset_tables=RESET_TABLES
-)
+last_load = storage.get_last_load(reset_tables=RESET_TABLES)
 print("Latest load:")
 print(last_load)
 print("*" * 50)
 
-# Get all new rows from bronze table.
-source_df = get_new_data(
-    db_path=SOURCE_DB, schema=SOURCE_SCHEMA, table=SOURCE_TABLE, last_load=last_load
-)
-if len(source_df) == 0:
+# Get all new loads from bronze table and split them into batches.
+with metrics.phase("get_new_loads"):
+    new_loads = get_new_loads(
+        db_path=SOURCE_DB,
+        schema=SOURCE_SCHEMA,
+        table=SOURCE_TABLE,
+        last_load=last_load,
+        archive_dir=ARCHIVE_DIR,
+    )
+if len(new_loads) == 0:
     print("No new data to load.")
+    metrics.finish(status="no_data")
     sys.exit(0)
 
-# Transform the bronze data to silver format.
-new_df = transform_bus_data(source_df=source_df)
-
-# Drop and log rows with nulls.
-new_df = drop_nulls(source_df=new_df, logging=True)
+batches = batch_loads(loads=new_loads, last_load=last_load, batch_size=BATCH_SIZE)
+print(f"# of new loads: {len(new_loads)}, # of batches: {len(batches)}")
+print("*" * 50)
+metrics.set("loads", len(new_loads))
+metrics.set("batches", len(batches))
+metrics.set("rows_in", sum(row_count for _, row_count in new_loads))
 
-# Deduplicate rows by PK.
 # NOTE: TARGET_TABLE_PK is defined in submodule db_operations.
 pk_cols = TARGET_TABLE_PK.split(", ")
-new_df = deduplicate(source_df=new_df, pk_cols=pk_cols, logging=True)
 
-print(f"# of new rows: {len(new_df)}")
-print("*" * 50)
+cache = None
+if CACHE_DIR is not None and ENGINE == "polars":
+    cache = BatchCache(
+        cache_dir=CACHE_DIR,
+        max_bytes=CACHE_MAX_MB * 2**20,
+        settings={"quarantine_rows": QUARANTINE_ROWS},
+    )
 
-with pl.Config() as cfg:
-    cfg.set_tbl_cols(new_df.width)
-    print(new_df)
-
-# Insert new data to silver. Reset tables if required.
-insert_new_data(
-    df=new_df,
-    checkpoint=source_df["_dlt_load_id"].max(),
-    db_path=TARGET_DB,
-    schema=TARGET_SCHEMA,
-    table=TARGET_TABLE,
-    reset_tables=RESET_TABLES,
-)
+
+def read_and_transform(
+    batch_start: str, batch_end: str
+) -> tuple[pl.DataFrame, int, int, int, pl.DataFrame | None]:
+    """
+    Function gets the rows of a batch from bronze and transforms them, or gets the
+    transformed batch from the cache. Returns the new rows, the numbers of rows with
+    nulls, duplicate rows and rows with malformed departure times, and the quarantined
+    rows. The rows with malformed departure times are also counted in the rows with
+    nulls.
+    """
+    if cache is not None:
+        with metrics.phase("cache_get"):
+            cached = cache.get(batch_start=batch_start, batch_end=batch_end)
+        if cached is not None:
+            metrics.count("cache_hits")
+            return cached
+        metrics.count("cache_misses")
+
+    # Get all rows of the loads in the batch from bronze table. Only the columns used
+    # by the transformation are read.
+    with metrics.phase("read"):
+        source_df = get_new_data(
+            db_path=SOURCE_DB,
+            schema=SOURCE_SCHEMA,
+            table=SOURCE_TABLE,
+            last_load=batch_start,
+            until_load=batch_end,
+            archive_dir=ARCHIVE_DIR,
+            columns=BRONZE_COLUMNS,
+        )
+    metrics.count("bytes_in", source_df.estimated_size())
+
+    with metrics.phase("transform"):
+        departure_errors = count_departure_errors(source_df=source_df)
+        # Transform the bronze data to silver format. The transformation is a single
+        # lazy query, so only the bronze columns it uses are materialized.
+        if QUARANTINE_ROWS > 0:
+            # Drop rows with nulls and deduplicate rows by PK, keeping the dropped
+            # rows for the quarantine.
+            new_df = transform_bus_data_lazy(source_lf=source_df.lazy()).collect(
+                streaming=STREAMING
+            )
+            del source_df
+            new_df, null_df = split_nulls(source_df=new_df)
+            new_df, duplicate_df = split_duplicates(source_df=new_df, pk_cols=pk_cols)
+            quarantine = quarantine_sample(
+                rejected={"null": null_df, "duplicate": duplicate_df},
+                max_rows=QUARANTINE_ROWS,
+            )
+            null_rows, duplicate_rows = len(null_df), len(duplicate_df)
+            del null_df, duplicate_df
+        else:
+            # Drop rows with nulls and deduplicate rows by PK in the same query.
+            new_df, not_null_rows = clean_bus_data(
+                source_df=source_df, pk_cols=pk_cols, streaming=STREAMING
+            )
+            null_rows = len(source_df) - not_null_rows
+            del source_df
+            duplicate_rows = not_null_rows - len(new_df)
+            quarantine = None
+
+    if cache is not None:
+        with metrics.phase("cache_put"):
+            cache.put(
+                batch_start=batch_start,
+                batch_end=batch_end,
+                new_df=new_df,
+                null_rows=null_rows,
+                duplicate_rows=duplicate_rows,
+                departure_errors=departure_errors,
+                quarantine=quarantine,
+            )
+
+    return new_df, null_rows, duplicate_rows, departure_errors, quarantine
+
+
+def transformed_batches():
+    """
+    Generator that yields the results of `read_and_transform` for each batch in order.
+    Up to WORKERS batches are read and transformed concurrently on a thread pool while
+    the earlier batches are inserted.
+    """
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        futures = deque()
+        for batch_start, batch_end in batches:
+            futures.append(pool.submit(read_and_transform, batch_start, batch_end))
+            if len(futures) >= WORKERS:
+                yield futures.popleft().result()
+        while len(futures) > 0:
+            yield futures.popleft().result()
+
+
+def record_counts(counts: tuple[int, int, int]):
+    """
+    Function prints the numbers of inserted, updated and skipped rows of a batch and
+    adds them to the metrics of the run.
+    """
+    inserted_rows, updated_rows, skipped_rows = counts
+    metrics.count("rows_out", inserted_rows + updated_rows)
+    metrics.count("rows_inserted", inserted_rows)
+    metrics.count("rows_updated", updated_rows)
+    metrics.count("rows_skipped", skipped_rows)
+    print(
+        f"# of inserted rows: {inserted_rows}, # of updated rows: {updated_rows}, "
+        + f"# of skipped rows: {skipped_rows}"
+    )
+
+
+if ENGINE == "duckdb":
+    for i, (batch_start, batch_end) in enumerate(batches):
+        # Transform and insert the batch to silver in a single query.
+        # Tables are reset only before the first batch if required.
+        with metrics.phase("transform_and_insert"):
+            counts = transform_and_insert_new_data(
+                source_db=SOURCE_DB,
+                source_schema=SOURCE_SCHEMA,
+                source_table=SOURCE_TABLE,
+                last_load=batch_start,
+                until_load=batch_end,
+                db_path=TARGET_DB,
+                schema=TARGET_SCHEMA,
+                table=TARGET_TABLE,
+                reset_tables=RESET_TABLES and i == 0,
+                archive_dir=ARCHIVE_DIR,
+                update=UPSERT,
+            )
+        print(f"Batch {i + 1}/{len(batches)}, loads up to {batch_end}")
+        record_counts(counts)
+        print("*" * 50)
+else:
+    for i, batch in enumerate(transformed_batches()):
+        new_df, null_rows, duplicate_rows, departure_errors, quarantine = batch
+        del batch
+        batch_end = batches[i][1]
+        metrics.count("null_rows", null_rows)
+        metrics.count("duplicate_rows", duplicate_rows)
+        metrics.count("departure_errors", departure_errors)
+        print(f"Batch {i + 1}/{len(batches)}, loads up to {batch_end}")
+        print(f"# of new rows: {len(new_df)}")
+        print(
+            f"# of rows with nulls: {null_rows}, # of duplicate rows: {duplicate_rows}"
+        )
+        if departure_errors > 0:
+            print(
+                f"# of rows with malformed departure times: {departure_errors}, "
+                + "dropped with the rows with nulls"
+            )
+
+        if LOG_LEVEL == "debug":
+            with pl.Config() as cfg:
+                cfg.set_tbl_cols(new_df.width)
+                print(new_df)
+                if quarantine is not None:
+                    print("Quarantined rows:")
+                    print(quarantine)
+
+        # Insert new data to silver and checkpoint the batch.
+        # Tables are reset only before the first batch if required.
+        with metrics.phase("insert"):
+            counts = storage.insert_new_data(
+                df=new_df,
+                checkpoint=batch_end,
+                reset_tables=RESET_TABLES and i == 0,
+                quarantine=quarantine,
+                update=UPSERT,
+            )
+        record_counts(counts)
+        print("*" * 50)
+        if quarantine is not None:
+            metrics.count("quarantined_rows", len(quarantine))
+        del new_df, quarantine
+
+metrics.set("db_bytes", storage.size_bytes())
+metrics.finish()
@@ -0,0 +1,175 @@
+import datetime
+import glob
+import hashlib
+import json
+import os
+import threading
+import polars as pl
+
+# Modules whose code determines the transformed rows. A change to any of them gives
+# new cache keys, so batches transformed with old code are never used.
+TRANSFORM_MODULES = [
+    os.path.join(os.path.dirname(__file__), "transformations.py"),
+    os.path.join(os.path.dirname(__file__), "format.py"),
+]
+
+
+def transform_code_hash() -> str:
+    """
+    Function hashes the code of TRANSFORM_MODULES and the Polars version.
+    """
+    digest = hashlib.sha256(pl.__version__.encode())
+    for path in TRANSFORM_MODULES:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class BatchCache:
+    """
+    Cache of transformed silver batches as Parquet files in a directory. A batch is keyed
+    by its range of load ids, the hash of the transformation code and the settings
+    that change the result, so a rerun of the same loads, e.g. a retry after the insert
+    of the batch failed or a reset of the silver tables, reads the transformed rows
+    instead of reading bronze and transforming them again. The loads of dlt do not
+    change after they are completed, so entries never go stale.
+
+    Every entry is a Parquet file of the rows, a Parquet file of the quarantined rows
+    and a JSON file of the row counts, which is written last. When the files take more
+    than max_bytes, the least recently used entries are removed.
+
+    Params:
+        - cache_dir: directory of the cache.
+        - max_bytes: maximum total size of the cached files.
+        - settings: settings that change the transformed rows, e.g. the number of
+          quarantined rows, added to the keys.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, settings: dict | None = None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.code_hash = transform_code_hash()
+        self.settings = settings or {}
+        # Batches are cached from the threads that transform them.
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, batch_start: str, batch_end: str) -> str:
+        """
+        Function gets the cache key of a batch.
+
+        Params:
+            - batch_start: load id before the first load of the batch.
+            - batch_end: last load id of the batch.
+        """
+        key = json.dumps(
+            [batch_start, batch_end, self.code_hash, self.settings], sort_keys=True
+        )
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}{suffix}")
+
+    def get(
+        self, batch_start: str, batch_end: str
+    ) -> tuple[pl.DataFrame, int, int, int, pl.DataFrame | None] | None:
+        """
+        Function gets a cached batch. Returns None if the batch is not cached. The
+        update_time of the rows is set to the current time like in a new
+        transformation, so gold picks up the rows the same way.
+
+        Params:
+            - batch_start: load id before the first load of the batch.
+            - batch_end: last load id of the batch.
+        """
+        key = self.key(batch_start, batch_end)
+        try:
+            with open(self.path(key, ".json")) as f:
+                counts = json.load(f)
+            update_time = pl.lit(datetime.datetime.now())
+            new_df = pl.read_parquet(self.path(key, ".parquet"))
+            quarantine = None
+            if counts["quarantine"]:
+                quarantine = pl.read_parquet(self.path(key, ".quarantine.parquet"))
+                quarantine = quarantine.with_columns(update_time=update_time)
+            # Marks the entry as recently used for the eviction.
+            os.utime(self.path(key, ".json"))
+        except FileNotFoundError:
+            return None
+
+        return (
+            new_df.with_columns(update_time=update_time),
+            counts["null_rows"],
+            counts["duplicate_rows"],
+            counts["departure_errors"],
+            quarantine,
+        )
+
+    def put(
+        self,
+        batch_start: str,
+        batch_end: str,
+        new_df: pl.DataFrame,
+        null_rows: int,
+        duplicate_rows: int,
+        departure_errors: int,
+        quarantine: pl.DataFrame | None,
+    ):
+        """
+        Function caches a transformed batch and evicts the least recently used entries
+        if the cache is larger than max_bytes.
+
+        Params:
+            - batch_start: load id before the first load of the batch.
+            - batch_end: last load id of the batch.
+            - new_df: transformed rows of the batch.
+            - null_rows: number of rows with nulls.
+            - duplicate_rows: number of duplicate rows.
+            - departure_errors: number of rows with malformed departure times.
+            - quarantine: quarantined rows of the batch or None.
+        """
+        key = self.key(batch_start, batch_end)
+        new_df.write_parquet(self.path(key, ".parquet"))
+        if quarantine is not None:
+            quarantine.write_parquet(self.path(key, ".quarantine.parquet"))
+        counts = {
+            "null_rows": null_rows,
+            "duplicate_rows": duplicate_rows,
+            "departure_errors": departure_errors,
+            "quarantine": quarantine is not None,
+        }
+        # The JSON file is replaced atomically, so an entry is only found once all of
+        # its files are written.
+        with open(self.path(key, ".json.tmp"), "w") as f:
+            json.dump(counts, f)
+        os.replace(self.path(key, ".json.tmp"), self.path(key, ".json"))
+        self.evict()
+
+    def evict(self):
+        """
+        Function removes the least recently used entries until the cached files take at
+        most max_bytes.
+        """
+        with self.lock:
+            entries = []
+            for path in glob.glob(os.path.join(self.cache_dir, "*.json")):
+                key = os.path.basename(path).removesuffix(".json")
+                files = glob.glob(os.path.join(self.cache_dir, f"{key}*"))
+                try:
+                    size = sum(os.path.getsize(file) for file in files)
+                    entries.append((os.path.getmtime(path), size, files))
+                except FileNotFoundError:
+                    continue
+
+            total_bytes = sum(size for _, size, _ in entries)
+            for _, size, files in sorted(entries):
+                if total_bytes <= self.max_bytes:
+                    break
+                # The JSON file is removed first, so the entry is not found while its
+                # Parquet files are removed.
+                for file in sorted(files, key=lambda file: not file.endswith(".json")):
+                    try:
+                        os.remove(file)
+                    except FileNotFoundError:
+                        pass
+                total_bytes -= size
@@ -1,3 +1,13 @@
+import polars as pl
+
+# ISO 8601 duration in the format used by the JourneysAPI, e.g. -P0Y0M0DT0H3M20.000S.
+# Fractional seconds are optional and truncated since delays are stored as whole seconds.
+DELAY_PATTERN = (
+    r"^(?<sign>-)?P(?<years>\d+)Y(?<months>\d+)M(?<days>\d+)D"
+    r"T(?<hours>\d+)H(?<minutes>\d+)M(?<seconds>\d+)(?:\.\d+)?S$"
+)
+
+
 def delay_sec(s: str) -> int:
     if s[0] == "-":
         neg = -1
@@ -8,5 +18,89 @@ def delay_sec(s: str) -> int:
     return neg * (60 * int(s[0]) + int(s[1]))
 
 
+def delay_parts(column: str) -> pl.Expr:
+    """
+    Expression that extracts the fields of an ISO 8601 duration string column to a struct
+    with the fields sign, years, months, days, hours, minutes and seconds.
+
+    Materialize the struct with `with_columns` before calling `delay_sec_from_parts`
+    so that the regex is only evaluated once per row.
+    """
+    return pl.col(column).str.extract_groups(DELAY_PATTERN)
+
+
+def delay_sec_from_parts(parts: pl.Expr) -> pl.Expr:
+    """
+    Vectorized version of `delay_sec`. Computes the delay in seconds from a struct created
+    with `delay_parts`. Unlike `delay_sec`, also takes days and hours into account. Years and
+    months are counted as 365 and 30 days. Null or malformed durations result in null.
+    """
+
+    def field(name: str) -> pl.Expr:
+        return parts.struct.field(name).cast(pl.Int64)
+
+    days = field("years") * 365 + field("months") * 30 + field("days")
+    seconds = (
+        (days * 24 + field("hours")) * 3600 + field("minutes") * 60 + field("seconds")
+    )
+    return (
+        pl.when(parts.struct.field("sign").is_null()).then(seconds).otherwise(-seconds)
+    )
+
+
+# Departure times of journeys in the HHMM format used by the JourneysAPI. Journeys that
+# depart after midnight but belong to the service day before have hours past 24, e.g.
+# 2415 is 00:15 on the next day. The categories of DEPARTURE_ENUM are all valid values
+# ordered by time, so the physical value of a category is the number of minutes from
+# the start of the service day.
+DEPARTURE_MAX_HOURS = 48
+MINUTES_PER_DAY = 1440
+DEPARTURE_ENUM = pl.Enum(
+    [
+        f"{hours:02d}{minutes:02d}"
+        for hours in range(DEPARTURE_MAX_HOURS)
+        for minutes in range(60)
+    ]
+)
+# Time of day of each category of DEPARTURE_ENUM.
+DEPARTURE_TIMES = (
+    pl.int_range(0, len(DEPARTURE_ENUM.categories), dtype=pl.Int64, eager=True)
+    % MINUTES_PER_DAY
+    * 60_000_000_000
+).cast(pl.Time)
+
+
+def departure_minutes(column: str) -> pl.Expr:
+    """
+    Expression that parses an HHMM departure time string column to the minutes from the
+    start of the service day as UInt32. Null or malformed values, e.g. 0960 or 123,
+    result in null. The values are parsed with a hash lookup in DEPARTURE_ENUM instead
+    of parsing the digits of every row, which is faster since a batch only has a few
+    distinct departure times.
+
+    Materialize the minutes with `with_columns` before calling `departure_time` and
+    `departure_day_offset`.
+    """
+    return pl.col(column).cast(DEPARTURE_ENUM, strict=False).to_physical()
+
+
+def departure_time(minutes: pl.Expr) -> pl.Expr:
+    """
+    Expression that gets the time of day of a departure from the minutes created with
+    `departure_minutes`, e.g. 00:15 for 2415.
+    """
+    return pl.lit(DEPARTURE_TIMES).gather(minutes)
+
+
+def departure_day_offset(minutes: pl.Expr) -> pl.Expr:
+    """
+    Expression that gets the number of days from the service day to the day of a
+    departure as Int8 from the minutes created with `departure_minutes`, e.g. 1 for 2415.
+    Departures are at most DEPARTURE_MAX_HOURS from the start of the service day, so
+    the offset is 0 or 1 and a comparison is cheaper than dividing.
+    """
+    return (minutes >= MINUTES_PER_DAY).cast(pl.Int8)
+
+
 def stop_id(s: str) -> str:
     return s[-4:]
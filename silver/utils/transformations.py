@@ -1,14 +1,48 @@
 import polars as pl
 import datetime
-from utils.format import delay_sec
+from utils.format import (
+    delay_parts,
+    delay_sec_from_parts,
+    departure_minutes,
+    departure_time,
+    departure_day_offset,
+)
+
+
+# Columns of the bronze table used by `transform_bus_data`. Reading only these from
+# the bronze table is enough.
+BRONZE_COLUMNS = [
+    "recorded_at_time",
+    "monitored_vehicle_journey__line_ref",
+    "monitored_vehicle_journey__operator_ref",
+    "monitored_vehicle_journey__vehicle_ref",
+    "monitored_vehicle_journey__journey_pattern_ref",
+    "monitored_vehicle_journey__origin_short_name",
+    "monitored_vehicle_journey__destination_short_name",
+    "monitored_vehicle_journey__direction_ref",
+    "monitored_vehicle_journey__delay",
+    "monitored_vehicle_journey__vehicle_location__longitude",
+    "monitored_vehicle_journey__vehicle_location__latitude",
+    "monitored_vehicle_journey__speed",
+    "monitored_vehicle_journey__origin_aimed_departure_time",
+]
+DEPARTURE_COLUMN = "monitored_vehicle_journey__origin_aimed_departure_time"
 
 
 def transform_bus_data(source_df: pl.DataFrame) -> pl.DataFrame:
     """
     Function that transforms the bronze bus delay dataframe to the silver bus delay dataframe.
     """
+    return transform_bus_data_lazy(source_df.lazy()).collect()
+
+
+def transform_bus_data_lazy(source_lf: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Lazy variant of `transform_bus_data`. Only the bronze columns used by the
+    transformation are read from `source_lf` when the query is collected.
+    """
     return (
-        source_df.rename(
+        source_lf.rename(
             {
                 "monitored_vehicle_journey__line_ref": "line",
                 "monitored_vehicle_journey__operator_ref": "operator",
@@ -18,7 +52,12 @@ def transform_bus_data(source_df: pl.DataFrame) -> pl.DataFrame:
                 "monitored_vehicle_journey__destination_short_name": "destination_short_name",
                 "monitored_vehicle_journey__direction_ref": "direction",
             }
-        ).with_columns(
+        )
+        .with_columns(
+            delay_parts("monitored_vehicle_journey__delay").alias("delay_parts"),
+            departure_minutes(DEPARTURE_COLUMN).alias("departure_minutes"),
+        )
+        .with_columns(
             pl.col("recorded_at_time").cast(pl.Date).alias("date"),
             pl.col("recorded_at_time").cast(pl.Time).alias("time"),
             pl.col("monitored_vehicle_journey__vehicle_location__longitude")
@@ -28,17 +67,13 @@ def transform_bus_data(source_df: pl.DataFrame) -> pl.DataFrame:
             .cast(pl.Float64)
             .alias("latitude"),
             pl.col("monitored_vehicle_journey__speed").cast(pl.Float32).alias("speed"),
-            pl.col("monitored_vehicle_journey__origin_aimed_departure_time")
-            .str.strptime(dtype=pl.Time, format="%H%M")
-            .alias("origin_aimed_departure_time"),
-            pl.struct("monitored_vehicle_journey__delay")
-            .map_batches(
-                lambda x: pl.Series(
-                    map(delay_sec, x.struct.field("monitored_vehicle_journey__delay"))
-                ),
-                return_dtype=pl.Int64,
-            )
-            .alias("delay"),
+            departure_time(pl.col("departure_minutes")).alias(
+                "origin_aimed_departure_time"
+            ),
+            departure_day_offset(pl.col("departure_minutes")).alias(
+                "origin_day_offset"
+            ),
+            delay_sec_from_parts(pl.col("delay_parts")).alias("delay"),
             update_time=datetime.datetime.now(),
         )
     ).select(
@@ -56,27 +91,36 @@ def transform_bus_data(source_df: pl.DataFrame) -> pl.DataFrame:
             "latitude",
             "speed",
             "origin_aimed_departure_time",
+            "origin_day_offset",
             "delay",
             "update_time",
         ]
     )
 
 
+def count_departure_errors(source_df: pl.DataFrame) -> int:
+    """
+    Function counts the bronze rows of a Polars dataframe `source_df` whose departure
+    time is set but is not a valid HHMM time. `transform_bus_data` sets their departure
+    time to null, so they are counted and dropped with the rows with nulls.
+    """
+    return source_df.select(
+        (
+            pl.col(DEPARTURE_COLUMN).is_not_null()
+            & departure_minutes(DEPARTURE_COLUMN).is_null()
+        ).sum()
+    ).item()
+
+
 def drop_nulls(source_df: pl.DataFrame, logging: bool = False) -> pl.DataFrame:
     """
     Function to drop nulls from a Polars dataframe `source_df`.
-    If logging is set to True, then prints all rows with nulls.
+    If logging is set to True, then prints the number of dropped rows.
     """
-    if logging:
-        with pl.Config() as cfg:
-            cfg.set_tbl_cols(source_df.width)
-            nulls = source_df.filter(pl.any_horizontal(pl.all().is_null()))
-            if len(nulls) > 0:
-                print(f"Dropping {len(nulls)} rows with nulls values:")
-                cfg.set_tbl_rows(len(nulls))
-                print(nulls)
-                print("*" * 50)
-    return source_df.drop_nulls()
+    df = drop_nulls_lazy(source_df.lazy()).collect()
+    if logging and len(df) < len(source_df):
+        print(f"Dropped {len(source_df) - len(df)} rows with null values.")
+    return df
 
 
 def deduplicate(
@@ -84,15 +128,105 @@ def deduplicate(
 ) -> pl.DataFrame:
     """
     Function to deduplicate rows in a Polars dataframe `source_df` based on a list of columns `pk_cols`.
-    If logging is set to True, then prints all duplicated rows.
-    """
-    if logging:
-        with pl.Config() as cfg:
-            cfg.set_tbl_cols(source_df.width)
-            duplicates = source_df.filter(pl.struct(pk_cols).is_duplicated())
-            if len(duplicates) > 0:
-                print(f"Deduplicating {len(duplicates)} rows:")
-                cfg.set_tbl_rows(len(duplicates))
-                print(duplicates.sort(duplicates.columns))
-                print("*" * 50)
-    return source_df.unique(pk_cols)
+    Keeps the first row of each primary key.
+    If logging is set to True, then prints the number of dropped rows.
+    """
+    df = deduplicate_lazy(source_df.lazy(), pk_cols).collect()
+    if logging and len(df) < len(source_df):
+        print(f"Dropped {len(source_df) - len(df)} duplicate rows.")
+    return df
+
+
+def drop_nulls_lazy(source_lf: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Lazy variant of `drop_nulls`.
+    """
+    return source_lf.drop_nulls()
+
+
+def deduplicate_lazy(source_lf: pl.LazyFrame, pk_cols: list[str]) -> pl.LazyFrame:
+    """
+    Lazy variant of `deduplicate`.
+    """
+    return source_lf.filter(pl.struct(pk_cols).is_first_distinct())
+
+
+def clean_bus_data_lazy(source_lf: pl.LazyFrame, pk_cols: list[str]) -> pl.LazyFrame:
+    """
+    Function chains `transform_bus_data_lazy`, `drop_nulls_lazy` and `deduplicate_lazy`
+    to a single query. Same result as `deduplicate(drop_nulls(transform_bus_data(df)))`.
+
+    Params:
+        - source_lf: bronze rows.
+        - pk_cols: primary key columns to deduplicate by.
+    """
+    return deduplicate_lazy(
+        drop_nulls_lazy(transform_bus_data_lazy(source_lf)), pk_cols
+    )
+
+
+def clean_bus_data(
+    source_df: pl.DataFrame, pk_cols: list[str], streaming: bool = False
+) -> tuple[pl.DataFrame, int]:
+    """
+    Function collects `clean_bus_data_lazy` once and also counts the rows without
+    nulls, so the numbers of rows dropped for nulls and for duplicates are known.
+    Returns the silver rows and the number of rows without nulls.
+
+    Params:
+        - source_df: bronze rows.
+        - pk_cols: primary key columns to deduplicate by.
+        - streaming: if True, collect with the streaming engine of Polars.
+    """
+    df = deduplicate_lazy(
+        drop_nulls_lazy(transform_bus_data_lazy(source_df.lazy())).with_columns(
+            _not_null_rows=pl.len()
+        ),
+        pk_cols,
+    ).collect(streaming=streaming)
+    not_null_rows = df["_not_null_rows"][0] if len(df) > 0 else 0
+    return df.drop("_not_null_rows"), not_null_rows
+
+
+def split_nulls(source_df: pl.DataFrame) -> tuple[pl.DataFrame, pl.DataFrame]:
+    """
+    Function splits a Polars dataframe `source_df` to the rows without nulls and the
+    rows with nulls, i.e. the rows `drop_nulls` keeps and the rows it drops. The nulls
+    are checked only once.
+    """
+    has_nulls = source_df.select(pl.any_horizontal(pl.all().is_null())).to_series()
+    return source_df.filter(~has_nulls), source_df.filter(has_nulls)
+
+
+def split_duplicates(
+    source_df: pl.DataFrame, pk_cols: list[str]
+) -> tuple[pl.DataFrame, pl.DataFrame]:
+    """
+    Function splits a Polars dataframe `source_df` to the first row of each primary key
+    in `pk_cols` and the rest of the rows, i.e. the rows `deduplicate` keeps and the
+    rows it drops. The primary keys are hashed only once.
+    """
+    first = source_df.select(pl.struct(pk_cols).is_first_distinct()).to_series()
+    return source_df.filter(first), source_df.filter(~first)
+
+
+def quarantine_sample(
+    rejected: dict[str, pl.DataFrame], max_rows: int
+) -> pl.DataFrame | None:
+    """
+    Function combines at most `max_rows` rejected rows for each reason to a single
+    dataframe with the reason in the column `reason`. Returns None if no rows were
+    rejected.
+
+    Params:
+        - rejected: rejected rows by reason, e.g. {"null": df_nulls}.
+        - max_rows: maximum number of rows to keep for each reason.
+    """
+    samples = [
+        df.head(max_rows).with_columns(reason=pl.lit(reason))
+        for reason, df in rejected.items()
+        if len(df) > 0
+    ]
+    if len(samples) == 0:
+        return None
+    return pl.concat(samples)
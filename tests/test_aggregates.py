@@ -0,0 +1,100 @@
+import datetime
+import os
+import sys
+import polars as pl
+import pytest
+from deltalake import DeltaTable
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "gold"))
+
+from delta_operations.aggregates import (
+    hourly_delays,
+    update_dimension,
+    update_rollups,
+    ROLLUP_COLUMNS,
+    ROLLUP_PK,
+)
+from delta_operations.functions import merge, add_missing_columns, missing_columns
+
+HOUR = 3_600_000_000
+
+
+def gold_rows(hours: list[int], delays: list[int], offset: int = 0) -> pl.DataFrame:
+    n = len(hours)
+    return pl.DataFrame(
+        {
+            "date": [datetime.date(2024, 4, 20)] * n,
+            "time": [h * HOUR + i + offset for i, h in enumerate(hours)],
+            "line": ["3"] * n,
+            "operator": ["TKL"] * n,
+            "vehicle": ["TKL_001"] * n,
+            "journey_pattern": ["3V"] * n,
+            "origin_short_name": ["3615"] * n,
+            "destination_short_name": ["1028"] * n,
+            "direction": ["1"] * n,
+            "longitude": [23.69] * n,
+            "latitude": [61.52] * n,
+            "speed": pl.Series([10.0] * n, dtype=pl.Float32),
+            "origin_aimed_departure_time": [81_600_000_000] * n,
+            "origin_day_offset": pl.Series([0] * n, dtype=pl.Int8),
+            "delay": delays,
+            "update_time": [datetime.datetime(2024, 4, 20, 12)] * n,
+        }
+    )
+
+
+def test_hourly_delays():
+    df = hourly_delays(gold_rows([5, 5, 5, 6], [10, 20, 60, -5]))
+    assert df["hour"].to_list() == [5, 6]
+    assert df["observations"].to_list() == [3, 1]
+    assert df["mean_delay"].to_list() == [30.0, -5.0]
+    assert df["p50_delay"].to_list() == [20.0, -5.0]
+
+
+def test_update_rollups(tmp_path):
+    fact_path = str(tmp_path / "journeys_data")
+    rollup_path = str(tmp_path / "delay_hourly")
+    first = gold_rows([5, 5, 6, 7], [10, 20, 30, 40])
+    # Updates a row of hour 5 and adds a row to hour 6, hour 7 is not touched.
+    second = pl.concat(
+        [
+            first.head(1).with_columns(delay=pl.lit(100, dtype=pl.Int64)),
+            gold_rows([6], [50], 1),
+        ]
+    )
+
+    assert update_rollups(first, fact_path, rollup_path) == 3
+    merge(first, fact_path)
+    assert update_rollups(second, fact_path, rollup_path) == 2
+    merge(second, fact_path)
+
+    full = hourly_delays(pl.read_delta(fact_path).select(ROLLUP_COLUMNS))
+    rollups = pl.read_delta(rollup_path).select(full.columns).sort(ROLLUP_PK)
+    assert rollups.equals(full.cast(dict(rollups.schema)))
+    assert rollups["mean_delay"].to_list() == [60.0, 40.0, 40.0]
+
+
+def test_update_dimension(tmp_path):
+    table_path = str(tmp_path / "dim_stop")
+    df = gold_rows([5, 6], [0, 0])
+    assert update_dimension(df, table_path, "dim_stop")
+    assert not update_dimension(df, table_path, "dim_stop")
+
+    later = df.with_columns(date=pl.lit(datetime.date(2024, 4, 21)))
+    assert update_dimension(later, table_path, "dim_stop")
+    dim = pl.read_delta(table_path).sort("stop_short_name")
+    assert dim["stop_short_name"].to_list() == ["1028", "3615"]
+    assert dim["first_seen"].to_list() == [datetime.date(2024, 4, 20)] * 2
+    assert dim["last_seen"].to_list() == [datetime.date(2024, 4, 21)] * 2
+
+
+def test_merge_requires_added_columns(tmp_path):
+    fact_path = str(tmp_path / "journeys_data")
+    merge(gold_rows([5], [10]).drop("origin_day_offset"), fact_path)
+    with pytest.raises(Exception, match="migrate.py"):
+        merge(gold_rows([5], [20]), fact_path)
+
+    missing = missing_columns(fact_path)
+    assert missing == ["origin_day_offset"]
+    data = add_missing_columns(DeltaTable(fact_path).to_pyarrow_table(), missing)
+    assert data["origin_day_offset"].to_pylist() == [0]
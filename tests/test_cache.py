@@ -0,0 +1,45 @@
+from utils.cache import BatchCache
+from utils.transformations import transform_bus_data, split_nulls
+from test_transformations import df_test
+import os
+
+
+def test_batch_cache(tmp_path):
+    cache = BatchCache(str(tmp_path), max_bytes=2**20)
+    new_df, null_df = split_nulls(transform_bus_data(df_test))
+    assert cache.get("0", "1") is None
+
+    cache.put("0", "1", new_df, 2, 1, 1, null_df)
+    cached_df, null_rows, duplicate_rows, departure_errors, quarantine = cache.get(
+        "0", "1"
+    )
+    assert (null_rows, duplicate_rows, departure_errors) == (2, 1, 1)
+    assert cached_df.drop("update_time").equals(new_df.drop("update_time"))
+    # Cached rows get a new update_time like newly transformed rows.
+    assert cached_df["update_time"].min() > new_df["update_time"].max()
+    assert quarantine.drop("update_time").equals(null_df.drop("update_time"))
+
+    # Other settings give other keys.
+    other = BatchCache(str(tmp_path), max_bytes=2**20, settings={"rows": 0})
+    assert other.get("0", "1") is None
+    other.put("0", "1", new_df, 0, 0, 0, None)
+    assert other.get("0", "1")[4] is None
+
+
+def test_batch_cache_eviction(tmp_path):
+    new_df = transform_bus_data(df_test)
+    cache = BatchCache(str(tmp_path), max_bytes=2**20)
+    cache.put("0", "1", new_df, 0, 0, 0, None)
+    cache.put("1", "2", new_df, 0, 0, 0, None)
+    entry_bytes = sum(
+        os.path.getsize(os.path.join(tmp_path, f)) for f in os.listdir(tmp_path)
+    )
+    # Using the first entry makes the second the least recently used.
+    os.utime(os.path.join(tmp_path, cache.key("1", "2") + ".json"), (0, 0))
+    assert cache.get("0", "1") is not None
+
+    cache.max_bytes = entry_bytes
+    cache.put("2", "3", new_df, 0, 0, 0, None)
+    assert cache.get("1", "2") is None
+    assert cache.get("0", "1") is not None
+    assert cache.get("2", "3") is not None
@@ -0,0 +1,175 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from db_operations.functions import (
+    create_or_replace_tables,
+    get_new_data,
+    insert_new_data,
+    transform_and_insert_new_data,
+    TARGET_TABLE_PK,
+)
+from utils.transformations import (
+    transform_bus_data,
+    drop_nulls,
+    deduplicate,
+    split_nulls,
+    split_duplicates,
+    quarantine_sample,
+)
+from test_transformations import df_test, df_past_midnight
+import duckdb
+import polars as pl
+
+LAST_LOAD = "0"
+UNTIL_LOAD = df_test["_dlt_load_id"].max()
+
+
+def create_bronze(db_path: str, bronze_df: pl.DataFrame = df_test):
+    with duckdb.connect(db_path) as db:
+        db.sql("CREATE SCHEMA bronze")
+        db.sql(
+            """CREATE TABLE bronze.journeys_data AS
+            SELECT * REPLACE (
+                recorded_at_time::TIMESTAMPTZ AS recorded_at_time,
+                valid_until_time::TIMESTAMPTZ AS valid_until_time
+            )
+            FROM bronze_df"""
+        )
+        db.sql(
+            """CREATE TABLE bronze._dlt_loads AS
+            SELECT DISTINCT _dlt_load_id AS load_id, 0 AS status
+            FROM bronze_df"""
+        )
+
+
+def run_polars_engine(source_db: str, target_db: str):
+    create_or_replace_tables(db_path=target_db, schema="silver", table="journeys_data")
+    source_df = get_new_data(
+        db_path=source_db,
+        schema="bronze",
+        table="journeys_data",
+        last_load=LAST_LOAD,
+        until_load=UNTIL_LOAD,
+    )
+    new_df = transform_bus_data(source_df=source_df)
+    new_df = drop_nulls(source_df=new_df)
+    new_df = deduplicate(source_df=new_df, pk_cols=TARGET_TABLE_PK.split(", "))
+    insert_new_data(
+        df=new_df,
+        checkpoint=UNTIL_LOAD,
+        db_path=target_db,
+        schema="silver",
+        table="journeys_data",
+        reset_tables=False,
+    )
+
+
+def run_duckdb_engine(source_db: str, target_db: str):
+    create_or_replace_tables(db_path=target_db, schema="silver", table="journeys_data")
+    transform_and_insert_new_data(
+        source_db=source_db,
+        source_schema="bronze",
+        source_table="journeys_data",
+        last_load=LAST_LOAD,
+        until_load=UNTIL_LOAD,
+        db_path=target_db,
+        schema="silver",
+        table="journeys_data",
+        reset_tables=False,
+    )
+
+
+def read_silver(db_path: str) -> pl.DataFrame:
+    with duckdb.connect(db_path, read_only=True) as db:
+        return db.sql(
+            f"""SELECT * EXCLUDE (update_time) FROM silver.journeys_data
+            ORDER BY {TARGET_TABLE_PK}"""
+        ).pl()
+
+
+def test_engines_produce_same_silver_table(tmp_path):
+    source_db = os.path.join(tmp_path, "ingest_pipe.duckdb")
+    polars_db = os.path.join(tmp_path, "cleaned_polars.duckdb")
+    duckdb_db = os.path.join(tmp_path, "cleaned_duckdb.duckdb")
+    create_bronze(source_db)
+
+    run_polars_engine(source_db, polars_db)
+    run_duckdb_engine(source_db, duckdb_db)
+
+    polars_silver = read_silver(polars_db)
+    duckdb_silver = read_silver(duckdb_db)
+    assert len(polars_silver) == 3
+    assert polars_silver.equals(duckdb_silver)
+
+
+def test_engines_parse_departures_past_midnight(tmp_path):
+    source_db = os.path.join(tmp_path, "ingest_pipe.duckdb")
+    polars_db = os.path.join(tmp_path, "cleaned_polars.duckdb")
+    duckdb_db = os.path.join(tmp_path, "cleaned_duckdb.duckdb")
+    create_bronze(source_db, pl.concat([df_test, df_past_midnight]))
+
+    run_polars_engine(source_db, polars_db)
+    run_duckdb_engine(source_db, duckdb_db)
+
+    polars_silver = read_silver(polars_db)
+    assert polars_silver["origin_day_offset"].to_list() == [0, 1, 0, 0]
+    assert polars_silver.equals(read_silver(duckdb_db))
+
+
+def test_duckdb_engine_checkpoint(tmp_path):
+    source_db = os.path.join(tmp_path, "ingest_pipe.duckdb")
+    target_db = os.path.join(tmp_path, "cleaned.duckdb")
+    create_bronze(source_db)
+
+    run_duckdb_engine(source_db, target_db)
+    # Running the same loads again does not insert duplicates.
+    run_duckdb_engine(source_db, target_db)
+
+    with duckdb.connect(target_db, read_only=True) as db:
+        loads = db.sql(
+            """SELECT load_id, loaded_rows, inserted_rows, updated_rows, skipped_rows
+            FROM silver.loads"""
+        ).fetchall()
+    assert loads == [(UNTIL_LOAD, 3, 3, 0, 0), (UNTIL_LOAD, 0, 0, 0, 3)]
+    assert len(read_silver(target_db)) == 3
+
+
+def test_polars_engine_quarantine(tmp_path):
+    source_db = os.path.join(tmp_path, "ingest_pipe.duckdb")
+    target_db = os.path.join(tmp_path, "cleaned.duckdb")
+    create_bronze(source_db)
+    create_or_replace_tables(db_path=target_db, schema="silver", table="journeys_data")
+
+    source_df = get_new_data(
+        db_path=source_db,
+        schema="bronze",
+        table="journeys_data",
+        last_load=LAST_LOAD,
+        until_load=UNTIL_LOAD,
+    )
+    new_df, null_df = split_nulls(transform_bus_data(source_df))
+    new_df, duplicate_df = split_duplicates(new_df, TARGET_TABLE_PK.split(", "))
+    insert_new_data(
+        df=new_df,
+        checkpoint=UNTIL_LOAD,
+        db_path=target_db,
+        schema="silver",
+        table="journeys_data",
+        reset_tables=False,
+        quarantine=quarantine_sample(
+            {"null": null_df, "duplicate": duplicate_df}, max_rows=10
+        ),
+    )
+
+    with duckdb.connect(target_db, read_only=True) as db:
+        quarantine = db.sql(
+            "SELECT load_id, reason, line FROM silver.quarantine ORDER BY line"
+        ).fetchall()
+    assert quarantine == [
+        (UNTIL_LOAD, "null", "15B"),
+        (UNTIL_LOAD, "null", "3A"),
+        (UNTIL_LOAD, "duplicate", "70"),
+    ]
+    assert len(read_silver(target_db)) == 3
@@ -0,0 +1,96 @@
+from utils.format import (
+    delay_sec,
+    delay_parts,
+    delay_sec_from_parts,
+    departure_minutes,
+    departure_time,
+    departure_day_offset,
+)
+import datetime
+import polars as pl
+import random
+
+
+def random_delay(rng: random.Random, hours: int = 0, days: int = 0) -> tuple[str, int]:
+    sign = rng.choice([1, -1])
+    minutes = rng.randint(0, 59)
+    seconds = rng.randint(0, 59)
+    value = (
+        f"{'-' if sign < 0 else ''}P0Y0M{days}DT{hours}H{minutes}M{seconds:02d}.000S"
+    )
+    return value, sign * (((days * 24 + hours) * 60 + minutes) * 60 + seconds)
+
+
+def vectorized_delay_sec(values: list[str]) -> list[int]:
+    return (
+        pl.DataFrame({"delay": values}, schema={"delay": pl.Utf8})
+        .with_columns(delay_parts("delay").alias("parts"))
+        .select(delay_sec_from_parts(pl.col("parts")).alias("delay"))["delay"]
+        .to_list()
+    )
+
+
+def test_delay_sec_from_parts_matches_delay_sec():
+    rng = random.Random(42)
+    values = [random_delay(rng)[0] for _ in range(10_000)]
+    assert vectorized_delay_sec(values) == [delay_sec(v) for v in values]
+
+
+def test_delay_sec_from_parts_hours_and_days():
+    rng = random.Random(7)
+    for _ in range(100):
+        value, expected = random_delay(
+            rng, hours=rng.randint(0, 23), days=rng.randint(0, 3)
+        )
+        assert vectorized_delay_sec([value]) == [expected]
+
+
+def test_delay_sec_from_parts_edge_cases():
+    assert vectorized_delay_sec(
+        [
+            "P1Y2M3DT4H5M6.999S",
+            "-P0Y0M0DT0H0M0S",
+            "-P0Y0M0DT0H3M20.5S",
+            "P0Y0M0DT0H3M",
+            "garbage",
+            None,
+        ]
+    ) == [
+        ((365 + 60 + 3) * 24 + 4) * 3600 + 5 * 60 + 6,
+        0,
+        -200,
+        None,
+        None,
+        None,
+    ]
+
+
+def test_departure_time_and_day_offset():
+    df = pl.DataFrame(
+        {
+            "departure": [
+                "0000",
+                "2359",
+                "2415",
+                "4759",
+                "4800",
+                "0960",
+                "123",
+                " 123",
+                "+123",
+                "",
+                None,
+            ]
+        },
+        schema={"departure": pl.Utf8},
+    ).select(
+        departure_time(departure_minutes("departure")).alias("time"),
+        departure_day_offset(departure_minutes("departure")).alias("offset"),
+    )
+    assert df.rows()[:4] == [
+        (datetime.time(0, 0), 0),
+        (datetime.time(23, 59), 0),
+        (datetime.time(0, 15), 1),
+        (datetime.time(23, 59), 1),
+    ]
+    assert df.slice(4).null_count().row(0) == (7, 7)
@@ -0,0 +1,90 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from db_operations.functions import batch_loads, get_new_data, get_new_loads
+from test_engines import create_bronze
+import duckdb
+
+
+loads = [
+    ("1713601219.3070812", 2),
+    ("1713601319.3070812", 2),
+    ("1713602219.3070812", 5),
+    ("1713603219.3070812", 1),
+]
+
+
+def test_batch_loads_single_batch():
+    assert batch_loads(loads, "0", None) == [("0", "1713603219.3070812")]
+    assert batch_loads(loads, "0", 100) == [("0", "1713603219.3070812")]
+
+
+def test_batch_loads_batch_size():
+    assert batch_loads(loads, "0", 4) == [
+        ("0", "1713601319.3070812"),
+        ("1713601319.3070812", "1713602219.3070812"),
+        ("1713602219.3070812", "1713603219.3070812"),
+    ]
+
+
+def test_batch_loads_no_loads():
+    assert batch_loads([], "0", 4) == []
+
+
+def test_get_new_loads(tmp_path):
+    db_path = os.path.join(tmp_path, "ingest_pipe.duckdb")
+    create_bronze(db_path)
+    assert get_new_loads(db_path, "bronze", "journeys_data", "0") == [
+        ("1713601219.3070812", 2),
+        ("1713601319.3070812", 2),
+        ("1713602219.3070812", 2),
+    ]
+    assert get_new_loads(db_path, "bronze", "journeys_data", "1713601319.3070812") == [
+        ("1713602219.3070812", 2)
+    ]
+
+
+def test_get_new_loads_skips_incomplete_loads(tmp_path):
+    db_path = os.path.join(tmp_path, "ingest_pipe.duckdb")
+    create_bronze(db_path)
+    with duckdb.connect(db_path) as db:
+        db.sql(
+            "UPDATE bronze._dlt_loads SET status = 1 WHERE load_id = '1713602219.3070812'"
+        )
+    assert get_new_loads(db_path, "bronze", "journeys_data", "1713601219.3070812") == [
+        ("1713601319.3070812", 2)
+    ]
+
+
+def test_get_new_loads_from_archive(tmp_path):
+    db_path = os.path.join(tmp_path, "ingest_pipe.duckdb")
+    archive_dir = os.path.join(tmp_path, "archive")
+    create_bronze(db_path)
+    # Archive the first load like clean_bronze/archive_old_loads.py does.
+    os.makedirs(os.path.join(archive_dir, "journeys_data"))
+    with duckdb.connect(db_path) as db:
+        db.sql(
+            f"""COPY (
+                SELECT *, '2024-04-20'::DATE AS load_date FROM bronze.journeys_data
+                WHERE _dlt_load_id <= '1713601219.3070812'
+            ) TO '{os.path.join(archive_dir, "journeys_data")}' (
+                FORMAT PARQUET, PARTITION_BY (load_date), OVERWRITE_OR_IGNORE true
+            )"""
+        )
+        db.sql(
+            "DELETE FROM bronze.journeys_data WHERE _dlt_load_id <= '1713601219.3070812'"
+        )
+
+    assert len(get_new_loads(db_path, "bronze", "journeys_data", "0")) == 2
+    assert get_new_loads(db_path, "bronze", "journeys_data", "0", archive_dir) == [
+        ("1713601219.3070812", 2),
+        ("1713601319.3070812", 2),
+        ("1713602219.3070812", 2),
+    ]
+    df = get_new_data(
+        db_path, "bronze", "journeys_data", "0", "1713601319.3070812", archive_dir
+    )
+    assert len(df) == 4
+    assert "load_date" not in df.columns
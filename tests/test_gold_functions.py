@@ -0,0 +1,184 @@
+import datetime
+import os
+import subprocess
+import sys
+import polars as pl
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from deltalake import DeltaTable, write_deltalake
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "gold"))
+
+import delta_operations.functions as functions
+from delta_operations.functions import (
+    DICTIONARY_COLUMNS,
+    get_table_stats,
+    is_partitioned,
+    merge,
+    scan_table_stats,
+    time_strings_to_microseconds,
+    to_gold_schema,
+    TARGET_TABLE_PK,
+    TIME_COLUMNS,
+)
+from test_aggregates import gold_rows
+
+GOLD_DIR = os.path.join(os.path.dirname(__file__), "..", "gold")
+TIMES = [datetime.time(0, 0), datetime.time(23, 19, 0, 8000), None]
+MICROSECONDS = [0, 83_940_008_000, None]
+
+
+def rows_on(day: int, delays: list[int]) -> pl.DataFrame:
+    return gold_rows([5] * len(delays), delays).with_columns(
+        date=pl.lit(datetime.date(2024, 4, day))
+    )
+
+
+def partition_files(table_path: str, partition: str) -> dict[str, bytes]:
+    files = DeltaTable(table_path).files([("date", "=", partition)])
+    return {file: open(os.path.join(table_path, file), "rb").read() for file in files}
+
+
+def run_migrate(target_dir: str) -> str:
+    return subprocess.run(
+        [sys.executable, "migrate.py"],
+        cwd=GOLD_DIR,
+        env=os.environ | {"TARGET_DIR": target_dir},
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+
+
+def test_get_table_stats_from_delta_log(tmp_path, monkeypatch):
+    table_path = str(tmp_path / "journeys_data")
+    merge(gold_rows([5, 6], [10, 20]), table_path)
+    latest = datetime.datetime(2024, 4, 21, 8)
+    merge(gold_rows([7], [30]).with_columns(update_time=pl.lit(latest)), table_path)
+
+    def scan(table_path):
+        raise Exception("Scanned the table")
+
+    monkeypatch.setattr(functions, "scan_table_stats", scan)
+    assert get_table_stats(table_path) == (latest, 3)
+
+
+def test_get_table_stats_without_file_statistics(tmp_path, capsys):
+    table_path = str(tmp_path / "journeys_data")
+    write_deltalake(
+        table_path,
+        gold_rows([5, 6], [10, 20]).to_arrow(),
+        file_options=ds.ParquetFileFormat().make_write_options(write_statistics=False),
+    )
+    assert get_table_stats(table_path) == (datetime.datetime(2024, 4, 20, 12), 2)
+    assert "Scanning the table instead" in capsys.readouterr().out
+
+
+def test_get_table_stats_verify(tmp_path, monkeypatch):
+    table_path = str(tmp_path / "journeys_data")
+    merge(gold_rows([5, 6, 7], [10, 20, 30]), table_path)
+    assert get_table_stats(table_path, verify=True) == scan_table_stats(table_path)
+    assert get_table_stats(table_path, verify=True) == get_table_stats(table_path)
+
+    # The scanned values are used if the statistics are wrong.
+    monkeypatch.setattr(functions, "scan_table_stats", lambda table_path: (None, 0))
+    assert get_table_stats(table_path, verify=True) == (None, 0)
+
+
+def test_merge_partitioned(tmp_path):
+    table_path = str(tmp_path / "journeys_data")
+    merge(pl.concat([rows_on(20, [10, 20]), rows_on(21, [30])]), table_path)
+    untouched = partition_files(table_path, "2024-04-21")
+
+    # Corrects a delay on an existing date and adds rows of a new date.
+    merge(pl.concat([rows_on(20, [15]), rows_on(22, [40])]), table_path)
+
+    assert partition_files(table_path, "2024-04-21") == untouched
+    df = pl.read_delta(table_path).sort("date", "time")
+    assert df.select("date", "delay").rows() == [
+        (datetime.date(2024, 4, 20), 15),
+        (datetime.date(2024, 4, 20), 20),
+        (datetime.date(2024, 4, 21), 30),
+        (datetime.date(2024, 4, 22), 40),
+    ]
+    assert len(DeltaTable(table_path).history()) == 2
+
+
+def test_migrate_partitions_table(tmp_path):
+    table_path = str(tmp_path / "journeys_data")
+    rows = pl.concat([rows_on(20, [10, 20]), rows_on(21, [30])])
+    write_deltalake(table_path, rows.to_arrow())
+    assert not is_partitioned(table_path)
+
+    assert "Migrated 3 rows" in run_migrate(str(tmp_path))
+    assert is_partitioned(table_path)
+    migrated = pl.read_delta(table_path).select(rows.columns)
+    assert migrated.sort(TARGET_TABLE_PK).equals(rows.sort(TARGET_TABLE_PK))
+    assert "already has the current layout" in run_migrate(str(tmp_path))
+
+
+def test_to_gold_schema_round_trip():
+    silver = pa.table(
+        {
+            "time": pa.array(TIMES, pa.time64("us")),
+            "origin_aimed_departure_time": pa.array(TIMES, pa.time64("ns")),
+        }
+    )
+    gold = to_gold_schema(silver)
+    assert gold["time"].to_pylist() == MICROSECONDS
+    assert gold["origin_aimed_departure_time"].to_pylist() == MICROSECONDS
+    # Columns that already are microseconds are kept as they are.
+    assert to_gold_schema(gold).equals(gold)
+    # Read back as times like the silver Delta storage does.
+    times = pl.from_arrow(gold).select((pl.col("time") * 1000).cast(pl.Time))
+    assert times["time"].to_list() == TIMES
+
+
+def test_time_strings_to_microseconds():
+    strings = ["00:00:00", "23:19:00.008", None]
+    data = pa.table({"time": strings, "origin_aimed_departure_time": strings})
+    converted = time_strings_to_microseconds(data)
+    assert converted["time"].to_pylist() == MICROSECONDS
+    assert converted["origin_aimed_departure_time"].to_pylist() == MICROSECONDS
+
+
+def test_migrate_time_strings(tmp_path):
+    table_path = str(tmp_path / "journeys_data")
+    rows = rows_on(20, [10, 20, 30]).with_columns(
+        time=pl.Series(["00:00:00", "23:19:00.008", "12:00:00"]),
+        origin_aimed_departure_time=pl.Series(["00:00:00", None, "23:59:00"]),
+    )
+    write_deltalake(table_path, rows.to_arrow())
+
+    assert "to microseconds since midnight" in run_migrate(str(tmp_path))
+    migrated = pl.read_delta(table_path).sort("delay")
+    assert migrated["time"].to_list() == [0, 83_940_008_000, 43_200_000_000]
+    assert migrated["origin_aimed_departure_time"].to_list() == [
+        0,
+        None,
+        86_340_000_000,
+    ]
+    assert migrated.drop(TIME_COLUMNS).equals(
+        rows.drop(TIME_COLUMNS).select(migrated.drop(TIME_COLUMNS).columns)
+    )
+
+
+def test_merge_write_options(tmp_path):
+    table_path = str(tmp_path / "journeys_data")
+    # Many small chunks, like the rows of several loads.
+    rows = pl.concat(
+        [gold_rows([5] * 1000, [10] * 1000, offset=i * 1000) for i in range(20)],
+        rechunk=False,
+    )
+    merge(rows, table_path)
+    merge(rows.head(10).with_columns(delay=pl.col("delay") + 10), table_path)
+
+    for file in DeltaTable(table_path).files():
+        metadata = pq.ParquetFile(os.path.join(table_path, file)).metadata
+        assert metadata.num_row_groups == 1
+        row_group = metadata.row_group(0)
+        for i in range(row_group.num_columns):
+            column = row_group.column(i)
+            dictionary = "RLE_DICTIONARY" in column.encodings
+            assert dictionary == (column.path_in_schema in DICTIONARY_COLUMNS)
@@ -0,0 +1,128 @@
+import pytest
+
+pytest.importorskip("dlt")
+
+import datetime
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bronze"))
+
+from journeys_api import (
+    fetch_endpoint,
+    fetch_endpoints,
+    ingest_lag,
+    make_client,
+    new_vehicle_activity,
+)
+
+PAGE_SIZE = 2
+JOURNEYS = [{"journey": i} for i in range(5)]
+
+
+class StubJourneysAPI(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        StubJourneysAPI.requests.append((url.path, dict(self.headers)))
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        start_index = int(parse_qs(url.query).get("startIndex", ["0"])[0])
+        body = JOURNEYS[start_index : start_index + PAGE_SIZE]
+        paging = {
+            "startIndex": start_index,
+            "pageSize": PAGE_SIZE,
+            "moreData": start_index + PAGE_SIZE < len(JOURNEYS),
+        }
+        payload = {
+            "status": "success",
+            "data": {"headers": {"paging": paging}},
+            "body": body,
+        }
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+        self.wfile.write(json.dumps(payload).encode())
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def base_url():
+    StubJourneysAPI.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubJourneysAPI)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_fetch_endpoint_pages(base_url):
+    rows, validators = fetch_endpoint(make_client(1), base_url, "journeys", {})
+    assert rows == JOURNEYS
+    assert validators == {"etag": '"v1"'}
+    assert len(StubJourneysAPI.requests) == 3
+
+
+def test_fetch_endpoint_not_modified(base_url):
+    rows, validators = fetch_endpoint(
+        make_client(1), base_url, "journeys", {"etag": '"v1"'}
+    )
+    assert rows is None
+    assert validators == {"etag": '"v1"'}
+    assert StubJourneysAPI.requests[0][1]["If-None-Match"] == '"v1"'
+
+
+def test_fetch_endpoints(base_url):
+    results = fetch_endpoints(
+        base_url=base_url,
+        endpoints=["vehicle-activity", "lines", "routes"],
+        validators={"routes": {"etag": '"v1"'}},
+        max_connections=3,
+    )
+    assert results["vehicle-activity"][0] == JOURNEYS
+    assert results["lines"][0] == JOURNEYS
+    assert results["routes"][0] is None
+
+
+def vehicle_activity(vehicle: str, recorded_at: str) -> dict:
+    return {
+        "recordedAtTime": recorded_at,
+        "monitoredVehicleJourney": {"vehicleRef": vehicle},
+    }
+
+
+def test_new_vehicle_activity():
+    last_recorded = {}
+    first = [
+        vehicle_activity("a", "2024-04-10T10:00:00.000+03:00"),
+        vehicle_activity("b", "2024-04-10T10:00:01.000+03:00"),
+    ]
+    second = [
+        vehicle_activity("a", "2024-04-10T10:00:00.000+03:00"),
+        vehicle_activity("b", "2024-04-10T10:00:04.000+03:00"),
+    ]
+    assert new_vehicle_activity(first, last_recorded) == first
+    assert new_vehicle_activity(second, last_recorded) == second[1:]
+    assert new_vehicle_activity(second, last_recorded) == []
+
+
+def test_ingest_lag():
+    loaded_at = datetime.datetime(2024, 4, 10, 7, 0, 10, tzinfo=datetime.timezone.utc)
+    rows = [
+        vehicle_activity("a", "2024-04-10T10:00:00.000+03:00"),
+        vehicle_activity("b", "2024-04-10T07:00:05Z"),
+        vehicle_activity("c", "not a timestamp"),
+    ]
+    assert ingest_lag(rows, loaded_at) == 10.0
+    assert ingest_lag(rows[2:], loaded_at) is None
@@ -0,0 +1,40 @@
+from utils.transformations import (
+    transform_bus_data,
+    drop_nulls,
+    deduplicate,
+    clean_bus_data,
+)
+from test_transformations import df_test
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+
+from journeys_generator import generate_vehicle_activity
+
+
+def test_generate_vehicle_activity():
+    df = generate_vehicle_activity(10_000, duplicate_fraction=0.01, null_fraction=0.01)
+    assert len(df) == 10_000
+    assert df.columns == df_test.columns
+    assert df["_dlt_load_id"].is_sorted()
+    assert df["_dlt_id"].n_unique() == len(df)
+
+    df_transformed = drop_nulls(transform_bus_data(df))
+    assert 0 < len(df) - len(df_transformed) < 500
+
+    # Repeated rows are duplicates by the primary key of silver.
+    df_deduplicated = deduplicate(
+        df_transformed,
+        ["date", "time", "line", "direction", "origin_aimed_departure_time"],
+    )
+    assert 0 < len(df_transformed) - len(df_deduplicated) <= 100
+
+    # The lazy query gives the same rows.
+    df_clean, not_null_rows = clean_bus_data(
+        df, ["date", "time", "line", "direction", "origin_aimed_departure_time"]
+    )
+    assert not_null_rows == len(df_transformed)
+    assert df_clean.drop("update_time").equals(df_deduplicated.drop("update_time"))
+
+    assert generate_vehicle_activity(1_000).equals(generate_vehicle_activity(1_000))
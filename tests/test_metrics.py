@@ -0,0 +1,60 @@
+import duckdb
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from instrumentation.metrics import RunMetrics
+
+
+def test_run_metrics(tmp_path):
+    metrics_dir = str(tmp_path / "metrics")
+    runs_db = str(tmp_path / "pipeline_runs.duckdb")
+
+    metrics = RunMetrics("silver", metrics_dir=metrics_dir, runs_db=runs_db)
+    for _ in range(2):
+        with metrics.phase("transform"):
+            pass
+    metrics.count("rows_out", 3)
+    metrics.count("rows_out", 4)
+    metrics.set("db_bytes", 100)
+    metrics.finish()
+    metrics.finish(status="failed")
+
+    assert list(metrics.phases) == ["transform"]
+    assert metrics.counters == {"rows_out": 7, "db_bytes": 100}
+
+    with open(os.path.join(metrics_dir, "silver.prom")) as f:
+        textfile = f.read()
+    assert 'journeys_pipeline_run_success{stage="silver"} 1' in textfile
+    assert 'journeys_pipeline_rows_out{stage="silver"} 7' in textfile
+    assert (
+        'journeys_pipeline_phase_duration_seconds{stage="silver",phase="transform"}'
+        in textfile
+    )
+
+    with duckdb.connect(runs_db) as db:
+        runs = db.sql(
+            "SELECT run_id, stage, status, counters FROM pipeline_runs"
+        ).fetchall()
+    assert len(runs) == 1
+    assert runs[0][:3] == (metrics.run_id, "silver", "success")
+    assert json.loads(runs[0][3]) == {"rows_out": 7, "db_bytes": 100}
+
+
+def test_run_metrics_failed_run(tmp_path):
+    metrics_dir = str(tmp_path / "metrics")
+
+    metrics = RunMetrics("gold", metrics_dir=metrics_dir)
+    try:
+        with metrics.phase("merge"):
+            raise ValueError
+    except ValueError:
+        pass
+    # Called at exit if the run was not finished.
+    metrics._finish_at_exit()
+
+    assert "merge" in metrics.phases
+    with open(os.path.join(metrics_dir, "gold.prom")) as f:
+        assert 'journeys_pipeline_run_success{stage="gold"} 0' in f.read()
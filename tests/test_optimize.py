@@ -0,0 +1,83 @@
+import os
+import sys
+import polars as pl
+from deltalake import DeltaTable, write_deltalake
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "clean_delta_table"))
+
+from optimize_and_vacuum import get_target_size, plan_partitions
+
+TARGET_SIZE = 1024 * 1024
+
+
+def create_table(table_path: str, files: dict[tuple[str, ...], int]) -> DeltaTable:
+    """
+    Function creates a Delta table partitioned by the columns of `files` with the given
+    number of small files in each partition.
+    """
+    columns = ["date", "line"][: len(next(iter(files)))]
+    for partition, count in files.items():
+        for i in range(count):
+            write_deltalake(
+                table_path,
+                pl.DataFrame({"x": [i]})
+                .with_columns(
+                    pl.lit(value).alias(col) for col, value in zip(columns, partition)
+                )
+                .to_arrow(),
+                mode="append",
+                partition_by=columns or None,
+            )
+    return DeltaTable(table_path)
+
+
+def test_get_target_size(tmp_path):
+    table = create_table(str(tmp_path / "table"), {("2024-04-20",): 1})
+    assert get_target_size(table) == 256 * 1024 * 1024
+    assert get_target_size(table, 64) == 64 * 1024 * 1024
+
+
+def test_plan_partitions_min_small_files(tmp_path):
+    table = create_table(
+        str(tmp_path / "table"), {("2024-04-20",): 3, ("2024-04-21",): 1}
+    )
+    assert plan_partitions(table, TARGET_SIZE, 2) == [[("date", "in", ["2024-04-20"])]]
+    assert plan_partitions(table, TARGET_SIZE, 4) == []
+    # Files at least the target size are not small.
+    assert plan_partitions(table, 1, 1) == []
+
+
+def test_plan_partitions_changed_within_hours(tmp_path):
+    table = create_table(str(tmp_path / "table"), {("2024-04-20",): 2})
+    assert plan_partitions(table, TARGET_SIZE, 2, changed_within_hours=1) == [
+        [("date", "in", ["2024-04-20"])]
+    ]
+    assert plan_partitions(table, TARGET_SIZE, 2, changed_within_hours=0) == []
+
+
+def test_plan_partitions_max_partitions(tmp_path):
+    table = create_table(
+        str(tmp_path / "table"),
+        {("2024-04-20",): 2, ("2024-04-21",): 4, ("2024-04-22",): 3},
+    )
+    assert plan_partitions(table, TARGET_SIZE, 2, max_partitions=2) == [
+        [("date", "in", ["2024-04-21", "2024-04-22"])]
+    ]
+
+
+def test_plan_partitions_multiple_columns(tmp_path):
+    table = create_table(
+        str(tmp_path / "table"),
+        {("2024-04-20", "3"): 3, ("2024-04-20", "4"): 2, ("2024-04-21", "3"): 1},
+    )
+    assert plan_partitions(table, TARGET_SIZE, 2) == [
+        [("date", "=", "2024-04-20"), ("line", "=", "3")],
+        [("date", "=", "2024-04-20"), ("line", "=", "4")],
+    ]
+
+
+def test_plan_partitions_unpartitioned(tmp_path):
+    table = create_table(str(tmp_path / "table"), {(): 2})
+    assert plan_partitions(table, TARGET_SIZE, 2) is None
+    assert plan_partitions(table, TARGET_SIZE, 3) == []
@@ -0,0 +1,41 @@
+import duckdb
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pipeline.connections import close_pool, connect, enable_pool
+from pipeline.run import read_env_file
+
+
+def test_connection_pool(tmp_path):
+    db_path = str(tmp_path / "test.duckdb")
+    enable_pool()
+    try:
+        with connect(db_path) as db:
+            db.sql("CREATE TABLE t AS SELECT 1 AS x")
+        # Read-only connections share the pooled connection of the file.
+        with connect(db_path, read_only=True) as db:
+            assert db.sql("FROM t").fetchall() == [(1,)]
+        with connect(os.path.join(str(tmp_path), ".", "test.duckdb")) as db:
+            db.sql("INSERT INTO t VALUES (2)")
+    finally:
+        close_pool()
+
+    # The file can be opened with another configuration once the pool is closed.
+    with duckdb.connect(db_path, read_only=True) as db:
+        assert db.sql("FROM t ORDER BY x").fetchall() == [(1,), (2,)]
+    with connect(db_path, read_only=True) as db:
+        assert db.sql("SELECT COUNT(*) FROM t").fetchall() == [(2,)]
+
+
+def test_read_env_file(tmp_path):
+    env_file = tmp_path / "env"
+    env_file.write_text(
+        '# Comment\n\nSOURCE_DB=cleaned.duckdb\nTARGET_DIR="/data/gold"\nQUERY=a=b\n'
+    )
+    assert read_env_file(str(env_file)) == {
+        "SOURCE_DB": "cleaned.duckdb",
+        "TARGET_DIR": "/data/gold",
+        "QUERY": "a=b",
+    }
@@ -0,0 +1,164 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from db_operations.functions import TARGET_TABLE_PK
+from db_operations.storage import get_storage, STORAGE_BACKENDS
+from utils.transformations import (
+    transform_bus_data,
+    split_nulls,
+    split_duplicates,
+    quarantine_sample,
+)
+from test_transformations import df_test
+import duckdb
+import polars as pl
+import pytest
+from deltalake import DeltaTable, write_deltalake
+
+PK_COLS = TARGET_TABLE_PK.split(", ")
+
+
+def silver_rows() -> tuple[pl.DataFrame, pl.DataFrame]:
+    new_df, null_df = split_nulls(transform_bus_data(df_test))
+    new_df, duplicate_df = split_duplicates(new_df, PK_COLS)
+    quarantine = quarantine_sample(
+        {"null": null_df, "duplicate": duplicate_df}, max_rows=10
+    )
+    return new_df, quarantine
+
+
+def get_test_storage(backend: str, tmp_path):
+    db_path = os.path.join(
+        tmp_path, "cleaned.duckdb" if backend == "duckdb" else "cleaned"
+    )
+    return get_storage(
+        backend=backend, db_path=db_path, schema="silver", table="journeys_data"
+    )
+
+
+@pytest.mark.parametrize("backend", STORAGE_BACKENDS)
+def test_storage_insert(tmp_path, backend):
+    storage = get_test_storage(backend, tmp_path)
+    new_df, quarantine = silver_rows()
+    storage.create_tables()
+    assert storage.get_last_load(reset_tables=False) == "0"
+
+    counts = storage.insert_new_data(
+        df=new_df, checkpoint="1", reset_tables=False, quarantine=quarantine
+    )
+    assert counts == (3, 0, 0)
+    # Rows with a primary key that is already in the table are skipped.
+    counts = storage.insert_new_data(df=new_df, checkpoint="2", reset_tables=False)
+    assert counts == (0, 0, 3)
+
+    assert storage.get_last_load(reset_tables=False) == "2"
+    assert storage.get_last_load(reset_tables=True) == "0"
+    silver = storage.read_table().drop("update_time").sort(PK_COLS)
+    assert silver.equals(new_df.drop("update_time").sort(PK_COLS))
+    loads = storage.read_table("loads").sort("load_id")
+    assert loads.rows() == [("1", 3, 3, 0, 0), ("2", 0, 0, 0, 3)]
+    quarantine = storage.read_table("quarantine").sort("line")
+    assert quarantine.select("load_id", "reason", "line").rows() == [
+        ("1", "null", "15B"),
+        ("1", "null", "3A"),
+        ("1", "duplicate", "70"),
+    ]
+
+    storage.insert_new_data(df=new_df.head(1), checkpoint="3", reset_tables=True)
+    assert len(storage.read_table()) == 1
+    assert storage.read_table("loads").rows() == [("3", 1, 1, 0, 0)]
+    assert len(storage.read_table("quarantine")) == 0
+    assert storage.size_bytes() > 0
+
+
+def test_delta_storage_reset_failure(tmp_path, monkeypatch):
+    storage = get_test_storage("delta", tmp_path)
+    new_df, quarantine = silver_rows()
+    storage.create_tables()
+    storage.insert_new_data(df=new_df, checkpoint="1", reset_tables=False)
+
+    # The run fails after the silver table is reset but before the checkpoint.
+    write = storage.write
+
+    def failing_write(table, *args, **kwargs):
+        if table == "quarantine":
+            raise Exception("Simulated failure")
+        write(table, *args, **kwargs)
+
+    monkeypatch.setattr(storage, "write", failing_write)
+    with pytest.raises(Exception, match="Simulated failure"):
+        storage.insert_new_data(
+            df=new_df.head(1), checkpoint="2", reset_tables=True, quarantine=quarantine
+        )
+    assert len(storage.read_table()) == 1
+    # The next run starts from the first load, not from the old checkpoint.
+    assert storage.get_last_load(reset_tables=False) == "0"
+
+
+@pytest.mark.parametrize("backend", STORAGE_BACKENDS)
+def test_storage_upsert(tmp_path, backend):
+    storage = get_test_storage(backend, tmp_path)
+    new_df, _ = silver_rows()
+    storage.create_tables()
+    storage.insert_new_data(df=new_df, checkpoint="1", reset_tables=False)
+
+    # A late correction of the delay of the first row, an unchanged row and a new row.
+    later_df = pl.concat(
+        [
+            new_df.head(1).with_columns(delay=pl.col("delay") + 60),
+            new_df.slice(1, 1),
+            new_df.slice(2, 1).with_columns(line=pl.lit("99")),
+        ]
+    )
+    counts = storage.insert_new_data(df=later_df, checkpoint="2", reset_tables=False)
+    assert counts == (1, 0, 2)
+    assert len(storage.read_table()) == 4
+    counts = storage.insert_new_data(
+        df=later_df, checkpoint="3", reset_tables=False, update=True
+    )
+    assert counts == (0, 1, 2)
+
+    silver = storage.read_table().drop("update_time").sort(PK_COLS)
+    expected = pl.concat([later_df, new_df.slice(2, 1)]).drop("update_time")
+    assert silver.equals(expected.sort(PK_COLS))
+    loads = storage.read_table("loads").sort("load_id")
+    assert loads["loaded_rows"].to_list() == [3, 1, 1]
+
+
+def test_storage_backends_have_same_schema(tmp_path):
+    new_df, _ = silver_rows()
+    schemas = []
+    for backend in STORAGE_BACKENDS:
+        storage = get_test_storage(backend, tmp_path)
+        storage.create_tables()
+        storage.insert_new_data(df=new_df, checkpoint="1", reset_tables=False)
+        schemas.append(storage.read_table().drop("update_time").schema)
+    assert schemas[0] == schemas[1]
+
+
+@pytest.mark.parametrize("backend", STORAGE_BACKENDS)
+def test_storage_adds_columns_to_old_tables(tmp_path, backend):
+    new_df, _ = silver_rows()
+    storage = get_test_storage(backend, tmp_path)
+    storage.create_tables()
+    storage.insert_new_data(df=new_df, checkpoint="1", reset_tables=False)
+    # Tables created before origin_day_offset was added.
+    if backend == "duckdb":
+        with duckdb.connect(storage.db_path) as db:
+            db.sql("ALTER TABLE silver.journeys_data DROP COLUMN origin_day_offset")
+    else:
+        path = storage.table_path(storage.table)
+        write_deltalake(
+            path,
+            DeltaTable(path).to_pyarrow_table().drop(["origin_day_offset"]),
+            mode="overwrite",
+            schema_mode="overwrite",
+            partition_by=["date"],
+        )
+
+    storage.create_tables()
+    df = storage.read_table()
+    assert len(df) == len(new_df)
+    assert df["origin_day_offset"].to_list() == [0] * len(new_df)
@@ -0,0 +1,113 @@
+import datetime
+import os
+import sys
+import polars as pl
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "gold"))
+
+from delta_operations.functions import merge
+from delta_operations.trajectories import (
+    trajectory_rows,
+    update_trajectories,
+    vehicles_near,
+    with_grid_cell,
+    CELL_BITS,
+    TRAJECTORY_SOURCE_COLUMNS,
+)
+from test_aggregates import gold_rows
+
+SECOND = 1_000_000
+
+
+def journey(
+    vehicle: str, seconds: list[int], latitudes: list[float], day: int = 20
+) -> pl.DataFrame:
+    n = len(seconds)
+    return gold_rows([0] * n, [0] * n).with_columns(
+        date=pl.lit(datetime.date(2024, 4, day)),
+        time=pl.Series([s * SECOND for s in seconds]),
+        vehicle=pl.lit(vehicle),
+        latitude=pl.Series(latitudes),
+        origin_aimed_departure_time=pl.lit(int(vehicle[-1]) * 60 * SECOND),
+    )
+
+
+def test_grid_cell():
+    df = with_grid_cell(
+        pl.DataFrame({"longitude": [23.76, -179.9, 179.9], "latitude": [61.5, 0, 0]})
+    )
+    cells = 2**CELL_BITS
+    x = int((23.76 + 180) * cells / 360)
+    y = int((61.5 + 90) * cells / 180)
+    expected = 0
+    for i in range(CELL_BITS):
+        expected |= ((x >> i) & 1) << (2 * i + 1) | ((y >> i) & 1) << (2 * i)
+    assert df["cell"][0] == expected
+    assert df["cell"][1] < df["cell"][2]
+
+
+def test_trajectory_rows():
+    # 0.001 degrees of latitude north every 10 s, then 20 s in place.
+    df = trajectory_rows(
+        pl.concat(
+            [
+                journey("TKL_001", [0, 10, 20, 40], [61.5, 61.501, 61.502, 61.502]),
+                # Same departure on the next day starts a new trajectory.
+                journey("TKL_001", [0], [61.5], day=21),
+            ]
+        )
+    ).sort("date", "time")
+    assert df["step_seconds"].to_list() == [None, 10.0, 10.0, 20.0, None]
+    assert [round(d) for d in df["step_distance"].to_list()[1:4]] == [111, 111, 0]
+    assert [round(h) for h in df["heading"].to_list()[1:3]] == [0, 0]
+    assert df["heading"][3] is None
+    assert df["dwell_seconds"].to_list() == [None, 0.0, 0.0, 20.0, None]
+
+
+def test_update_trajectories(tmp_path):
+    fact_path = str(tmp_path / "journeys_data")
+    trajectory_path = str(tmp_path / "trajectories")
+    first = pl.concat(
+        [
+            journey("TKL_001", [86_000, 86_390], [61.5, 61.501]),
+            journey("TKL_002", [0, 10], [61.6, 61.601]),
+        ]
+    )
+    # Continues the journey of TKL_001 past midnight and corrects a position of TKL_002.
+    second = pl.concat(
+        [
+            journey("TKL_001", [10], [61.502], day=21),
+            journey("TKL_002", [10], [61.602]),
+        ]
+    )
+
+    assert update_trajectories(first, fact_path, trajectory_path) == 2
+    merge(first, fact_path)
+    assert update_trajectories(second, fact_path, trajectory_path) == 2
+    merge(second, fact_path)
+
+    full = trajectory_rows(pl.read_delta(fact_path).select(TRAJECTORY_SOURCE_COLUMNS))
+    trajectories = pl.read_delta(trajectory_path).select(full.columns)
+    assert trajectories.sort("date", "time").equals(full.sort("date", "time"))
+    assert trajectories.filter(date=datetime.date(2024, 4, 21))["step_seconds"][0] == 20
+
+
+def test_vehicles_near(tmp_path):
+    trajectory_path = str(tmp_path / "trajectories")
+    rows = pl.concat(
+        [
+            journey("TKL_001", [0, 10, 20], [61.5, 61.501, 61.502]),
+            journey("TKL_002", [0, 10], [61.6, 61.601]),
+        ]
+    )
+    update_trajectories(rows, str(tmp_path / "journeys_data"), trajectory_path)
+
+    start = datetime.datetime(2024, 4, 20)
+    near = vehicles_near(
+        trajectory_path, 23.69, 61.5011, 50, start, start + datetime.timedelta(hours=1)
+    )
+    assert near["vehicle"].to_list() == ["TKL_001"]
+    assert near["time"].to_list() == [10 * SECOND]
+    assert round(near["distance"][0]) == 11
+    # Outside the time range.
+    assert len(vehicles_near(trajectory_path, 23.69, 61.5011, 50, start, start)) == 0
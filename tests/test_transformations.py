@@ -1,4 +1,15 @@
-from utils.transformations import transform_bus_data, drop_nulls, deduplicate
+from utils.transformations import (
+    transform_bus_data,
+    drop_nulls,
+    deduplicate,
+    split_nulls,
+    split_duplicates,
+    quarantine_sample,
+    clean_bus_data_lazy,
+    clean_bus_data,
+    count_departure_errors,
+    BRONZE_COLUMNS,
+)
 import polars as pl
 import datetime
 
@@ -180,6 +191,12 @@ schema = {
 }
 
 df_test = pl.DataFrame(data=data, schema=schema)
+# A journey of the previous service day that departs at 00:05.
+df_past_midnight = df_test.slice(3, 1).with_columns(
+    pl.lit("1N").alias("monitored_vehicle_journey__line_ref"),
+    pl.lit("2405").alias("monitored_vehicle_journey__origin_aimed_departure_time"),
+    pl.lit("pmPGkQanjz8xNN").alias("_dlt_id"),
+)
 df_transform_bus_data = transform_bus_data(df_test)
 df_drop_nulls = drop_nulls(df_transform_bus_data)
 df_deduplicate = deduplicate(
@@ -202,6 +219,7 @@ def test_transform_bus_data():
         "latitude",
         "speed",
         "origin_aimed_departure_time",
+        "origin_day_offset",
         "delay",
         "update_time",
     ]
@@ -219,6 +237,7 @@ def test_transform_bus_data():
         pl.Float64,
         pl.Float32,
         pl.Time,
+        pl.Int8,
         pl.Int64,
         pl.Datetime,
     ]
@@ -236,6 +255,7 @@ def test_transform_bus_data():
         61.5267588,
         10.0,
         datetime.time(22, 40),
+        0,
         -200,
     )
     assert df_transform_bus_data.row(1)[:-1] == (
@@ -252,14 +272,74 @@ def test_transform_bus_data():
         60.5267588,
         21.0,
         datetime.time(21, 40),
+        0,
         621,
     )
+    assert df_transform_bus_data.row(3)[12:14] == (datetime.time(20, 5), 0)
     assert len(df_transform_bus_data) == 6
 
 
+def test_transform_bus_data_past_midnight():
+    df = transform_bus_data(df_past_midnight)
+    # Departures past midnight belong to the service day before.
+    assert df.row(0)[12:14] == (datetime.time(0, 5), 1)
+
+
 def test_drop_nulls():
     assert len(df_drop_nulls) == 4
 
 
 def test_deduplicate():
     assert len(df_deduplicate) == 3
+
+
+def test_split_nulls():
+    df_kept, df_rejected = split_nulls(df_transform_bus_data)
+    assert df_kept.equals(df_drop_nulls)
+    assert len(df_rejected) == 2
+    assert df_rejected["line"].to_list() == ["3A", "15B"]
+
+
+def test_split_duplicates():
+    pk_cols = ["date", "time", "line", "direction", "origin_aimed_departure_time"]
+    df_kept, df_rejected = split_duplicates(df_drop_nulls, pk_cols)
+    assert df_kept.equals(df_deduplicate)
+    assert len(df_rejected) == 1
+    assert df_rejected["line"].to_list() == ["70"]
+
+
+def test_quarantine_sample():
+    df_nulls = split_nulls(df_transform_bus_data)[1]
+    df_quarantine = quarantine_sample(
+        {"null": df_nulls, "duplicate": df_nulls.clear()}, max_rows=1
+    )
+    assert len(df_quarantine) == 1
+    assert df_quarantine["reason"].to_list() == ["null"]
+    assert quarantine_sample({"null": df_nulls.clear()}, max_rows=1) is None
+
+
+def test_clean_bus_data_lazy():
+    pk_cols = ["date", "time", "line", "direction", "origin_aimed_departure_time"]
+    df_lazy = clean_bus_data_lazy(df_test.lazy(), pk_cols).collect()
+    assert df_lazy.drop("update_time").equals(df_deduplicate.drop("update_time"))
+
+    df_clean, not_null_rows = clean_bus_data(
+        df_test.select(BRONZE_COLUMNS), pk_cols, streaming=True
+    )
+    assert df_clean.drop("update_time").equals(df_deduplicate.drop("update_time"))
+    assert not_null_rows == len(df_drop_nulls)
+    assert clean_bus_data(df_test.clear(), pk_cols)[1] == 0
+
+
+def test_count_departure_errors():
+    assert count_departure_errors(df_test) == 0
+    malformed = df_test.with_columns(
+        pl.Series(
+            "monitored_vehicle_journey__origin_aimed_departure_time",
+            ["2240", "4800", None, "9:05", "1234", "1234"],
+        )
+    )
+    assert count_departure_errors(malformed) == 2
+    assert (
+        transform_bus_data(malformed)["origin_aimed_departure_time"].null_count() == 3
+    )
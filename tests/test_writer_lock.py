@@ -0,0 +1,23 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bronze"))
+
+from writer_lock import acquire_lock, backoff, release_lock
+
+
+def test_writer_lock_is_exclusive(tmp_path):
+    path = str(tmp_path / "ingest_pipe.duckdb.lock")
+    lock = acquire_lock(path)
+    assert lock is not None
+    assert acquire_lock(path) is None
+    release_lock(lock)
+
+    lock = acquire_lock(path)
+    assert lock is not None
+    release_lock(lock)
+
+
+def test_backoff():
+    for attempt in range(10):
+        assert 0 <= backoff(attempt, base=0.1, cap=5.0) <= min(5.0, 0.1 * 2**attempt)